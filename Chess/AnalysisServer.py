@@ -0,0 +1,561 @@
+"""Local HTTP/JSON analysis service: serves index.html and the API it plays through.
+
+    python -m Chess server serve --port 8000          # then open http://127.0.0.1:8000/
+    python -m Chess server bench --clients 50         # in-process server plus local clients
+
+Endpoints (moves are UCI strings such as e2e4 or e7e8q; bodies are JSON):
+
+    GET  /                              index.html (piece images under /assets/)
+    GET  /api/moves?fen=...&moves=e2e4,e7e5   legal moves of a position
+    POST /api/games         {"fen"?, "moves"?}      new game, returns its status and id
+    GET  /api/games/<id>                            status: FEN, moves, legal moves, check, mate, draws
+    POST /api/games/<id>/move   {"move": "e2e4"}
+    POST /api/games/<id>/undo
+    GET  /api/games/<id>/analysis?depth=3&movetime=0.5
+    POST /api/analyze       {"fen"?, "moves"?, "depth"?, "movetime"?}
+    GET  /api/metrics                               latency, throughput, queue and merge counters
+
+Everything runs on one asyncio event loop except analysis, which goes to a process
+pool whose workers each keep a GameState and an Analyzer warm, like BatchAnalysis.
+A job is keyed by the position's GameState.snapshot() and its limits, so clients
+asking for the same analysis while it is running all wait on the one job. At most
+--max-queued distinct jobs are in flight; beyond that requests are shed with 503 and
+Retry-After rather than queued without bound. Analysis scores are centipawns from
+White's point of view, as in AnalysisWorker.
+
+Games live in memory, the least recently used being dropped beyond MAX_GAMES. The
+server binds to 127.0.0.1 by default and has no authentication.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import secrets
+import sys
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from .Analyzer import Analyzer
+from .ChessEngine import START_FEN, GameState
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_PATH = os.path.join(os.path.dirname(BASE_DIR), "index.html")
+ASSETS_DIR = os.path.join(BASE_DIR, "assests")
+ASSET_PATTERN = re.compile(r"^/assets/([wb][pNBRQK])\.png$")
+
+DEFAULT_DEPTH = 3
+MAX_DEPTH = 6
+MAX_MOVETIME = 10.0  # seconds
+MAX_GAMES = 1000
+MAX_BODY_BYTES = 64 * 1024
+MAX_HEADER_LINES = 100
+IDLE_TIMEOUT = 30.0  # seconds a keep-alive connection may wait for its next request
+LATENCY_WINDOW = 1000  # latest requests per route kept for the percentiles
+THROUGHPUT_SECONDS = 10.0  # window of the recent requests/s figure
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+# Per-process state, created by _initWorker
+_workerState = None
+_workerAnalyzer = None
+
+
+def _initWorker(backend):
+    global _workerState, _workerAnalyzer
+    _workerState = GameState(backend)
+    _workerAnalyzer = Analyzer()
+
+
+def _analyzeSnapshot(snapshot, depth, timeLimit):
+    """Worker side: analyses the position of a GameState.snapshot()."""
+    gs = _workerState
+    gs.restore(snapshot)
+    result = _workerAnalyzer.analyze(gs, depth, timeLimit)
+    sign = 1 if gs.whiteToMove else -1
+    return {"bestMove": result.bestMove.getChessNotation() if result.bestMove else None,
+            "score": sign * result.score, "pv": [move.getChessNotation() for move in result.pv],
+            "depth": result.iterations[-1]["depth"] if result.iterations else 0, "nodes": result.nodes,
+            "seconds": round(result.seconds, 4)}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Request():
+    def __init__(self, method, path, query, headers, body, keepAlive):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.keepAlive = keepAlive
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, "body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "body must be a JSON object")
+        return data
+
+
+async def readRequest(reader):
+    """Parses one HTTP/1.1 request from reader; None when the client closed the connection."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADER_LINES:
+            raise HttpError(400, "too many headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise HttpError(400, "invalid Content-Length")
+    if length < 0 or length > MAX_BODY_BYTES:
+        raise HttpError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    parts = urlsplit(target)
+    query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+    connection = headers.get("connection", "").lower()
+    keepAlive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return Request(method.upper(), parts.path, query, headers, body, keepAlive)
+
+
+def encodeResponse(status, body, contentType="application/json", headers=None, keepAlive=True):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Unknown')}", f"Content-Type: {contentType}",
+             f"Content-Length: {len(body)}", "Connection: " + ("keep-alive" if keepAlive else "close")]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Metrics():
+    """Request counts, status codes and latency percentiles per route, plus throughput."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.recent = deque()  # completion times within THROUGHPUT_SECONDS
+        self.jobs = 0
+        self.merged = 0
+        self.shed = 0
+
+    def record(self, route, status, seconds):
+        now = time.monotonic()
+        self.requests[route] += 1
+        self.statuses[status] += 1
+        self.latencies[route].append(seconds)
+        self.recent.append(now)
+        while self.recent[0] < now - THROUGHPUT_SECONDS:
+            self.recent.popleft()
+
+    def report(self):
+        now = time.monotonic()
+        while self.recent and self.recent[0] < now - THROUGHPUT_SECONDS:
+            self.recent.popleft()
+        uptime = now - self.started
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            routes[route] = {"requests": self.requests[route],
+                             **{name: round(_percentile(ordered, fraction) * 1000, 2)
+                                for name, fraction in (("p50Ms", 0.5), ("p95Ms", 0.95), ("p99Ms", 0.99))},
+                             "maxMs": round(ordered[-1] * 1000, 2)}
+        total = sum(self.requests.values())
+        return {"uptimeSeconds": round(uptime, 1), "requests": total,
+                "requestsPerSecond": round(total / uptime, 1) if uptime else 0.0,
+                "recentRequestsPerSecond": round(len(self.recent) / min(uptime, THROUGHPUT_SECONDS), 1) if uptime else 0.0,
+                "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+                "analysis": {"jobs": self.jobs, "merged": self.merged, "shed": self.shed},
+                "routes": routes}
+
+
+def _findMove(gs, text):
+    return next((move for move in gs.getValidMoves() if move.getChessNotation() == text), None)
+
+
+def _playMoves(gs, moves):
+    if isinstance(moves, str):
+        moves = moves.replace(",", " ").split()
+    if not isinstance(moves, list):
+        raise HttpError(400, "moves must be a list of UCI moves")
+    for text in moves:
+        move = _findMove(gs, text) if isinstance(text, str) else None
+        if move is None:
+            raise HttpError(400, f"illegal move: {text}")
+        gs.makeMove(move)
+
+
+def _setUp(gs, fen, moves):
+    try:
+        gs.loadFen(fen or START_FEN)
+    except (ValueError, KeyError, IndexError, AttributeError, TypeError):
+        raise HttpError(400, f"invalid FEN: {fen}")
+    # loadFen insists on one king per side; the side that just moved must not be left in check
+    kingRow, kingCol = gs.blackKingLocation if gs.whiteToMove else gs.whiteKingLocation
+    if gs.isSquareAttacked(kingRow, kingCol, "w" if gs.whiteToMove else "b"):
+        raise HttpError(400, f"invalid FEN, the side not to move is in check: {fen}")
+    _playMoves(gs, moves or [])
+
+
+def _limits(values):
+    """(depth, movetime) from a query or JSON body, clamped to MAX_DEPTH and MAX_MOVETIME."""
+    try:
+        depth = int(values["depth"]) if values.get("depth") is not None else None
+        movetime = float(values["movetime"]) if values.get("movetime") is not None else None
+    except (TypeError, ValueError):
+        raise HttpError(400, "depth must be an integer and movetime a number of seconds")
+    if depth is None and movetime is None:
+        depth = DEFAULT_DEPTH
+    if depth is not None:
+        depth = max(1, min(depth, MAX_DEPTH))
+    if movetime is not None:
+        movetime = max(0.01, min(movetime, MAX_MOVETIME))
+    return depth, movetime
+
+
+def gameStatus(gs):
+    moves = gs.getValidMoves()
+    return {"fen": gs.getFen(), "whiteToMove": gs.whiteToMove,
+            "moves": [move.getChessNotation() for move in gs.moveLog],
+            "legalMoves": [move.getChessNotation() for move in moves], "inCheck": gs.inCheck(),
+            "checkMate": gs.checkMate, "staleMate": gs.staleMate, "repetitionDraw": gs.repetitionDraw,
+            "fiftyMoveDraw": gs.fiftyMoveDraw, "fivefoldRepetition": gs.fivefoldRepetition,
+            "seventyFiveMoveDraw": gs.seventyFiveMoveDraw}
+
+
+class AnalysisServer():
+    def __init__(self, workers=None, maxQueued=None, backend="list"):
+        self.workers = workers or os.cpu_count() or 1
+        self.maxQueued = maxQueued or 4 * self.workers
+        self.backend = backend
+        self.pool = None
+        self.server = None
+        self.games = OrderedDict()  # id -> GameState, least recently used first
+        self.scratch = GameState(backend)  # for requests that describe a position by FEN and moves
+        self.inflight = {}  # (snapshot, depth, movetime) -> future of the analysis job
+        self.connections = set()  # open connections' writers, closed by close()
+        self.metrics = Metrics()
+        self.routes = [
+            ("GET", re.compile(r"^/$"), "GET /", self.index),
+            ("GET", ASSET_PATTERN, "GET /assets", self.asset),
+            ("GET", re.compile(r"^/api/moves$"), "GET /api/moves", self.legalMoves),
+            ("POST", re.compile(r"^/api/games$"), "POST /api/games", self.newGame),
+            ("GET", re.compile(r"^/api/games/([\w-]+)$"), "GET /api/games/{id}", self.status),
+            ("POST", re.compile(r"^/api/games/([\w-]+)/move$"), "POST /api/games/{id}/move", self.move),
+            ("POST", re.compile(r"^/api/games/([\w-]+)/undo$"), "POST /api/games/{id}/undo", self.undo),
+            ("GET", re.compile(r"^/api/games/([\w-]+)/analysis$"), "GET /api/games/{id}/analysis", self.gameAnalysis),
+            ("POST", re.compile(r"^/api/analyze$"), "POST /api/analyze", self.analyzePosition),
+            ("GET", re.compile(r"^/api/metrics$"), "GET /api/metrics", self.metricsReport),
+        ]
+
+    async def start(self, host="127.0.0.1", port=8000):
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_initWorker, initargs=(self.backend,))
+        self.server = await asyncio.start_server(self.handleConnection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.connections):
+            writer.close()
+        while self.connections:  # each handler sees end of input and returns
+            await asyncio.sleep(0.01)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    async def handleConnection(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(readRequest(reader), IDLE_TIMEOUT)
+                except HttpError as error:
+                    writer.write(encodeResponse(error.status, json.dumps({"error": str(error)}).encode(),
+                                                keepAlive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                start = time.perf_counter()
+                route, status, body, contentType, headers = await self.dispatch(request)
+                writer.write(encodeResponse(status, body, contentType, headers, request.keepAlive))
+                await writer.drain()
+                self.metrics.record(route, status, time.perf_counter() - start)
+                if not request.keepAlive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def dispatch(self, request):
+        """(route, status, body, content type, headers) for a request."""
+        allowed = False
+        for method, pattern, route, handler in self.routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            try:
+                result = await handler(request, *match.groups())
+            except HttpError as error:
+                return route, error.status, json.dumps({"error": str(error)}).encode(), "application/json", error.headers
+            except Exception:
+                logger.exception("%s %s failed", request.method, request.path)
+                return route, 500, json.dumps({"error": STATUS_TEXT[500]}).encode(), "application/json", None
+            if isinstance(result, tuple):  # (content type, bytes) for static files
+                return route, 200, result[1], result[0], None
+            status = 201 if route == "POST /api/games" else 200
+            return route, status, json.dumps(result).encode(), "application/json", None
+        status = 405 if allowed else 404
+        return "other", status, json.dumps({"error": STATUS_TEXT[status]}).encode(), "application/json", None
+
+    # ------------------------------------------------------------------
+    # Handlers
+    # ------------------------------------------------------------------
+
+    async def index(self, request):
+        with open(INDEX_PATH, "rb") as f:
+            return "text/html; charset=utf-8", f.read()
+
+    async def asset(self, request, piece):
+        with open(os.path.join(ASSETS_DIR, piece + ".png"), "rb") as f:
+            return "image/png", f.read()
+
+    async def legalMoves(self, request):
+        _setUp(self.scratch, request.query.get("fen"), request.query.get("moves"))
+        return gameStatus(self.scratch)
+
+    def _game(self, gameId):
+        gs = self.games.get(gameId)
+        if gs is None:
+            raise HttpError(404, f"no game {gameId}")
+        self.games.move_to_end(gameId)
+        return gs
+
+    async def newGame(self, request):
+        data = request.json()
+        gs = GameState(self.backend)
+        _setUp(gs, data.get("fen"), data.get("moves"))
+        gameId = secrets.token_urlsafe(9)
+        self.games[gameId] = gs
+        if len(self.games) > MAX_GAMES:
+            self.games.popitem(last=False)
+        return {"id": gameId, **gameStatus(gs)}
+
+    async def status(self, request, gameId):
+        return {"id": gameId, **gameStatus(self._game(gameId))}
+
+    async def move(self, request, gameId):
+        gs = self._game(gameId)
+        text = request.json().get("move")
+        move = _findMove(gs, text) if isinstance(text, str) else None
+        if move is None:
+            raise HttpError(400, f"illegal move: {text}")
+        gs.makeMove(move)
+        return {"id": gameId, **gameStatus(gs)}
+
+    async def undo(self, request, gameId):
+        gs = self._game(gameId)
+        gs.undoMove()
+        return {"id": gameId, **gameStatus(gs)}
+
+    async def gameAnalysis(self, request, gameId):
+        depth, movetime = _limits(request.query)
+        return await self.analyze(self._game(gameId), depth, movetime)
+
+    async def analyzePosition(self, request):
+        data = request.json()
+        depth, movetime = _limits(data)
+        _setUp(self.scratch, data.get("fen"), data.get("moves"))
+        return await self.analyze(self.scratch, depth, movetime)
+
+    async def metricsReport(self, request):
+        report = self.metrics.report()
+        report["analysis"].update({"inFlight": len(self.inflight), "maxQueued": self.maxQueued,
+                                   "workers": self.workers})
+        report["games"] = len(self.games)
+        return report
+
+    async def analyze(self, gs, depth, movetime):
+        """Runs an analysis job for the position of gs on the pool, joining an identical
+        job already in flight. Sheds the request when maxQueued jobs are in flight."""
+        key = (gs.snapshot(), depth, movetime)
+        future = self.inflight.get(key)
+        if future is not None:
+            self.metrics.merged += 1
+        else:
+            if len(self.inflight) >= self.maxQueued:
+                self.metrics.shed += 1
+                raise HttpError(503, "analysis queue is full", {"Retry-After": "1"})
+            self.metrics.jobs += 1
+            future = asyncio.get_running_loop().run_in_executor(self.pool, _analyzeSnapshot, key[0], depth, movetime)
+            self.inflight[key] = future
+            future.add_done_callback(lambda done: self.inflight.pop(key, None))
+        # shield: a client that disconnects must not cancel the job for the others
+        return await asyncio.shield(future)
+
+
+# ----------------------------------------------------------------------
+# Local client and load test
+# ----------------------------------------------------------------------
+
+class Client():
+    """Minimal keep-alive HTTP client for the JSON API, for tests and the benchmark."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, data=None):
+        """(status, decoded JSON body)."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(data).encode() if data is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n\r\n"
+                          .encode() + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        payload = await self.reader.readexactly(length)
+        return status, json.loads(payload) if payload[:1] in (b"{", b"[") else payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+
+async def _retrying(client, method, path, data=None, retryDelay=1.0):
+    """Repeats a request shed with 503 after retryDelay seconds, as Retry-After asks."""
+    while True:
+        status, body = await client.request(method, path, data)
+        if status != 503:
+            return status, body
+        await asyncio.sleep(retryDelay)
+
+
+async def _playClient(host, port, seed, plies, depth):
+    """One simulated browser: a game of random moves, asking for analysis after each."""
+    import random
+    rng = random.Random(seed)
+    client = Client(host, port)
+    try:
+        status, game = await client.request("POST", "/api/games", {})
+        for ply in range(plies):
+            if not game["legalMoves"]:
+                break
+            status, game = await client.request("POST", f"/api/games/{game['id']}/move",
+                                                {"move": rng.choice(game["legalMoves"])})
+            await _retrying(client, "GET", f"/api/games/{game['id']}/analysis?depth={depth}")
+        await client.request("POST", f"/api/games/{game['id']}/undo")
+        # Every client also asks about the same opening position, as page loads do
+        await _retrying(client, "POST", "/api/analyze", {"moves": ["e2e4", "e7e5"], "depth": depth})
+    finally:
+        await client.close()
+
+
+async def _benchmark(clients, plies, depth, workers, maxQueued, backend):
+    server = AnalysisServer(workers, maxQueued, backend)
+    host, port = await server.start("127.0.0.1", 0)
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(_playClient(host, port, seed, plies, depth) for seed in range(clients)))
+        seconds = time.perf_counter() - start
+        client = Client(host, port)
+        status, report = await client.request("GET", "/api/metrics")
+        await client.close()
+    finally:
+        await server.close()
+    report["benchmarkSeconds"] = round(seconds, 2)
+    report["analysesPerSecond"] = round(clients * (plies + 1) / seconds, 1)
+    return report
+
+
+def benchmark(clients=20, plies=6, depth=2, workers=None, maxQueued=None, backend="list"):
+    """Runs an in-process server against `clients` concurrent local clients and
+    returns its metrics report."""
+    return asyncio.run(_benchmark(clients, plies, depth, workers, maxQueued, backend))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON analysis service for index.html")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    parser.add_argument("--workers", type=int, help="analysis processes (default: all cores)")
+    parser.add_argument("--max-queued", type=int, help="analysis jobs in flight before shedding (default: 4 per worker)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serveParser = sub.add_parser("serve", help="serve index.html and the API")
+    serveParser.add_argument("--host", default="127.0.0.1")
+    serveParser.add_argument("--port", type=int, default=8000)
+    benchParser = sub.add_parser("bench", help="load-test an in-process server with local clients")
+    benchParser.add_argument("--clients", type=int, default=20)
+    benchParser.add_argument("--plies", type=int, default=6, help="moves each client plays")
+    benchParser.add_argument("--depth", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        report = benchmark(args.clients, args.plies, args.depth, args.workers, args.max_queued, args.backend)
+        print(json.dumps(report, indent=2))
+        return 0
+
+    async def serve():
+        server = AnalysisServer(args.workers, args.max_queued, args.backend)
+        host, port = await server.start(args.host, args.port)
+        print(f"Serving on http://{host}:{port}/", file=sys.stderr)
+        try:
+            await server.server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Background analysis for the GUI, in its own process so searching never competes
+with the event loop for the GIL.
+
+    worker = AnalysisWorker()
+    worker.submit(gs)                  # after every move, undo, redo or reset
+    for message in worker.poll():      # never blocks; only results for the latest submit
+        ...
+    worker.close()
+
+submit() sends the position's GameState.snapshot() (a couple of hundred bytes, with the
+hashes repetition detection needs) and returns at once. Submitting again cancels the job in progress: the
+search polls a shared job counter and unwinds as soon as it is out of date, and
+queued snapshots that were overtaken are skipped. Results stream back as dicts:
+
+    {"job": n, "kind": "position", "moves": [packed, ...], "inCheck": ..., "checkMate": ..., "staleMate": ...}
+    {"job": n, "kind": "line", "depth": d, "score": s, "pv": [packed, ...], "nodes": ...}
+    {"job": n, "kind": "done"}
+
+The position message comes first, straight after move generation; a line follows
+every completed search depth. Scores are centipawns from White's point of view
+(see Analyzer.MATE_SCORE for mates). The worker keeps one Analyzer for its whole
+life, so the transposition table stays warm from one position to the next.
+"""
+import multiprocessing
+import queue
+
+from .Analyzer import Analyzer
+from .ChessEngine import GameState
+
+ANALYSIS_SECONDS = 10.0  # longest search per position; the worker then sleeps until the next submit
+
+
+def _newestJob(jobs, job):
+    """The most recent job waiting in the queue, skipping those it overtook (None means close)."""
+    while job is not None:
+        try:
+            job = jobs.get_nowait()
+        except queue.Empty:
+            break
+    return job
+
+
+def _run(jobs, results, latest, backend, depth, timeLimit):
+    gs = GameState(backend)
+    analyzer = Analyzer()
+    while True:
+        job = _newestJob(jobs, jobs.get())
+        if job is None:
+            return
+        jobId, snapshot = job
+        if jobId != latest.value:
+            continue
+        gs.restore(snapshot)
+        moves = gs.getValidMoves()
+        results.put({"job": jobId, "kind": "position", "moves": [move.packed for move in moves],
+                     "inCheck": gs.inCheck(), "checkMate": gs.checkMate, "staleMate": gs.staleMate})
+        if moves:
+            sign = 1 if gs.whiteToMove else -1
+
+            def onIteration(iteration, pv):
+                results.put({"job": jobId, "kind": "line", "depth": iteration["depth"], "score": sign * iteration["score"],
+                             "pv": [move.packed for move in pv], "nodes": iteration["nodes"]})
+
+            analyzer.analyze(gs, depth, timeLimit, onIteration=onIteration, shouldStop=lambda: latest.value != jobId)
+        results.put({"job": jobId, "kind": "done"})
+
+
+class AnalysisWorker():
+    def __init__(self, backend="list", depth=None, timeLimit=ANALYSIS_SECONDS):
+        self.jobs = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.latest = multiprocessing.Value("q", 0, lock=False)
+        self.job = 0
+        self.busy = False
+        self.process = multiprocessing.Process(target=_run, args=(self.jobs, self.results, self.latest, backend,
+                                                                  depth, timeLimit), daemon=True)
+        self.process.start()
+
+    def submit(self, gs):
+        """Queues analysis of the current position of gs, cancelling the previous job. Returns the job id."""
+        self.job += 1
+        self.latest.value = self.job
+        self.jobs.put((self.job, gs.snapshot()))
+        self.busy = True
+        return self.job
+
+    def poll(self):
+        """Messages that have arrived for the latest job, oldest first. Results of cancelled jobs are dropped."""
+        messages = []
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return messages
+            if message["job"] == self.job:
+                messages.append(message)
+                if message["kind"] == "done":
+                    self.busy = False
+
+    def close(self):
+        self.latest.value = -1
+        self.jobs.put(None)
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,402 @@
+"""Position analysis: evaluation plus an iterative-deepening alpha-beta search.
+
+    from Chess.Analyzer import analyze
+    result = analyze(gs, depth=4)            # or time_limit=2.0 (seconds)
+    result.bestMove, result.score, result.pv, result.iterations
+
+Scores are centipawns from the point of view of the side to move. Mates are
+reported as MATE_SCORE minus the distance in plies (negative when being mated).
+The search plays moves with makeMove/undoMove(record=False), so the game's redo
+stack and draw flags are never touched.
+"""
+import time
+
+from .ChessEngine import FIFTY_MOVE_PLIES, GameState, captureOrder
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+MAX_PLY = 64
+# The clock and the stop callback are checked every (CHECK_INTERVAL_MASK + 1) nodes,
+# a few milliseconds at this engine's speed
+CHECK_INTERVAL_MASK = 255
+
+PIECE_VALUES = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+
+# Piece-square bonuses from White's side, row 0 = rank 8 (the same orientation as
+# GameState.board); Black uses the tables mirrored vertically.
+PIECE_SQUARE_BONUS = {
+    "p": ((0, 0, 0, 0, 0, 0, 0, 0),
+          (50, 50, 50, 50, 50, 50, 50, 50),
+          (10, 10, 20, 30, 30, 20, 10, 10),
+          (5, 5, 10, 25, 25, 10, 5, 5),
+          (0, 0, 0, 20, 20, 0, 0, 0),
+          (5, -5, -10, 0, 0, -10, -5, 5),
+          (5, 10, 10, -20, -20, 10, 10, 5),
+          (0, 0, 0, 0, 0, 0, 0, 0)),
+    "N": ((-50, -40, -30, -30, -30, -30, -40, -50),
+          (-40, -20, 0, 0, 0, 0, -20, -40),
+          (-30, 0, 10, 15, 15, 10, 0, -30),
+          (-30, 5, 15, 20, 20, 15, 5, -30),
+          (-30, 0, 15, 20, 20, 15, 0, -30),
+          (-30, 5, 10, 15, 15, 10, 5, -30),
+          (-40, -20, 0, 5, 5, 0, -20, -40),
+          (-50, -40, -30, -30, -30, -30, -40, -50)),
+    "B": ((-20, -10, -10, -10, -10, -10, -10, -20),
+          (-10, 0, 0, 0, 0, 0, 0, -10),
+          (-10, 0, 5, 10, 10, 5, 0, -10),
+          (-10, 5, 5, 10, 10, 5, 5, -10),
+          (-10, 0, 10, 10, 10, 10, 0, -10),
+          (-10, 10, 10, 10, 10, 10, 10, -10),
+          (-10, 5, 0, 0, 0, 0, 5, -10),
+          (-20, -10, -10, -10, -10, -10, -10, -20)),
+    "R": ((0, 0, 0, 0, 0, 0, 0, 0),
+          (5, 10, 10, 10, 10, 10, 10, 5),
+          (-5, 0, 0, 0, 0, 0, 0, -5),
+          (-5, 0, 0, 0, 0, 0, 0, -5),
+          (-5, 0, 0, 0, 0, 0, 0, -5),
+          (-5, 0, 0, 0, 0, 0, 0, -5),
+          (-5, 0, 0, 0, 0, 0, 0, -5),
+          (0, 0, 0, 5, 5, 0, 0, 0)),
+    "Q": ((-20, -10, -10, -5, -5, -10, -10, -20),
+          (-10, 0, 0, 0, 0, 0, 0, -10),
+          (-10, 0, 5, 5, 5, 5, 0, -10),
+          (-5, 0, 5, 5, 5, 5, 0, -5),
+          (0, 0, 5, 5, 5, 5, 0, -5),
+          (-10, 5, 5, 5, 5, 5, 0, -10),
+          (-10, 0, 5, 0, 0, 0, 0, -10),
+          (-20, -10, -10, -5, -5, -10, -10, -20)),
+    "K": ((-30, -40, -40, -50, -50, -40, -40, -30),
+          (-30, -40, -40, -50, -50, -40, -40, -30),
+          (-30, -40, -40, -50, -50, -40, -40, -30),
+          (-30, -40, -40, -50, -50, -40, -40, -30),
+          (-20, -30, -30, -40, -40, -30, -30, -20),
+          (-10, -20, -20, -20, -20, -20, -20, -10),
+          (20, 20, 0, 0, 0, 0, 20, 20),
+          (20, 30, 10, 0, 0, 10, 30, 20)),
+}
+
+# Material plus placement for every piece on every square, White positive
+PIECE_SQUARE_SCORES = {"--": [[0] * 8 for r in range(8)]}
+for _type, _table in PIECE_SQUARE_BONUS.items():
+    PIECE_SQUARE_SCORES["w" + _type] = [[PIECE_VALUES[_type] + _table[r][c] for c in range(8)] for r in range(8)]
+    PIECE_SQUARE_SCORES["b" + _type] = [[-(PIECE_VALUES[_type] + _table[7 - r][c]) for c in range(8)] for r in range(8)]
+
+# Transposition table entry bounds
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+
+def evaluate(gs):
+    """Static evaluation in centipawns from the side to move's point of view."""
+    score = 0
+    for r, row in enumerate(gs.board):
+        for c, piece in enumerate(row):
+            if piece != "--":
+                score += PIECE_SQUARE_SCORES[piece][r][c]
+    return score if gs.whiteToMove else -score
+
+
+def isMateScore(score):
+    return abs(score) >= MATE_SCORE - MAX_PLY * 2
+
+
+def _scoreToTable(score, ply):
+    """Mate scores count plies from the root; the table keeps them counted from the
+    node itself, so they stay right when the position is reached at another ply."""
+    if isMateScore(score):
+        return score + ply if score > 0 else score - ply
+    return score
+
+
+def _scoreFromTable(score, ply):
+    if isMateScore(score):
+        return score - ply if score > 0 else score + ply
+    return score
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionTable():
+    """Fixed-size table of search results keyed by GameState.zobristKey.
+
+    A slot is overwritten when it holds the same position, an entry from an
+    earlier search, or a shallower result (depth-preferred replacement).
+    """
+
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.entries = [None] * size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def newSearch(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, packedMove):
+        index = key % self.size
+        existing = self.entries[index]
+        if (existing is None or existing[0] == key or existing[5] != self.generation
+                or depth >= existing[1]):
+            self.entries[index] = (key, depth, score, bound, packedMove, self.generation)
+
+
+class AnalysisResult():
+    def __init__(self, bestMove, score, pv, iterations, nodes, seconds, fromBook=False, fromTablebase=False):
+        self.bestMove = bestMove
+        self.score = score
+        self.pv = pv
+        self.iterations = iterations
+        self.nodes = nodes
+        self.seconds = seconds
+        self.fromBook = fromBook
+        self.fromTablebase = fromTablebase
+
+
+class Analyzer():
+    """Negamax alpha-beta with iterative deepening, quiescence search on captures
+    and a transposition table that stays warm between analyze() calls. Given an
+    OpeningBook or Tablebases, positions they cover are answered without searching."""
+
+    def __init__(self, ttSize=1 << 18, book=None, tablebases=None):
+        self.tt = TranspositionTable(ttSize)
+        self.book = book
+        self.tablebases = tablebases
+        self.nodes = 0
+        self.deadline = None
+        self.shouldStop = None
+        self.searchFirst = None
+
+    def analyze(self, gs, depth=None, time_limit=None, onIteration=None, shouldStop=None, searchFirst=None):
+        """Searches gs to `depth` plies, or deepening until `time_limit` seconds have
+        passed (whichever comes first). Returns an AnalysisResult.
+
+        onIteration(iteration, pv) is called after every completed depth with that
+        depth's entry of AnalysisResult.iterations and its principal variation as Moves.
+        shouldStop() is polled during the search; once it returns True the search
+        unwinds and the result of the last completed depth is returned.
+        searchFirst (a Move or packed move, e.g. the move played from gs in a game
+        whose next position was just analysed) is tried first at the root of every
+        depth, ahead of the table's best move."""
+        if self.book is not None:
+            start = time.perf_counter()
+            entries = self.book.lookup(gs)
+            if entries:
+                best = max(entries, key=lambda entry: (entry.frequency, entry.score))
+                return AnalysisResult(best.move, evaluate(gs), [best.move], [], 0, time.perf_counter() - start,
+                                      fromBook=True)
+        if self.tablebases is not None:
+            start = time.perf_counter()
+            found = self.tablebases.bestMove(gs)
+            if found is not None:
+                move, (wdl, plies) = found
+                score = wdl * (MATE_SCORE - plies) if wdl else 0
+                return AnalysisResult(move, score, [move], [], 0, time.perf_counter() - start, fromTablebase=True)
+        if depth is None:
+            depth = MAX_PLY if time_limit is not None else 4
+        savedFlags = (gs.checkMate, gs.staleMate, gs.pins, gs.checks)
+        rootLength = len(gs.moveLog)
+        rootMoves = gs.getValidMoves()
+        self.tt.newSearch()
+        self.nodes = 0
+        self.shouldStop = shouldStop
+        self.searchFirst = getattr(searchFirst, "packed", searchFirst)
+        start = time.perf_counter()
+        iterations = []
+        bestMove = rootMoves[0] if rootMoves else None
+        score = evaluate(gs) if rootMoves else (-MATE_SCORE if gs.checkMate else 0)
+        pv = [bestMove] if bestMove else []
+        try:
+            for currentDepth in range(1, depth + 1):
+                if not rootMoves:
+                    break
+                # Always finish depth 1 so there is a move to report
+                self.deadline = start + time_limit if time_limit is not None and currentDepth > 1 else None
+                iterationStart = time.perf_counter()
+                nodesBefore, probesBefore, hitsBefore = self.nodes, self.tt.probes, self.tt.hits
+                score = self._negamax(gs, currentDepth, -INFINITY, INFINITY, 0)
+                pv = self._principalVariation(gs, currentDepth)
+                if pv:
+                    bestMove = pv[0]
+                elapsed = time.perf_counter() - iterationStart
+                nodes = self.nodes - nodesBefore
+                probes = self.tt.probes - probesBefore
+                iterations.append({"depth": currentDepth, "score": score, "nodes": nodes, "seconds": elapsed,
+                                   "nps": nodes / elapsed if elapsed > 0 else 0.0,
+                                   "ttHitRate": (self.tt.hits - hitsBefore) / probes if probes else 0.0,
+                                   "pv": [move.getChessNotation() for move in pv]})
+                if onIteration is not None:
+                    onIteration(iterations[-1], pv)
+                if isMateScore(score) or (time_limit is not None and time.perf_counter() - start >= time_limit):
+                    break
+        except SearchTimeout:
+            while len(gs.moveLog) > rootLength:
+                gs.undoMove(record=False)
+        gs.checkMate, gs.staleMate, gs.pins, gs.checks = savedFlags
+        self.deadline = None
+        self.shouldStop = None
+        self.searchFirst = None
+        return AnalysisResult(bestMove, score, pv, iterations, self.nodes, time.perf_counter() - start)
+
+    def _orderMoves(self, moves, *firstMoves):
+        """Sorts moves by MVV-LVA, then brings the given packed moves to the front,
+        the first of them ending up first."""
+        moves.sort(key=captureOrder, reverse=True)
+        for first in reversed(firstMoves):
+            if first is None:
+                continue
+            for i, move in enumerate(moves):
+                if move.packed == first:
+                    moves.insert(0, moves.pop(i))
+                    break
+        return moves
+
+    def _checkTime(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.shouldStop is not None and self.shouldStop():
+            raise SearchTimeout()
+
+    def _negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & CHECK_INTERVAL_MASK == 0:
+            self._checkTime()
+        key = gs.zobristKey
+        if ply > 0 and (gs.halfmoveClock >= FIFTY_MOVE_PLIES or gs.isRepetition()):
+            return 0  # repeating a position or reaching the fifty-move rule is scored as a draw
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(gs, alpha, beta, ply)
+
+        entry = self.tt.probe(key)
+        ttMove = None
+        if entry is not None:
+            ttMove = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                ttScore, bound = _scoreFromTable(entry[2], ply), entry[3]
+                if bound == EXACT or (bound == LOWER_BOUND and ttScore >= beta) or (bound == UPPER_BOUND and ttScore <= alpha):
+                    return ttScore
+
+        moves = gs.getValidMoves()
+        if not moves:
+            return -MATE_SCORE + ply if gs.checkMate else 0
+
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        firstMoves = (self.searchFirst, ttMove) if ply == 0 else (ttMove,)
+        for move in self._orderMoves(moves, *firstMoves):
+            gs.makeMove(move, record=False)
+            score = -self._negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove(record=False)
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if bestScore <= originalAlpha:
+            bound = UPPER_BOUND
+        elif bestScore >= beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, _scoreToTable(bestScore, ply), bound, bestMove.packed)
+        return bestScore
+
+    def _quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & CHECK_INTERVAL_MASK == 0:
+            self._checkTime()
+        inCheck = gs.inCheck()
+        if not inCheck:
+            standPat = evaluate(gs)
+            if standPat >= beta or ply >= MAX_PLY:
+                return standPat
+            alpha = max(alpha, standPat)
+        if inCheck:
+            # Every evasion is searched
+            moves = gs.getValidMoves()
+            if not moves:
+                return -MATE_SCORE + ply
+            moves.sort(key=captureOrder, reverse=True)
+        else:
+            # Only captures and queen promotions, which generateMoves yields first and
+            # in MVV-LVA order, so the quiet moves are never generated
+            moves = []
+            anyMove = False
+            for move in gs.generateMoves():
+                anyMove = True
+                if move.pieceCaptured == "--" and not move.isPawnPromotion:
+                    break
+                if move.pieceCaptured != "--" or move.promotionChoice == "Q":
+                    moves.append(move)
+            if not anyMove:
+                return 0  # stalemate
+        bestScore = alpha if not inCheck else -INFINITY
+        for move in moves:
+            gs.makeMove(move, record=False)
+            score = -self._quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove(record=False)
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return bestScore
+
+    def _principalVariation(self, gs, depth):
+        """Follows best moves stored in the transposition table from the root."""
+        pv = []
+        seen = set()
+        while len(pv) < depth and gs.zobristKey not in seen:
+            seen.add(gs.zobristKey)
+            entry = self.tt.probe(gs.zobristKey)
+            if entry is None or entry[4] is None:
+                break
+            move = next((m for m in gs.getValidMoves() if m.packed == entry[4]), None)
+            if move is None:
+                break
+            pv.append(move)
+            gs.makeMove(move, record=False)
+        for move in pv:
+            gs.undoMove(record=False)
+        return pv
+
+
+_defaultAnalyzer = None
+
+
+def analyze(gs, depth=None, time_limit=None):
+    """Analyses gs with a shared Analyzer, so its transposition table is reused
+    between calls. See Analyzer.analyze."""
+    global _defaultAnalyzer
+    if _defaultAnalyzer is None:
+        _defaultAnalyzer = Analyzer()
+    return _defaultAnalyzer.analyze(gs, depth, time_limit)
+
+
+if __name__ == "__main__":
+    import sys
+    state = GameState()
+    if len(sys.argv) > 1:
+        state.loadFen(" ".join(sys.argv[1:]))
+    result = analyze(state, time_limit=5.0)
+    for iteration in result.iterations:
+        print(f"depth {iteration['depth']:2} score {iteration['score']:6} nodes {iteration['nodes']:8} "
+              f"nps {iteration['nps']:8,.0f} tt {iteration['ttHitRate']:.0%} pv {' '.join(iteration['pv'])}")
+    print("bestmove", result.bestMove.getChessNotation() if result.bestMove else "(none)")
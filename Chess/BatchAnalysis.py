@@ -0,0 +1,220 @@
+"""Analyse whole collections of games or positions on a process pool.
+
+    python -m Chess batch games.pgn.gz --depth 3 --output results.jsonl
+    python -m Chess batch positions.epd --movetime 0.5 --unordered --workers 8
+    python -m Chess batch games.pgn.gz --output results.jsonl --resume   # after a crash
+
+Every worker process keeps one GameState and one Analyzer for its whole life, so
+position caches and the transposition table stay warm between items. Input is
+read lazily and at most --max-pending chunks are in flight, so a slow consumer
+holds the readers back instead of filling memory. Results are JSON lines tagged
+with the item's input index; --resume skips the indexes already in --output.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .Analyzer import Analyzer
+from .ChessEngine import GameState
+from .PgnReader import readGames, readGameTexts
+
+PGN_SUFFIXES = (".pgn", ".pgn.gz", ".pgn.bz2")
+
+# Per-process state, created by _initWorker
+_workerState = None
+_workerAnalyzer = None
+
+
+def readItems(path, start=0, skip=()):
+    """Yields (index, kind, payload) for every game ("game", PGN text) or position
+    ("position", FEN) in `path`, leaving out indexes below `start` or in `skip`."""
+    if path.endswith(PGN_SUFFIXES):
+        kind, payloads = "game", readGameTexts(path)
+    else:
+        kind, payloads = "position", _readFens(path)
+    for index, payload in enumerate(payloads):
+        if index >= start and index not in skip:
+            yield index, kind, payload
+
+
+def _readFens(path):
+    """One FEN or EPD record per line; EPD operations after the fourth field are dropped."""
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+                yield " ".join(fields[:6])
+            else:
+                yield " ".join(fields[:4])
+
+
+def _initWorker(backend):
+    global _workerState, _workerAnalyzer
+    _workerState = GameState(backend)
+    _workerAnalyzer = Analyzer()
+
+
+def _analyzePosition(gs, depth, timeLimit):
+    result = _workerAnalyzer.analyze(gs, depth, timeLimit)
+    return {"bestMove": result.bestMove.getChessNotation() if result.bestMove else None, "score": result.score,
+            "depth": result.iterations[-1]["depth"] if result.iterations else 0, "nodes": result.nodes}
+
+
+def _analyzeChunk(chunk, depth, timeLimit):
+    """Worker side: analyses a list of items and returns one result dict per item."""
+    gs = _workerState
+    results = []
+    for index, kind, payload in chunk:
+        record = {"index": index, "kind": kind}
+        try:
+            if kind == "position":
+                gs.loadFen(payload)
+                record["fen"] = payload
+                record.update(_analyzePosition(gs, depth, timeLimit))
+            else:
+                game = next(readGames(io.StringIO(payload), gs=gs))
+                record["headers"] = game.headers
+                record["result"] = game.result
+                if game.error:
+                    record["error"] = game.error
+                gs.loadFen(game.startFen)
+                plies = []
+                for ply in range(len(game.moves) + 1):
+                    analysis = _analyzePosition(gs, depth, timeLimit)
+                    analysis["ply"] = ply
+                    if ply < len(game.moves):
+                        analysis["played"] = game.moves[ply].getChessNotation()
+                        gs.makeMove(game.moves[ply])
+                    plies.append(analysis)
+                record["plies"] = plies
+        except Exception as error:  # one bad item must not take down the batch
+            record["error"] = f"{type(error).__name__}: {error}"
+        results.append(record)
+    return results
+
+
+def _chunked(items, chunkSize):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def analyzeBatch(items, depth=3, timeLimit=None, workers=None, chunkSize=4, ordered=True, maxPending=None,
+                 backend="list"):
+    """Analyses (index, kind, payload) items on a process pool and yields result dicts.
+
+    With ordered=True results come back in input order, otherwise as soon as each
+    chunk finishes. At most maxPending chunks (default two per worker) are submitted
+    or waiting to be yielded at any time.
+    """
+    workers = workers or os.cpu_count() or 1
+    maxPending = maxPending or 2 * workers
+    pool = ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(backend,))
+    pending = deque()
+    try:
+        for chunk in _chunked(items, chunkSize):
+            while len(pending) >= maxPending:
+                yield from _collect(pending, ordered)
+            pending.append(pool.submit(_analyzeChunk, chunk, depth, timeLimit))
+        while pending:
+            yield from _collect(pending, ordered)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _collect(pending, ordered):
+    """Removes one finished future from `pending` (the oldest when ordered) and returns its results."""
+    if ordered:
+        return pending.popleft().result()
+    done, notDone = wait(pending, return_when=FIRST_COMPLETED)
+    future = done.pop()
+    pending.remove(future)
+    return future.result()
+
+
+def completedIndexes(path):
+    """Indexes already written to a results file; a line cut short by a crash is ignored."""
+    indexes = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    indexes.add(json.loads(line)["index"])
+                except (ValueError, KeyError):
+                    pass
+    return indexes
+
+
+def dropPartialLine(path):
+    """Truncates a results file after its last newline, so records appended on resume
+    do not run on from a line cut short by a crash."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            size = min(4096, position)
+            f.seek(position - size)
+            newline = f.read(size).rfind(b"\n")
+            if newline >= 0:
+                position = position - size + newline + 1
+                break
+            position -= size
+        if position < end:
+            f.truncate(position)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse games or positions on all cores")
+    parser.add_argument("input", help="PGN file (.pgn/.pgn.gz/.pgn.bz2) or one FEN/EPD per line")
+    parser.add_argument("--output", help="JSON lines results file (default: stdout)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--movetime", type=float, help="seconds per position instead of a fixed depth")
+    parser.add_argument("--workers", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=4, help="items sent to a worker at a time")
+    parser.add_argument("--max-pending", type=int, help="chunks in flight (default: 2 per worker)")
+    parser.add_argument("--unordered", action="store_true", help="write results as they finish")
+    parser.add_argument("--start", type=int, default=0, help="skip the first START items")
+    parser.add_argument("--resume", action="store_true", help="skip items already in --output")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    args = parser.parse_args(argv)
+
+    skip = set()
+    if args.resume and args.output:
+        skip = completedIndexes(args.output)
+        dropPartialLine(args.output)
+    depth = None if args.movetime and args.depth == parser.get_default("depth") else args.depth
+    out = open(args.output, "a") if args.output else sys.stdout
+    items = positions = 0
+    start = time.perf_counter()
+    try:
+        for record in analyzeBatch(readItems(args.input, args.start, skip), depth, args.movetime, args.workers,
+                                   args.chunk_size, not args.unordered, args.max_pending, args.backend):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            items += 1
+            positions += len(record["plies"]) if "plies" in record else 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    print(f"{items} items ({positions} positions) in {seconds:.1f}s: {items / seconds if seconds else 0:,.2f} items/s, "
+          f"{positions / seconds if seconds else 0:,.1f} positions/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,539 @@
+from array import array
+
+from .ChessEngine import (ATTACKER_NAMES, HALFMOVE_LIMIT, MOVE_FLAG_CASTLE, MOVE_FLAG_ENPASSANT, MOVE_FLAG_PROMOTION,
+                          NO_SQUARE, PIECE_CODE, PIECE_CODES, POSITION_CACHE_SIZE, PROMOTION_PIECES, SQUARE_COORDS,
+                          ZOBRIST_BLACK_TO_MOVE, ZOBRIST_CASTLING, ZOBRIST_ENPASSANT_FILE, ZOBRIST_PIECES, GameState,
+                          Move, captureOrder)
+
+# Squares are numbered sq = row * 8 + col, so a8 is bit 0 and h1 is bit 63 (the same
+# row/col orientation as GameState.board).
+FULL_BOARD = (1 << 64) - 1
+PIECE_NAMES = ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")
+
+
+def _buildJumps(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+def _buildRay(dr, dc):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for i in range(1, 8):
+            if not (0 <= r + dr * i < 8 and 0 <= c + dc * i < 8):
+                break
+            bb |= 1 << ((r + dr * i) * 8 + c + dc * i)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _buildJumps(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _buildJumps(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# Squares attacked by a pawn of the given colour standing on sq
+PAWN_ATTACKS = {"w": _buildJumps(((-1, -1), (-1, 1))), "b": _buildJumps(((1, -1), (1, 1)))}
+
+# Rays that run towards higher square numbers stop at their lowest blocker, the
+# others at their highest one.
+ORTHOGONAL_UP_RAYS = (_buildRay(1, 0), _buildRay(0, 1))
+ORTHOGONAL_DOWN_RAYS = (_buildRay(-1, 0), _buildRay(0, -1))
+DIAGONAL_UP_RAYS = (_buildRay(1, 1), _buildRay(1, -1))
+DIAGONAL_DOWN_RAYS = (_buildRay(-1, -1), _buildRay(-1, 1))
+ROOK_RAYS = [ORTHOGONAL_UP_RAYS[0][sq] | ORTHOGONAL_UP_RAYS[1][sq] | ORTHOGONAL_DOWN_RAYS[0][sq] | ORTHOGONAL_DOWN_RAYS[1][sq]
+             for sq in range(64)]
+BISHOP_RAYS = [DIAGONAL_UP_RAYS[0][sq] | DIAGONAL_UP_RAYS[1][sq] | DIAGONAL_DOWN_RAYS[0][sq] | DIAGONAL_DOWN_RAYS[1][sq]
+               for sq in range(64)]
+
+
+def _slidingAttacks(sq, occupied, upRays, downRays):
+    attacks = 0
+    for rays in upRays:
+        ray = rays[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in downRays:
+        ray = rays[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    # Only the rays that actually hold a blocker need trimming
+    if not ROOK_RAYS[sq] & occupied:
+        return ROOK_RAYS[sq]
+    return _slidingAttacks(sq, occupied, ORTHOGONAL_UP_RAYS, ORTHOGONAL_DOWN_RAYS)
+
+
+def bishopAttacks(sq, occupied):
+    if not BISHOP_RAYS[sq] & occupied:
+        return BISHOP_RAYS[sq]
+    return _slidingAttacks(sq, occupied, DIAGONAL_UP_RAYS, DIAGONAL_DOWN_RAYS)
+
+
+def _buildBetween():
+    """BETWEEN[a][b]: squares strictly between a and b when they share a line, else 0.
+    LINE[a][b]: the whole line through a and b (a included), used to keep pinned
+    pieces on their pin ray."""
+    between = [[0] * 64 for sq in range(64)]
+    line = [[0] * 64 for sq in range(64)]
+    for a in range(64):
+        for rays, backRays in ((ORTHOGONAL_UP_RAYS + ORTHOGONAL_DOWN_RAYS, ORTHOGONAL_DOWN_RAYS + ORTHOGONAL_UP_RAYS),
+                               (DIAGONAL_UP_RAYS + DIAGONAL_DOWN_RAYS, DIAGONAL_DOWN_RAYS + DIAGONAL_UP_RAYS)):
+            for ray, backRay in zip(rays, backRays):
+                full = ray[a] | backRay[a] | (1 << a)
+                bb = ray[a]
+                while bb:
+                    bit = bb & -bb
+                    b = bit.bit_length() - 1
+                    between[a][b] = ray[a] & backRay[b]
+                    line[a][b] = full
+                    bb ^= bit
+    return between, line
+
+
+BETWEEN, LINE = _buildBetween()
+
+
+PROMOTION_SQUARES = 0xFF | 0xFF << 56
+
+# Castling rights (CastleRights.index() bits) lost when a king moves, and when a
+# rook leaves or is captured on its corner
+KING_CASTLING_RIGHTS = {"wK": 1 | 4, "bK": 2 | 8}
+ROOK_CASTLING_RIGHTS = {"wR": {63: 1, 56: 4}, "bR": {7: 2, 0: 8}}
+
+
+def _squares(bb):
+    """Yields the square numbers of the set bits of bb, lowest first."""
+    while bb:
+        bit = bb & -bb
+        yield bit.bit_length() - 1
+        bb ^= bit
+
+
+class BitboardGameState(GameState):
+    """GameState whose move generation and attack tests run on integer bitboards.
+
+    makeMove/undoMove/redoMove and all game bookkeeping are inherited; the
+    bitboards are updated from each move on top of that, and self.board stays in
+    sync as the list-of-strings view the UI draws from. makePackedMove and
+    undoPackedMove play the moves of getValidMovesPacked without any Move objects,
+    for tree walks such as perft. Create one with GameState(backend="bitboard") or
+    BitboardGameState().
+    """
+
+    def __init__(self, backend="bitboard", positionCacheSize=POSITION_CACHE_SIZE):
+        super().__init__(backend, positionCacheSize)
+        self._syncBitboards()
+        self.packedLog = array("H")  # moves played with makePackedMove, on top of moveLog
+
+    def loadFen(self, fen):
+        super().loadFen(fen)
+        self._syncBitboards()
+        self.packedLog = array("H")
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self._syncBitboards()
+        self.packedLog = array("H")
+
+    def clone(self, shareHistory=False):
+        other = super().clone(shareHistory)
+        other.pieceBitboards = dict(self.pieceBitboards)
+        other.colorBitboards = dict(self.colorBitboards)
+        other.packedLog = array("H")
+        return other
+
+    def _syncBitboards(self):
+        """Rebuilds every bitboard from self.board."""
+        self.pieceBitboards = {piece: 0 for piece in PIECE_NAMES}
+        self.colorBitboards = {"w": 0, "b": 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    bit = 1 << (r * 8 + c)
+                    self.pieceBitboards[piece] |= bit
+                    self.colorBitboards[piece[0]] |= bit
+
+    def _movePiece(self, piece, fromSq, toSq):
+        bits = (1 << fromSq) | (1 << toSq)
+        self.pieceBitboards[piece] ^= bits
+        self.colorBitboards[piece[0]] ^= bits
+
+    def _togglePiece(self, piece, sq):
+        bit = 1 << sq
+        self.pieceBitboards[piece] ^= bit
+        self.colorBitboards[piece[0]] ^= bit
+
+    def _applyMoveBitboards(self, move):
+        """Toggles the bitboards for move; calling it twice restores them."""
+        fromSq = move.startRow * 8 + move.startCol
+        toSq = move.endRow * 8 + move.endCol
+        if move.isEnpassantMove:
+            self._togglePiece(move.pieceCaptured, move.startRow * 8 + move.endCol)
+        elif move.pieceCaptured != "--":
+            self._togglePiece(move.pieceCaptured, toSq)
+        if move.isPawnPromotion:
+            # self.board holds the promoted piece both right after makeMove and right before undoMove
+            self._togglePiece(move.pieceMoved, fromSq)
+            self._togglePiece(self.board[move.endRow][move.endCol], toSq)
+        else:
+            self._movePiece(move.pieceMoved, fromSq, toSq)
+        if move.isCastleMove:
+            rook = move.pieceMoved[0] + "R"
+            rowBase = move.endRow * 8
+            if move.endCol - move.startCol == 2:
+                self._movePiece(rook, rowBase + 7, rowBase + 5)
+            else:
+                self._movePiece(rook, rowBase, rowBase + 3)
+
+    def makeMove(self, move, clear_redo=True, record=True):
+        super().makeMove(move, clear_redo, record)
+        self._applyMoveBitboards(move)
+
+    def undoMove(self, record=True):
+        if len(self.moveLog) != 0:
+            self._applyMoveBitboards(self.moveLog[-1])
+        super().undoMove(record)
+
+    def makePackedMove(self, packed):
+        """Plays a packed move from getValidMovesPacked without building a Move, the
+        way makeMove(move, record=False) would: board, bitboards, hash, king
+        locations, castling rights, en passant square and halfmove clock all follow,
+        and undoPackedMove takes it back. The move goes on packedLog rather than
+        moveLog, so take back all packed moves before makeMove, undoMove or clone."""
+        if self.historyShared:
+            self._unshareHistory()
+        packedLog = self.packedLog
+        ply = len(self.moveLog) + len(packedLog)
+        if ply == len(self.undoKeys):
+            self.undoStates.extend(self.undoStates)
+            self.undoKeys.extend(self.undoKeys)
+        board = self.board
+        pieces = self.pieceBitboards
+        colors = self.colorBitboards
+        fromSq = packed & 63
+        toSq = packed >> 6 & 63
+        flags = packed >> 12
+        fromRow, fromCol = fromSq >> 3, fromSq & 7
+        toRow, toCol = toSq >> 3, toSq & 7
+        moved = board[fromRow][fromCol]
+        color = moved[0]
+        rights = self.currentCastlingRight.index()
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[rights]
+        epSq = NO_SQUARE
+        if self.enpassantPossible != ():
+            epRow, epCol = self.enpassantPossible
+            epSq = epRow * 8 + epCol
+            key ^= ZOBRIST_ENPASSANT_FILE[epCol]
+        if flags == MOVE_FLAG_ENPASSANT:
+            capturedSq = fromRow * 8 + toCol
+            captured = board[fromRow][toCol]
+            board[fromRow][toCol] = "--"
+        else:
+            capturedSq = toSq
+            captured = board[toRow][toCol]
+        self.undoStates[ply] = rights | epSq << 4 | PIECE_CODE[captured] << 11 | self.halfmoveClock << 15
+        self.undoKeys[ply] = self.zobristKey
+        if captured != "--":
+            bit = 1 << capturedSq
+            pieces[captured] ^= bit
+            colors[captured[0]] ^= bit
+            key ^= ZOBRIST_PIECES[captured][capturedSq >> 3][capturedSq & 7]
+        placed = color + PROMOTION_PIECES[flags & 3] if flags & MOVE_FLAG_PROMOTION else moved
+        pieces[moved] ^= 1 << fromSq
+        pieces[placed] ^= 1 << toSq
+        colors[color] ^= 1 << fromSq | 1 << toSq
+        key ^= ZOBRIST_PIECES[moved][fromRow][fromCol] ^ ZOBRIST_PIECES[placed][toRow][toCol]
+        board[fromRow][fromCol] = "--"
+        board[toRow][toCol] = placed
+        kind = moved[1]
+        if kind == "K":
+            if flags == MOVE_FLAG_CASTLE:
+                rook = color + "R"
+                rookFrom, rookTo = (toCol + 1, toCol - 1) if toCol > fromCol else (toCol - 2, toCol + 1)
+                bits = 1 << (toRow * 8 + rookFrom) | 1 << (toRow * 8 + rookTo)
+                pieces[rook] ^= bits
+                colors[color] ^= bits
+                board[toRow][rookFrom] = "--"
+                board[toRow][rookTo] = rook
+                key ^= ZOBRIST_PIECES[rook][toRow][rookFrom] ^ ZOBRIST_PIECES[rook][toRow][rookTo]
+            if color == "w":
+                self.whiteKingLocation = SQUARE_COORDS[toSq]
+            else:
+                self.blackKingLocation = SQUARE_COORDS[toSq]
+        if rights:
+            if kind == "K":
+                rights &= ~KING_CASTLING_RIGHTS[moved]
+            elif kind == "R":
+                rights &= ~ROOK_CASTLING_RIGHTS[moved].get(fromSq, 0)
+            if captured[1] == "R":
+                rights &= ~ROOK_CASTLING_RIGHTS[captured].get(toSq, 0)
+            self.currentCastlingRight.setIndex(rights)
+        key ^= ZOBRIST_CASTLING[rights]
+        if kind == "p" and (toSq - fromSq == 16 or fromSq - toSq == 16):
+            self.enpassantPossible = SQUARE_COORDS[(fromSq + toSq) >> 1]
+            key ^= ZOBRIST_ENPASSANT_FILE[fromCol]
+        else:
+            self.enpassantPossible = ()
+        if kind == "p" or captured != "--":
+            self.halfmoveClock = 0
+        elif self.halfmoveClock < HALFMOVE_LIMIT:
+            self.halfmoveClock += 1
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey = key
+        packedLog.append(packed)
+
+    def undoPackedMove(self):
+        """Takes back the last makePackedMove."""
+        packed = self.packedLog.pop()
+        ply = len(self.moveLog) + len(self.packedLog)
+        state = self.undoStates[ply]
+        board = self.board
+        pieces = self.pieceBitboards
+        colors = self.colorBitboards
+        fromSq = packed & 63
+        toSq = packed >> 6 & 63
+        flags = packed >> 12
+        fromRow, fromCol = fromSq >> 3, fromSq & 7
+        toRow, toCol = toSq >> 3, toSq & 7
+        placed = board[toRow][toCol]
+        color = placed[0]
+        moved = color + "p" if flags & MOVE_FLAG_PROMOTION else placed
+        captured = PIECE_CODES[state >> 11 & 15]
+        pieces[moved] ^= 1 << fromSq
+        pieces[placed] ^= 1 << toSq
+        colors[color] ^= 1 << fromSq | 1 << toSq
+        board[fromRow][fromCol] = moved
+        if flags == MOVE_FLAG_ENPASSANT:
+            capturedSq = fromRow * 8 + toCol
+            board[toRow][toCol] = "--"
+            board[fromRow][toCol] = captured
+        else:
+            capturedSq = toSq
+            board[toRow][toCol] = captured
+        if captured != "--":
+            bit = 1 << capturedSq
+            pieces[captured] ^= bit
+            colors[captured[0]] ^= bit
+        if moved[1] == "K":
+            if flags == MOVE_FLAG_CASTLE:
+                rook = color + "R"
+                rookFrom, rookTo = (toCol + 1, toCol - 1) if toCol > fromCol else (toCol - 2, toCol + 1)
+                bits = 1 << (toRow * 8 + rookFrom) | 1 << (toRow * 8 + rookTo)
+                pieces[rook] ^= bits
+                colors[color] ^= bits
+                board[toRow][rookTo] = "--"
+                board[toRow][rookFrom] = rook
+            if color == "w":
+                self.whiteKingLocation = SQUARE_COORDS[fromSq]
+            else:
+                self.blackKingLocation = SQUARE_COORDS[fromSq]
+        self.whiteToMove = not self.whiteToMove
+        self.currentCastlingRight.setIndex(state & 15)
+        epSq = state >> 4 & 127
+        self.enpassantPossible = () if epSq == NO_SQUARE else SQUARE_COORDS[epSq]
+        self.halfmoveClock = state >> 15
+        self.zobristKey = self.undoKeys[ply]
+
+    # ------------------------------------------------------------------
+    # Attack queries
+    # ------------------------------------------------------------------
+
+    def _attackersBitboard(self, sq, color, occupied):
+        """Bitboard of pieces of `color` (restricted to `occupied`) attacking sq."""
+        pieces = self.pieceBitboards
+        pawn, knight, bishop, rook, queen, king = ATTACKER_NAMES[color]
+        queens = pieces[queen]
+        return ((PAWN_ATTACKS["b" if color == "w" else "w"][sq] & pieces[pawn]) |
+                (KNIGHT_ATTACKS[sq] & pieces[knight]) |
+                (KING_ATTACKS[sq] & pieces[king]) |
+                (rookAttacks(sq, occupied) & (pieces[rook] | queens)) |
+                (bishopAttacks(sq, occupied) & (pieces[bishop] | queens))) & occupied
+
+    def isSquareAttacked(self, r, c, color):
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        return self._attackersBitboard(r * 8 + c, color, occupied) != 0
+
+    def attackersTo(self, r, c, color):
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        return [SQUARE_COORDS[sq] for sq in _squares(self._attackersBitboard(r * 8 + c, color, occupied))]
+
+    def _kingAttacked(self):
+        if self.whiteToMove:
+            return self.isSquareAttacked(self.whiteKingLocation[0], self.whiteKingLocation[1], "b")
+        else:
+            return self.isSquareAttacked(self.blackKingLocation[0], self.blackKingLocation[1], "w")
+
+    # ------------------------------------------------------------------
+    # Legal move generation
+    # ------------------------------------------------------------------
+
+    def _generateValidMoves(self, legalFilter=False):
+        if legalFilter:
+            return super()._generateValidMoves(legalFilter=True)
+        packedMoves = array("H")
+        inCheckFlag = self._generateLegalMoves(packedMoves)
+        board = self.board
+        fromPacked = Move.fromPacked
+        return [fromPacked(packed, board) for packed in packedMoves], inCheckFlag
+
+    def getValidMovesPacked(self):
+        moves = array("H")
+        inCheckFlag = self._generateLegalMoves(moves)
+        self.checkMate = inCheckFlag and len(moves) == 0
+        self.staleMate = not inCheckFlag and len(moves) == 0
+        return moves
+
+    def generateMoves(self):
+        """See GameState.generateMoves. The bitboard generator finds every packed move
+        in one pass; only the captures and promotions are turned into Moves up
+        front, the rest as they are consumed."""
+        entry = self._cachedEntry()
+        if entry is not None:
+            yield from self._stageMoves(entry[0])
+            return
+        packedMoves = array("H")
+        self._generateLegalMoves(packedMoves)
+        board = self.board
+        fromPacked = Move.fromPacked
+        captures = [fromPacked(packed, board) for packed in packedMoves
+                    if packed >> 12 & (MOVE_FLAG_ENPASSANT | MOVE_FLAG_PROMOTION) or board[packed >> 9 & 7][packed >> 6 & 7] != "--"]
+        captures.sort(key=captureOrder, reverse=True)
+        yield from captures
+        for packed in packedMoves:
+            if not packed >> 12 and board[packed >> 9 & 7][packed >> 6 & 7] == "--":
+                yield fromPacked(packed, board)
+        for packed in packedMoves:
+            if packed >> 12 == MOVE_FLAG_CASTLE:
+                yield fromPacked(packed, board)
+
+    def hasLegalMove(self):
+        """See GameState.hasLegalMove. Generates the packed moves only, without
+        building Move objects."""
+        entry = self._cachedEntry()
+        if entry is not None:
+            self.checkMate, self.staleMate = entry[2], entry[3]
+            return len(entry[0]) > 0
+        return len(self.getValidMovesPacked()) > 0
+
+    def _generateLegalMoves(self, moves):
+        """Appends all legal moves, packed, to `moves` and returns whether the side to move is in check."""
+        pieces = self.pieceBitboards
+        us, them = ("w", "b") if self.whiteToMove else ("b", "w")
+        own = self.colorBitboards[us]
+        enemy = self.colorBitboards[them]
+        occupied = own | enemy
+        kingRow, kingCol = self.whiteKingLocation if us == "w" else self.blackKingLocation
+        kingSq = kingRow * 8 + kingCol
+        checkers = self._attackersBitboard(kingSq, them, occupied)
+
+        # King moves, tested with the king removed so it cannot hide behind itself
+        withoutKing = occupied ^ (1 << kingSq)
+        for sq in _squares(KING_ATTACKS[kingSq] & ~own):
+            if not self._attackersBitboard(sq, them, withoutKing):
+                moves.append(kingSq | sq << 6)
+        if checkers & (checkers - 1):
+            return True  # double check: only the king may move
+
+        if checkers:
+            checkerSq = checkers.bit_length() - 1
+            targetMask = checkers | BETWEEN[kingSq][checkerSq]
+        else:
+            targetMask = FULL_BOARD
+        targetMask &= ~own
+
+        # Pinned pieces: enemy sliders that would see the king through exactly one of our pieces
+        pinned = 0
+        pinLines = {}
+        enemyQueens = pieces[them + "Q"]
+        snipers = ((ROOK_RAYS[kingSq] & (pieces[them + "R"] | enemyQueens)) |
+                   (BISHOP_RAYS[kingSq] & (pieces[them + "B"] | enemyQueens)))
+        for sniperSq in _squares(snipers):
+            blockers = BETWEEN[kingSq][sniperSq] & occupied
+            if blockers and not (blockers & (blockers - 1)) and blockers & own:
+                pinned |= blockers
+                pinLines[blockers.bit_length() - 1] = LINE[kingSq][sniperSq]
+
+        for sq in _squares(pieces[us + "N"] & ~pinned):
+            targets = KNIGHT_ATTACKS[sq] & targetMask
+            while targets:
+                bit = targets & -targets
+                moves.append(sq | (bit.bit_length() - 1) << 6)
+                targets ^= bit
+        queens = pieces[us + "Q"]
+        for sliders, attackFunction in ((pieces[us + "R"] | queens, rookAttacks), (pieces[us + "B"] | queens, bishopAttacks)):
+            for sq in _squares(sliders):
+                targets = attackFunction(sq, occupied) & targetMask
+                if pinned >> sq & 1:
+                    targets &= pinLines[sq]
+                while targets:
+                    bit = targets & -targets
+                    moves.append(sq | (bit.bit_length() - 1) << 6)
+                    targets ^= bit
+
+        self._generatePawnMoves(moves, us, them, occupied, enemy, targetMask, pinned, pinLines, kingSq)
+
+        if not checkers:
+            self._generateCastleMoves(moves, us, them, occupied, kingRow, kingCol)
+        return checkers != 0
+
+    def _generatePawnMoves(self, moves, us, them, occupied, enemy, targetMask, pinned, pinLines, kingSq):
+        if us == "w":
+            step, startRow = -8, 6
+        else:
+            step, startRow = 8, 1
+        empty = ~occupied
+        epSq = -1
+        if self.enpassantPossible != ():
+            epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+        for sq in _squares(self.pieceBitboards[us + "p"]):
+            allowed = targetMask
+            if pinned >> sq & 1:
+                allowed &= pinLines[sq]
+            toSq = sq + step
+            targets = PAWN_ATTACKS[us][sq] & enemy & allowed
+            if empty >> toSq & 1:
+                targets |= 1 << toSq & allowed
+                if sq >> 3 == startRow and (empty & allowed) >> (toSq + step) & 1:
+                    moves.append(sq | (toSq + step) << 6)
+            if targets & PROMOTION_SQUARES:
+                for toSq in _squares(targets):
+                    for promotion in range(4):
+                        moves.append(sq | toSq << 6 | (MOVE_FLAG_PROMOTION | promotion) << 12)
+            else:
+                for toSq in _squares(targets):
+                    moves.append(sq | toSq << 6)
+            if epSq >= 0 and PAWN_ATTACKS[us][sq] >> epSq & 1:
+                # Both pawns leave their squares at once, so test the king directly
+                capturedSq = epSq - step
+                afterOccupied = occupied ^ (1 << sq) ^ (1 << capturedSq) | (1 << epSq)
+                if not self._attackersBitboard(kingSq, them, afterOccupied):
+                    moves.append(sq | epSq << 6 | MOVE_FLAG_ENPASSANT << 12)
+
+    def _generateCastleMoves(self, moves, us, them, occupied, kingRow, kingCol):
+        rights = self.currentCastlingRight
+        kingside, queenside = (rights.wks, rights.wqs) if us == "w" else (rights.bks, rights.bqs)
+        rowBase = kingRow * 8
+        rook = self.pieceBitboards[us + "R"]
+        if kingside and rook >> (rowBase + 7) & 1 and not occupied & (0b11 << (rowBase + 5)):
+            if not (self._attackersBitboard(rowBase + 5, them, occupied) or
+                    self._attackersBitboard(rowBase + 6, them, occupied)):
+                moves.append(rowBase + kingCol | (rowBase + kingCol + 2) << 6 | MOVE_FLAG_CASTLE << 12)
+        if queenside and rook >> rowBase & 1 and not occupied & (0b111 << (rowBase + 1)):
+            if not (self._attackersBitboard(rowBase + 3, them, occupied) or
+                    self._attackersBitboard(rowBase + 2, them, occupied)):
+                moves.append(rowBase + kingCol | (rowBase + kingCol - 2) << 6 | MOVE_FLAG_CASTLE << 12)
@@ -0,0 +1,309 @@
+"""Cached, dirty-region drawing of the board for ChessMain.
+
+    renderer = BoardRenderer(screen, images)
+    rects = renderer.render(board, selected=(r, c), marked=marked, hints=hints,
+                            check=kingSquare, arrows=[(arrow, color), ...], message=text)
+    if rects:
+        p.display.update(rects)
+
+The board background, the square highlights, the move hints and the fonts are built
+once. Every call to render() describes the whole scene; the renderer compares it with
+the scene it drew last time and repaints only the squares whose contents changed
+(plus the squares under arrows or a message that appeared, moved or went away), then
+returns just those rectangles. If the screen is wider than the board, the strip to
+its right shows an evaluation bar, redrawn only when its fill or label changes.
+When nothing changed nothing is drawn and the list is empty, so an idle board
+costs no drawing and no display update at all.
+"""
+import math
+
+import pygame as p
+
+from .Analyzer import MATE_SCORE, isMateScore
+
+DIMENSION = 8
+LIGHT_COLOR = p.Color("white")
+DARK_COLOR = p.Color("dark green")
+SELECTED_COLOR, SELECTED_ALPHA = p.Color("yellow"), 100
+MARKED_COLOR, MARKED_ALPHA = p.Color("red"), 120
+CHECK_COLOR, CHECK_ALPHA = p.Color("red"), 120
+CAPTURE_HINT_COLOR = p.Color("grey")
+MOVE_HINT_COLOR = p.Color("blue")
+ARROW_WIDTH = 8
+ARROW_HEAD_LENGTH = 20
+ARROW_HEAD_ANGLE = math.pi / 7
+FONT_NAMES = ("Poppins", "Arial")
+FONT_SIZE = 40
+EVAL_WHITE_COLOR = p.Color(235, 235, 235)
+EVAL_BLACK_COLOR = p.Color(40, 40, 40)
+EVAL_LABEL_SIZE = 16
+
+
+def drawArrow(screen, start, end, color, sqSize):
+    """Draws an arrow between the centres of two (row, col) squares."""
+    startPx = (start[1] * sqSize + sqSize // 2, start[0] * sqSize + sqSize // 2)
+    endPx = (end[1] * sqSize + sqSize // 2, end[0] * sqSize + sqSize // 2)
+    p.draw.line(screen, color, startPx, endPx, ARROW_WIDTH)
+    angle = math.atan2(endPx[1] - startPx[1], endPx[0] - startPx[0])
+    for sign in (-1, 1):
+        dx = ARROW_HEAD_LENGTH * math.cos(angle + sign * ARROW_HEAD_ANGLE)
+        dy = ARROW_HEAD_LENGTH * math.sin(angle + sign * ARROW_HEAD_ANGLE)
+        p.draw.line(screen, color, endPx, (endPx[0] - dx, endPx[1] - dy), ARROW_WIDTH)
+
+
+def whiteShare(score):
+    """Fraction of the evaluation bar given to White for a score from White's point of view."""
+    if isMateScore(score):
+        return 1.0 if score > 0 else 0.0
+    return 1 / (1 + 10 ** (-score / 400))
+
+
+def scoreLabel(score):
+    if isMateScore(score):
+        return f"M{(MATE_SCORE - abs(score) + 1) // 2}"
+    return f"{score / 100:+.1f}"
+
+
+def arrowRect(start, end, sqSize):
+    """A rectangle containing everything drawArrow paints for this arrow."""
+    left, right = sorted((start[1], end[1]))
+    top, bottom = sorted((start[0], end[0]))
+    margin = ARROW_HEAD_LENGTH + ARROW_WIDTH
+    return p.Rect(left * sqSize + sqSize // 2 - margin, top * sqSize + sqSize // 2 - margin,
+                  (right - left) * sqSize + 2 * margin, (bottom - top) * sqSize + 2 * margin)
+
+
+class BoardRenderer():
+    def __init__(self, screen, images, sqSize=None):
+        self.screen = screen
+        self.images = images
+        self.sqSize = sqSize or screen.get_height() // DIMENSION
+        self.boardRect = p.Rect(0, 0, self.sqSize * DIMENSION, self.sqSize * DIMENSION)
+        self.background = self._renderBackground()
+        self.selectedOverlay = self._overlay(SELECTED_COLOR, SELECTED_ALPHA)
+        self.markedOverlay = self._overlay(MARKED_COLOR, MARKED_ALPHA)
+        self.checkOverlay = self._overlay(CHECK_COLOR, CHECK_ALPHA)
+        self.moveHint = self._hint(MOVE_HINT_COLOR, self.sqSize // 8)
+        self.captureHint = self._hint(CAPTURE_HINT_COLOR, self.sqSize // 2 - 6)
+        barWidth = screen.get_width() - self.boardRect.right
+        self.evalBarRect = p.Rect(self.boardRect.right, 0, barWidth, self.boardRect.height) if barWidth > 0 else None
+        self.font = None
+        self.labelFont = None
+        self.messages = {}  # text -> (text surface, backing surface)
+        self.framesDrawn = 0
+        self.squaresDrawn = 0
+        self.lastArrows = ()
+        self.lastMessage = None
+        self.lastOverlayRects = []
+        self.lastSpriteRects = []
+        self.invalidate()
+
+    # ------------------------------------------------------------ cached surfaces
+
+    def _renderBackground(self):
+        surface = p.Surface(self.boardRect.size).convert()
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                color = DARK_COLOR if (r + c) % 2 else LIGHT_COLOR
+                surface.fill(color, p.Rect(c * self.sqSize, r * self.sqSize, self.sqSize, self.sqSize))
+        return surface
+
+    def _overlay(self, color, alpha):
+        surface = p.Surface((self.sqSize, self.sqSize)).convert()
+        surface.fill(color)
+        surface.set_alpha(alpha)
+        return surface
+
+    def _hint(self, color, radius):
+        surface = p.Surface((self.sqSize, self.sqSize), p.SRCALPHA).convert_alpha()
+        p.draw.circle(surface, color, (self.sqSize // 2, self.sqSize // 2), radius)
+        return surface
+
+    def getFont(self):
+        """SysFont searches the installed fonts, so it is looked up once per renderer."""
+        if self.font is None:
+            for name in FONT_NAMES:
+                if p.font.match_font(name):
+                    self.font = p.font.SysFont(name, FONT_SIZE, False, False)
+                    break
+            else:
+                self.font = p.font.SysFont(None, FONT_SIZE, False, False)
+        return self.font
+
+    def _drawEvalBar(self, evaluation):
+        """Draws the bar for a score from White's point of view (None: no result yet)
+        and returns its rect, or None when it already shows the same thing."""
+        share = 0.5 if evaluation is None else whiteShare(evaluation)
+        label = None if evaluation is None else scoreLabel(evaluation)
+        whiteHeight = round(share * self.evalBarRect.height)
+        if (whiteHeight, label) == self.lastEval:
+            return None
+        self.lastEval = (whiteHeight, label)
+        bar = self.evalBarRect
+        self.screen.fill(EVAL_BLACK_COLOR, p.Rect(bar.left, bar.top, bar.width, bar.height - whiteHeight))
+        self.screen.fill(EVAL_WHITE_COLOR, p.Rect(bar.left, bar.bottom - whiteHeight, bar.width, whiteHeight))
+        if label is not None:
+            if self.labelFont is None:
+                self.labelFont = p.font.SysFont(None, EVAL_LABEL_SIZE)
+            # the label sits at the end of the side that is ahead, in a colour that shows on it
+            whiteAhead = share >= 0.5
+            text = self.labelFont.render(label, True, EVAL_BLACK_COLOR if whiteAhead else EVAL_WHITE_COLOR)
+            if whiteAhead:
+                position = text.get_rect(midbottom=(bar.centerx, bar.bottom - 4))
+            else:
+                position = text.get_rect(midtop=(bar.centerx, bar.top + 4))
+            self.screen.blit(text, position)
+        return bar
+
+    def _message(self, text):
+        """(text surface, semi-transparent backing) for a centred message, rendered once per text."""
+        if text not in self.messages:
+            textObject = self.getFont().render(text, True, p.Color("white"))
+            textBg = p.Surface((textObject.get_width() + 20, textObject.get_height() + 10)).convert()
+            textBg.set_alpha(180)
+            textBg.fill(p.Color("black"))
+            self.messages[text] = (textObject, textBg)
+        return self.messages[text]
+
+    def _messageRect(self, text):
+        textObject, textBg = self._message(text)
+        return textBg.get_rect(center=self.boardRect.center)
+
+    # ------------------------------------------------------------------ drawing
+
+    def invalidate(self, rect=None):
+        """Forces the squares under rect (the whole board by default) to be repainted
+        on the next render, e.g. after something else has drawn over them."""
+        if rect is None:
+            self.lastKeys = [None] * (DIMENSION * DIMENSION)
+            self.lastEval = None
+        else:
+            for sq in self._squaresUnder(rect):
+                self.lastKeys[sq] = None
+
+    def _squaresUnder(self, rect):
+        rect = rect.clip(self.boardRect)
+        if not rect.width or not rect.height:
+            return ()
+        return [r * DIMENSION + c
+                for r in range(rect.top // self.sqSize, (rect.bottom - 1) // self.sqSize + 1)
+                for c in range(rect.left // self.sqSize, (rect.right - 1) // self.sqSize + 1)]
+
+    def _squareKeys(self, board, selected, marked, hints, check):
+        """What each square shows: (piece, selected, marked, in check, move hint)."""
+        keys = []
+        for r in range(DIMENSION):
+            row = board[r]
+            for c in range(DIMENSION):
+                sq = (r, c)
+                keys.append((row[c], sq == selected, sq in marked, sq == check, hints.get(sq)))
+        return keys
+
+    def _drawSquare(self, sq, key):
+        piece, selected, marked, check, hint = key
+        r, c = divmod(sq, DIMENSION)
+        position = (c * self.sqSize, r * self.sqSize)
+        self.screen.blit(self.background, position, p.Rect(position, (self.sqSize, self.sqSize)))
+        if marked:
+            self.screen.blit(self.markedOverlay, position)
+        if selected:
+            self.screen.blit(self.selectedOverlay, position)
+        if hint is not None:
+            self.screen.blit(self.captureHint if hint else self.moveHint, position)
+        if check:
+            self.screen.blit(self.checkOverlay, position)
+        if piece != "--":
+            self.screen.blit(self.images[piece], position)
+
+    def _drawOverlays(self, arrows, message, clip):
+        self.screen.set_clip(clip)
+        for (start, end), color in arrows:
+            if clip.colliderect(arrowRect(start, end, self.sqSize)):
+                drawArrow(self.screen, start, end, color, self.sqSize)
+        if message is not None and clip.colliderect(self._messageRect(message)):
+            textObject, textBg = self._message(message)
+            rect = self._messageRect(message)
+            self.screen.blit(textBg, rect)
+            self.screen.blit(textObject, textObject.get_rect(center=rect.center))
+        self.screen.set_clip(None)
+
+    def render(self, board, selected=(), marked=(), hints=None, check=None, arrows=(), message=None, sprites=(),
+               evaluation=None):
+        """Brings the screen up to date with the described scene and returns the
+        rectangles that were repainted, ready for pygame.display.update.
+
+        hints maps (row, col) to the piece a move there would capture (True) or not (False);
+        arrows is a sequence of (((row, col), (row, col)), color); sprites are extra
+        animated objects with a draw(screen) method returning the rect they painted,
+        which are drawn last and erased again on the next render; evaluation is the
+        score shown by the evaluation bar, from White's point of view."""
+        keys = self._squareKeys(board, selected, marked, hints or {}, check)
+        arrows = tuple(arrows)
+        overlayRects = [arrowRect(start, end, self.sqSize) for (start, end), color in arrows]
+        if message is not None:
+            overlayRects.append(self._messageRect(message))
+
+        dirty = set(sq for sq in range(DIMENSION * DIMENSION) if keys[sq] != self.lastKeys[sq])
+        if arrows != self.lastArrows or message != self.lastMessage:
+            for rect in overlayRects + self.lastOverlayRects:
+                dirty.update(self._squaresUnder(rect))
+        for rect in self.lastSpriteRects:
+            dirty.update(self._squaresUnder(rect))
+            if self.evalBarRect is not None and rect.colliderect(self.evalBarRect):
+                self.lastEval = None
+        barRect = self._drawEvalBar(evaluation) if self.evalBarRect is not None else None
+        if not dirty and not sprites:
+            self.lastSpriteRects = []
+            return [barRect] if barRect else []
+
+        for sq in dirty:
+            self._drawSquare(sq, keys[sq])
+        rects = self._runs(dirty)
+        if overlayRects:
+            for rect in rects:
+                self._drawOverlays(arrows, message, rect)
+        spriteRects = [sprite.draw(self.screen) for sprite in sprites]
+
+        self.lastKeys = keys
+        self.lastArrows = arrows
+        self.lastMessage = message
+        self.lastOverlayRects = overlayRects
+        self.lastSpriteRects = spriteRects
+        self.framesDrawn += 1
+        self.squaresDrawn += len(dirty)
+        return rects + spriteRects + ([barRect] if barRect else [])
+
+    def _runs(self, squares):
+        """Merges squares into one rectangle per horizontal run."""
+        rects = []
+        for sq in sorted(squares):
+            r, c = divmod(sq, DIMENSION)
+            last = rects[-1] if rects else None
+            if last is not None and last.top == r * self.sqSize and last.right == c * self.sqSize:
+                last.width += self.sqSize
+            else:
+                rects.append(p.Rect(c * self.sqSize, r * self.sqSize, self.sqSize, self.sqSize))
+        return rects
+
+    def animateMove(self, move, board, clock, framesPerSquare=10, fps=60):
+        """Slides the moved piece from its start to its end square. board is the position
+        after the move; only the rectangle spanning the two squares is redrawn each frame."""
+        dR = move.endRow - move.startRow
+        dC = move.endCol - move.startCol
+        frameCount = (abs(dR) + abs(dC)) * framesPerSquare
+        startRect = p.Rect(move.startCol * self.sqSize, move.startRow * self.sqSize, self.sqSize, self.sqSize)
+        endRect = p.Rect(move.endCol * self.sqSize, move.endRow * self.sqSize, self.sqSize, self.sqSize)
+        region = startRect.union(endRect)
+        squares = self._squaresUnder(region)
+        for frame in range(frameCount + 1):
+            for sq in squares:
+                r, c = divmod(sq, DIMENSION)
+                # the end square shows the captured piece (if any) until the mover arrives
+                piece = move.pieceCaptured if (r, c) == (move.endRow, move.endCol) else board[r][c]
+                self._drawSquare(sq, (piece, False, False, False, None))
+            r = move.startRow + dR * frame / frameCount
+            c = move.startCol + dC * frame / frameCount
+            self.screen.blit(self.images[move.pieceMoved], (c * self.sqSize, r * self.sqSize))
+            p.display.update(region)
+            clock.tick(fps)
+        self.invalidate(region)
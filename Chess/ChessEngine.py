@@ -1,5 +1,131 @@
+import logging
+import os
+import random
+from array import array
+from collections import OrderedDict
+
+# Zobrist keys: one random 64-bit number per (piece, square), side to move,
+# castling-rights combination and en passant file. A fixed seed keeps keys stable
+# between runs so they can be stored in caches and indexes.
+_zobristRandom = random.Random(20250711)
+ZOBRIST_PIECES = {piece: [[_zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+                  for piece in ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for i in range(16)]
+ZOBRIST_ENPASSANT_FILE = [_zobristRandom.getrandbits(64) for i in range(8)]
+
+
+def _buildTargets(offsets):
+    return [[tuple((r + dr, c + dc) for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8)
+             for c in range(8)] for r in range(8)]
+
+
+def _buildRays(directions):
+    rays = []
+    for r in range(8):
+        row = []
+        for c in range(8):
+            squares = []
+            for dr, dc in directions:
+                squares.append(tuple((r + dr * i, c + dc * i) for i in range(1, 8)
+                                     if 0 <= r + dr * i < 8 and 0 <= c + dc * i < 8))
+            row.append(tuple(squares))
+        rays.append(row)
+    return rays
+
+
+# Attack tables indexed [row][col]. Each entry lists the squares a piece standing
+# there reaches (for rays: one tuple per direction, nearest square first), so
+# attack queries can walk outward from a target square instead of generating moves.
+KNIGHT_TARGETS = _buildTargets(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_TARGETS = _buildTargets(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+ORTHOGONAL_RAYS = _buildRays(((-1, 0), (0, -1), (1, 0), (0, 1)))
+DIAGONAL_RAYS = _buildRays(((-1, -1), (-1, 1), (1, -1), (1, 1)))
+# Squares from which a pawn of the given colour attacks [row][col]
+PAWN_ATTACKER_SQUARES = {"w": _buildTargets(((1, -1), (1, 1))), "b": _buildTargets(((-1, -1), (-1, 1)))}
+SQUARE_COORDS = [divmod(sq, 8) for sq in range(64)]
+
+# Packed moves are 16-bit ints: bits 0-5 start square, 6-11 end square (row * 8 + col),
+# 12-15 flags. Promotions set MOVE_FLAG_PROMOTION plus the PROMOTION_PIECES index.
+MOVE_FLAG_ENPASSANT = 1
+MOVE_FLAG_CASTLE = 2
+MOVE_FLAG_PROMOTION = 4
+PROMOTION_PIECES = ("N", "B", "R", "Q")
+
+
+def packMove(startSq, endSq, flags=0):
+    return startSq | endSq << 6 | flags << 12
+
+
+# Undo stack: for every ply played, makeMove stores what undoMove cannot recompute
+# from the Move in one int of GameState.undoStates (castling rights index in bits
+# 0-3, en passant square or NO_SQUARE in bits 4-10, captured piece code in bits
+# 11-14, halfmove clock from bit 15) and the position's hash in GameState.undoKeys.
+# Both are preallocated and doubled when a game outgrows them.
+UNDO_STACK_SIZE = 256
+CLONE_STACK_SIZE = 16  # clones and restored positions start small; the stack doubles as needed
+NO_SQUARE = 64
+PIECE_CODES = ("--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_CODE = {piece: code for code, piece in enumerate(PIECE_CODES)}
+HALFMOVE_LIMIT = 0xFFFF  # the clock is stored in 16 bits
+
+# GameState.snapshot() is a plain tuple, so it pickles small and fast:
+# (board as 64 PIECE_CODES bytes, row 0 first; whiteToMove; castling rights index;
+#  en passant square or NO_SQUARE; halfmove clock; ply number; zobristKey;
+#  the hashes of the positions since the last capture or pawn move, as bytes)
+# Earlier positions cannot recur, so those hashes are all repetition detection needs.
+
+# Draw rules, in plies of the halfmove clock and earlier occurrences of a position.
+# Threefold repetition and the fifty-move rule let a player claim a draw; fivefold
+# repetition and the seventy-five-move rule end the game without a claim.
+FIFTY_MOVE_PLIES = 100
+SEVENTY_FIVE_MOVE_PLIES = 150
+THREEFOLD_REPETITIONS = 2
+FIVEFOLD_REPETITIONS = 4
+
+
+# Piece names per colour: pawn, knight, bishop, rook, queen, king
+ATTACKER_NAMES = {"w": ("wp", "wN", "wB", "wR", "wQ", "wK"), "b": ("bp", "bN", "bB", "bR", "bQ", "bK")}
+
+# Piece values for ordering captures in generateMoves and the Analyzer's search
+# (most valuable victim, then least valuable attacker). A legal king capture is
+# never recaptured, so the king goes first among attackers.
+CAPTURE_ORDER_VALUES = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 0}
+
+
+def captureOrder(move):
+    """Sort key putting captures and promotions in MVV-LVA order, largest first."""
+    victim = CAPTURE_ORDER_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+    if move.isPawnPromotion:
+        victim += CAPTURE_ORDER_VALUES[move.promotionChoice]
+    return victim * 16 - CAPTURE_ORDER_VALUES[move.pieceMoved[1]]
+
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {"P": "wp", "R": "wR", "N": "wN", "B": "wB", "Q": "wQ", "K": "wK",
+              "p": "bp", "r": "bR", "n": "bN", "b": "bB", "q": "bQ", "k": "bK"}
+PIECES_TO_FEN = {v: k for k, v in FEN_PIECES.items()}
+
+# Default number of positions whose legal moves and check/mate status GameState
+# remembers (see getValidMoves); 0 turns the cache off.
+POSITION_CACHE_SIZE = 1024
+
+# Castling decisions are logged at DEBUG level; see Instrumentation.py for counters and timers
+logger = logging.getLogger(__name__)
+
+
 class GameState():
-    def __init__(self):
+    def __new__(cls, backend="list", positionCacheSize=POSITION_CACHE_SIZE):
+        # GameState(backend="bitboard") hands back the bitboard implementation, which
+        # keeps this class's public API.
+        if backend == "bitboard" and cls is GameState:
+            from .BitboardEngine import BitboardGameState
+            cls = BitboardGameState
+        elif backend not in ("list", "bitboard"):
+            raise ValueError(f"Unknown backend: {backend}")
+        return super().__new__(cls)
+
+    def __init__(self, backend="list", positionCacheSize=POSITION_CACHE_SIZE):
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
@@ -9,8 +135,7 @@ class GameState():
             ["--", "--", "--", "--", "--", "--", "--", "--"],
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
-        self.moveFunctions = {"p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves, 
-        "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves}
+        self._bindMoveFunctions()
 
         self.whiteToMove = True
         self.moveLog = []
@@ -22,30 +147,210 @@ class GameState():
         self.checks = []
         self.enpassantPossible = ()
         self.currentCastlingRight = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        self.halfmoveClock = 0  # plies since the last capture or pawn move
+        self.undoStates = array("I", bytes(4 * UNDO_STACK_SIZE))
+        self.undoKeys = array("Q", bytes(8 * UNDO_STACK_SIZE))
+        self.redoStack = []
+        # True while moveLog, the undo stack and redoStack are shared with a clone;
+        # whichever side writes first copies them (see clone)
+        self.historyShared = False
+        self.zobristKey = self.computeZobristKey()
+        # Hashes of positions before the first move of moveLog that can still repeat
+        # (set by restore and clone); oldest first
+        self.priorKeys = array("Q")
+        self.repetitionDraw = False  # threefold repetition: a draw can be claimed
+        self.fiftyMoveDraw = False  # fifty moves without a capture or pawn move: a draw can be claimed
+        self.fivefoldRepetition = False  # drawn without a claim
+        self.seventyFiveMoveDraw = False  # drawn without a claim
+        self.fenStartPly = 0  # ply number of the first position, for the FEN move counter
+        # zobristKey -> (moves, inCheck, checkMate, staleMate), least recently used first
+        self.positionCache = OrderedDict()
+        self.positionCacheSize = positionCacheSize
+        self.cacheHits = 0
+        self.cacheMisses = 0
+
+    def loadFen(self, fen):
+        """Sets up the position described by a FEN string and clears the move history.
+
+        Every field is checked before anything is assigned, so a ValueError leaves
+        the GameState as it was.
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"Invalid FEN: {fen}")
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError(f"Invalid FEN: {fen}")
+        board = []
+        kings = {"K": [], "k": []}
+        for r, rowText in enumerate(rows):
+            row = []
+            for ch in rowText:
+                if ch.isdigit():
+                    row.extend(["--"] * int(ch))
+                elif ch in FEN_PIECES:
+                    row.append(FEN_PIECES[ch])
+                    if ch in kings:
+                        kings[ch].append((r, len(row) - 1))
+                else:
+                    raise ValueError(f"Invalid FEN: {fen}")
+            if len(row) != 8:
+                raise ValueError(f"Invalid FEN: {fen}")
+            board.append(row)
+        if len(kings["K"]) != 1 or len(kings["k"]) != 1:
+            raise ValueError(f"Invalid FEN (each side needs exactly one king): {fen}")
+        if fields[1] not in ("w", "b"):
+            raise ValueError(f"Invalid FEN: {fen}")
+        whiteToMove = fields[1] == "w"
+        castling = fields[2]
+        if castling != "-" and (not castling or any(ch not in "KQkq" for ch in castling)):
+            raise ValueError(f"Invalid FEN: {fen}")
+        if fields[3] == "-":
+            enpassantPossible = ()
+        elif len(fields[3]) == 2 and fields[3][0] in Move.filesToCols and fields[3][1] in Move.ranksToRows:
+            enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        else:
+            raise ValueError(f"Invalid FEN: {fen}")
+        try:
+            halfmoveClock = min(int(fields[4]), HALFMOVE_LIMIT) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"Invalid FEN: {fen}") from None
+        if halfmoveClock < 0 or fullmoveNumber < 1:
+            raise ValueError(f"Invalid FEN: {fen}")
+
+        self.board = board
+        self.whiteKingLocation = kings["K"][0]
+        self.blackKingLocation = kings["k"][0]
+        self.whiteToMove = whiteToMove
+        self.currentCastlingRight = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        self.enpassantPossible = enpassantPossible
+        self.halfmoveClock = halfmoveClock
+        self.fenStartPly = 2 * (fullmoveNumber - 1) + (0 if whiteToMove else 1)
+        self.moveLog = []
         self.redoStack = []
-        self.positionCounts = {}
-        self.repetitionDraw = False
+        self.checkMate = False
+        self.staleMate = False
+        self.pins = []
+        self.checks = []
+        self.zobristKey = self.computeZobristKey()
+        self.resetRepetition()
+
+    def getFen(self):
+        """Returns the current position as a FEN string."""
+        rows = []
+        for row in self.board:
+            text = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    if empty:
+                        text += str(empty)
+                        empty = 0
+                    text += PIECES_TO_FEN[piece]
+            if empty:
+                text += str(empty)
+            rows.append(text)
+        rights = self.currentCastlingRight
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = "-"
+        fullmoveNumber = (self.fenStartPly + len(self.moveLog)) // 2 + 1
+        return f"{'/'.join(rows)} {'w' if self.whiteToMove else 'b'} {castling or '-'} {enpassant} {self.halfmoveClock} {fullmoveNumber}"
+
+
+    def computeZobristKey(self):
+        """Builds the Zobrist key of the current position from scratch.
 
+        makeMove/undoMove keep self.zobristKey up to date incrementally; this is only
+        needed when the position is set up by other means.
+        """
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r][c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.currentCastlingRight.index()]
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT_FILE[self.enpassantPossible[1]]
+        return key
 
     def getPositionHash(self):
         # Hash includes board, side to move, castling rights, en passant
-        board_str = ''.join([''.join(row) for row in self.board])
-        castling = f"{self.currentCastlingRight.wks}{self.currentCastlingRight.bks}{self.currentCastlingRight.wqs}{self.currentCastlingRight.bqs}"
-        ep = str(self.enpassantPossible)
-        stm = 'w' if self.whiteToMove else 'b'
-        return board_str + stm + castling + ep
-
-    def updateRepetition(self):
-        h = self.getPositionHash()
-        self.positionCounts[h] = self.positionCounts.get(h, 0) + 1
-        if self.positionCounts[h] >= 3:
-            self.repetitionDraw = True
-        else:
-            self.repetitionDraw = False
+        return self.zobristKey
+
+    def repetitionCount(self, limit=FIVEFOLD_REPETITIONS):
+        """How many times the current position occurred before, counting up to limit.
+
+        Only positions since the last capture or pawn move can be equal to it, and
+        only every other one has the same side to move, so this walks back through
+        at most halfmoveClock / 2 hashes of the undo stack.
+        """
+        key = self.zobristKey
+        ply = len(self.moveLog)
+        stop = ply - self.halfmoveClock
+        keys = self.undoKeys
+        count = 0
+        # A position cannot recur within four plies
+        i = ply - 4
+        while i >= stop and i >= 0:
+            if keys[i] == key:
+                count += 1
+                if count >= limit:
+                    return count
+            i -= 2
+        if i >= stop and self.priorKeys:
+            prior = self.priorKeys
+            while i >= stop and i >= -len(prior):
+                if prior[i] == key:
+                    count += 1
+                    if count >= limit:
+                        return count
+                i -= 2
+        return count
+
+    def isRepetition(self):
+        """Whether the current position occurred before; the search scores it as a draw."""
+        return self.repetitionCount(1) > 0
+
+    def updateDraws(self):
+        """Sets the draw flags for the current position."""
+        repetitions = self.repetitionCount()
+        self.repetitionDraw = repetitions >= THREEFOLD_REPETITIONS
+        self.fivefoldRepetition = repetitions >= FIVEFOLD_REPETITIONS
+        self.fiftyMoveDraw = self.halfmoveClock >= FIFTY_MOVE_PLIES
+        self.seventyFiveMoveDraw = self.halfmoveClock >= SEVENTY_FIVE_MOVE_PLIES
+
+    def makeMove(self, move, clear_redo=True, record=True):
+        """Plays move. With record=False (search, perft) the redo stack and the
+        draw flags are left alone, so the move can be taken back with
+        undoMove(record=False) without touching the game's history."""
+        if self.historyShared:
+            self._unshareHistory()
+        ply = len(self.moveLog)
+        if ply == len(self.undoKeys):
+            self.undoStates.extend(self.undoStates)
+            self.undoKeys.extend(self.undoKeys)
+        rightsIndex = self.currentCastlingRight.index()
+        epSq = NO_SQUARE if self.enpassantPossible == () else self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+        self.undoStates[ply] = rightsIndex | epSq << 4 | PIECE_CODE[move.pieceCaptured] << 11 | self.halfmoveClock << 15
+        self.undoKeys[ply] = self.zobristKey
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[rightsIndex]
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow][move.startCol]
+        if move.isEnpassantMove:
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow][move.endCol]
+        elif move.pieceCaptured != "--":
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endRow][move.endCol]
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT_FILE[self.enpassantPossible[1]]
 
-    def makeMove(self, move, clear_redo=True):
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)
@@ -55,45 +360,63 @@ class GameState():
         elif move.pieceMoved == "bK":
             self.blackKingLocation = (move.endRow, move.endCol)
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + "Q"
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = "--"
         
         if move.pieceMoved[1] == "p" and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ((move.startRow + move.endRow) //2, move.startCol)
+            self.enpassantPossible = SQUARE_COORDS[(move.startRow + move.endRow) // 2 * 8 + move.startCol]
         else:
             self.enpassantPossible = ()
+        if move.pieceMoved[1] == "p" or move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        elif self.halfmoveClock < HALFMOVE_LIMIT:
+            self.halfmoveClock += 1
        
         #castle move
         if move.isCastleMove:
-            print(f"\nExecuting castle move:")
-            print(f"Before castle - King at ({move.startRow}, {move.startCol}) moving to ({move.endRow}, {move.endCol})")
             if move.endCol - move.startCol == 2: #kingside castle
-                print("Kingside castle - Moving rook from h1/h8 to f1/f8")
                 self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol + 1] #moves the rook to f1/f8
                 self.board[move.endRow][move.endCol + 1] = "--" #erase old rook from h1/h8
             else: #queen side castle
-                print("Queenside castle - Moving rook from a1/a8 to d1/d8")
                 self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2] #moves the rook to d1/d8
                 self.board[move.endRow][move.endCol - 2] = "--" #erase old rook from a1/a8
-            print("Board state after castle:")
-            self._printBoard()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Castled %s, king (%d, %d) -> (%d, %d):\n%s", "kingside" if move.endCol > move.startCol else "queenside",
+                             move.startRow, move.startCol, move.endRow, move.endCol, self._boardText())
+            rook = move.pieceMoved[0] + "R"
+            if move.endCol - move.startCol == 2:
+                key ^= ZOBRIST_PIECES[rook][move.endRow][move.endCol + 1] ^ ZOBRIST_PIECES[rook][move.endRow][move.endCol - 1]
+            else:
+                key ^= ZOBRIST_PIECES[rook][move.endRow][move.endCol - 2] ^ ZOBRIST_PIECES[rook][move.endRow][move.endCol + 1]
 
         #update castling rights - whenever its a rook or a king move
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
-        if clear_redo:
-            self.redoStack = []  # Only clear redo stack on user move
-        self.updateRepetition()
+
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]
+        key ^= ZOBRIST_CASTLING[self.currentCastlingRight.index()]
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT_FILE[self.enpassantPossible[1]]
+        self.zobristKey = key
+        if record:
+            if clear_redo:
+                self.redoStack = []  # Only clear redo stack on user move
+            self.updateDraws()
 
 
 
-    def undoMove(self):
+    def undoMove(self, record=True):
+        """Takes back the last move, restoring castling rights, the en passant square,
+        the captured piece, the halfmove clock and the hash from the undo stack."""
+        if self.historyShared:
+            self._unshareHistory()
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
+            ply = len(self.moveLog)
+            state = self.undoStates[ply]
+            captured = PIECE_CODES[state >> 11 & 15]
             self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.board[move.endRow][move.endCol] = captured
             self.whiteToMove = not self.whiteToMove
             if move.pieceMoved == "wK":
                 self.whiteKingLocation = (move.startRow, move.startCol)
@@ -101,16 +424,22 @@ class GameState():
                 self.blackKingLocation = (move.startRow, move.startCol)
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = "--"
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            if move.pieceMoved[1] == "p" and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
-            self.redoStack.append(move)
-            # Remove this position from repetition count
-            h = self.getPositionHash()
-            if h in self.positionCounts:
-                self.positionCounts[h] -= 1
-            self.repetitionDraw = False
+                self.board[move.startRow][move.endCol] = captured
+            if move.isCastleMove:
+                if move.endCol - move.startCol == 2: #kingside castle
+                    self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
+                    self.board[move.endRow][move.endCol - 1] = "--"
+                else: #queen side castle
+                    self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
+                    self.board[move.endRow][move.endCol + 1] = "--"
+            self.currentCastlingRight.setIndex(state & 15)
+            epSq = state >> 4 & 127
+            self.enpassantPossible = () if epSq == NO_SQUARE else SQUARE_COORDS[epSq]
+            self.halfmoveClock = state >> 15
+            self.zobristKey = self.undoKeys[ply]
+            if record:
+                self.redoStack.append(move)
+                self.updateDraws()
 
     def redoMove(self):
         if self.redoStack:
@@ -136,100 +465,317 @@ class GameState():
                     self.currentCastlingRight.bqs = False
                 elif move.startCol == 7: #right rook
                     self.currentCastlingRight.bks = False
+        #a rook captured on its starting square takes its castling right with it
+        if move.pieceCaptured == "wR":
+            if move.endRow == 7:
+                if move.endCol == 0:
+                    self.currentCastlingRight.wqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRight.wks = False
+        elif move.pieceCaptured == "bR":
+            if move.endRow == 0:
+                if move.endCol == 0:
+                    self.currentCastlingRight.bqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRight.bks = False
 
-    def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                        self.currentCastlingRight.wqs, self.currentCastlingRight.bqs) #copy the
-        # ------------------------------------------------------------------
-        # 1. Detect checks and pins FIRST so that move generation respects them
-        # ------------------------------------------------------------------
+    def getValidMoves(self, legalFilter=False):
+        """Returns the legal moves for the side to move and updates checkMate/staleMate.
 
-        inCheckFlag, self.pins, self.checks = self.checkForPinsAndChecks()
+        Results are kept in a least-recently-used cache keyed by zobristKey, which
+        covers everything the moves depend on (pieces, side to move, castling rights,
+        en passant square), so stepping back and forth through a game does not
+        regenerate positions already seen. The caller gets its own list and may
+        modify it. legalFilter=True bypasses the cache; see _generateValidMoves.
+        """
+        if not legalFilter:
+            entry = self._cachedEntry()
+            if entry is not None:
+                self.checkMate, self.staleMate = entry[2], entry[3]
+                return list(entry[0])
+        moves, inCheckFlag = self._generateValidMoves(legalFilter)
+        self.checkMate = inCheckFlag and len(moves) == 0
+        self.staleMate = not inCheckFlag and len(moves) == 0
+        if not legalFilter and self.positionCacheSize:
+            self.positionCache[self.zobristKey] = (tuple(moves), inCheckFlag, self.checkMate, self.staleMate)
+            if len(self.positionCache) > self.positionCacheSize:
+                self.positionCache.popitem(last=False)
+        return moves
+
+    def _cachedEntry(self):
+        """The position cache entry (moves, in check, checkMate, staleMate) for the
+        current position, or None. Counts the lookup as a hit or a miss and keeps a
+        hit from being the next one evicted. Always None when the cache is off."""
+        if not self.positionCacheSize:
+            return None
+        entry = self.positionCache.get(self.zobristKey)
+        if entry is None:
+            self.cacheMisses += 1
+        else:
+            self.cacheHits += 1
+            self.positionCache.move_to_end(self.zobristKey)
+        return entry
+
+    def clearPositionCache(self):
+        """Forgets all cached positions. Needed only if the board is edited directly
+        instead of through makeMove/undoMove/loadFen."""
+        self.positionCache.clear()
+
+    def getPositionCacheStats(self):
+        lookups = self.cacheHits + self.cacheMisses
+        return {"size": len(self.positionCache), "maxSize": self.positionCacheSize, "hits": self.cacheHits,
+                "misses": self.cacheMisses, "hitRate": self.cacheHits / lookups if lookups else 0.0}
 
+    def _generateValidMoves(self, legalFilter=False):
+        """Generates the legal moves; returns (moves, whether the side to move is in check).
+
+        Moves are legal by construction: pins, check evasion, king safety and the en
+        passant discovered-check case are all handled during generation. Passing
+        legalFilter=True additionally plays every candidate with makeMove/undoMove
+        and drops any that leave the king in check; it is much slower and only
+        meant as a reference for checking the generator.
+        """
         # ------------------------------------------------------------------
-        # 2. Generate all standard (non-castling) moves. Because self.pins has been
-        #    set, the individual piece-move generators will correctly prune moves
-        #    for pinned pieces.
+        # 1. Detect checks and pins FIRST so that move generation respects them
         # ------------------------------------------------------------------
 
-        moves = self.getAllPossibleMoves()
+        inCheckFlag, self.pins, self.checks = self.checkForPinsAndChecks()
 
         if self.whiteToMove:
             kingRow, kingCol = self.whiteKingLocation
         else:
             kingRow, kingCol = self.blackKingLocation
 
+        # ------------------------------------------------------------------
+        # 2. Generate the moves. Because self.pins has been set, the individual
+        #    piece-move generators only produce moves that keep pinned pieces on
+        #    their pin line; king moves never step onto an attacked square and en
+        #    passant captures are checked against the king directly.
+        # ------------------------------------------------------------------
+
         if inCheckFlag:
             if len(self.checks) == 1:
                 moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                checkRow, checkCol, checkDirRow, checkDirCol = check
-                pieceChecking = self.board[checkRow][checkCol]
+                validSquares = self._checkBlockSquares(kingRow, kingCol, self.checks[0])
 
-                validSquares = []
-                if pieceChecking[1] == "N":  # Knight checks can only be blocked by capturing
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + checkDirRow * i, kingCol + checkDirCol * i)
-                        validSquares.append(validSquare)
-                        if validSquare == (checkRow, checkCol):
-                            break
-
-                # Remove moves that don't block or capture the checking piece
+                # Remove moves that don't block or capture the checking piece. En passant
+                # captures were already tested against the king by the pawn generator.
                 for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != "K":
+                    if moves[i].pieceMoved[1] != "K" and not moves[i].isEnpassantMove:
                         if (moves[i].endRow, moves[i].endCol) not in validSquares:
                             moves.pop(i)
             else:
-                # Double check — only king moves are legal. Clear other moves first.
+                # Double check — only king moves are legal.
                 moves = []
                 self.getKingMoves(kingRow, kingCol, moves)
         else:
+            moves = self.getAllPossibleMoves()
             # King is not in check – we can now consider castling moves.
-            if self.whiteToMove:
-                self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
-            else:
-                self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
+            self.getCastleMoves(kingRow, kingCol, moves)
 
         # ------------------------------------------------------------------
-        # 3. Final legality filter – ensure no move leaves own king in check
+        # 3. Optional reference filter – ensure no move leaves own king in check
         # ------------------------------------------------------------------
 
-        legalMoves = []
-        for move in moves:
-            self.makeMove(move)
-            # After making the move, the turn has switched to the opponent. Switch it back
-            # temporarily so `inCheck()` tests OUR king, not the opponent's.
-            self.whiteToMove = not self.whiteToMove
-            isOwnKingInCheck = self.inCheck()
-            self.whiteToMove = not self.whiteToMove  # restore turn indicator
-            self.undoMove()
-            if not isOwnKingInCheck:
-                legalMoves.append(move)
+        if legalFilter:
+            legalMoves = []
+            for move in moves:
+                self.makeMove(move, record=False)
+                # The turn has passed to the opponent; test whether they attack OUR king
+                if self.whiteToMove:
+                    isOwnKingInCheck = self.isSquareAttacked(self.blackKingLocation[0], self.blackKingLocation[1], "w")
+                else:
+                    isOwnKingInCheck = self.isSquareAttacked(self.whiteKingLocation[0], self.whiteKingLocation[1], "b")
+                self.undoMove(record=False)
+                if not isOwnKingInCheck:
+                    legalMoves.append(move)
+            moves = legalMoves
 
-        # ------------------------------------------------------------------
-        # 4. Determine checkmate or stalemate conditions (after legality filter)
-        # ------------------------------------------------------------------
+        return moves, inCheckFlag
 
-        if len(legalMoves) == 0:
-            # Recompute to be absolutely certain, ignoring earlier cached value
-            currentInCheck = self.inCheck()
-            if currentInCheck:
-                self.checkMate = True
-                self.staleMate = False
-            else:
-                self.staleMate = True
-                self.checkMate = False
+
+    def getValidMovesPacked(self):
+        """Same as getValidMoves, as an array('H') of packed moves (see packMove)."""
+        return array("H", [move.packed for move in self.getValidMoves()])
+
+    def _checkBlockSquares(self, kingRow, kingCol, check):
+        """Squares that end a single check (an entry of self.checks) when a piece other
+        than the king moves there: the checker's square and any between it and the king."""
+        checkRow, checkCol, checkDirRow, checkDirCol = check
+        if self.board[checkRow][checkCol][1] == "N":  # Knight checks can only be blocked by capturing
+            return [(checkRow, checkCol)]
+        validSquares = []
+        for i in range(1, 8):
+            validSquare = (kingRow + checkDirRow * i, kingCol + checkDirCol * i)
+            validSquares.append(validSquare)
+            if validSquare == (checkRow, checkCol):
+                break
+        return validSquares
+
+    # ------------------------------------------------------------------
+    # Staged generation
+    # ------------------------------------------------------------------
+
+    def generateMoves(self):
+        """Yields the legal moves in stages: captures and promotions in captureOrder
+        (most valuable victim, then least valuable attacker), then quiet moves one
+        piece at a time, then castling.
+
+        The capture stage only looks for the first piece along each line, so quiet
+        moves are only generated if the consumer keeps going, and castling (which
+        needs attack tests on the king's path) comes last. The consumer may stop at
+        any point, and may make and take back moves between items. Unlike
+        getValidMoves this does not set checkMate/staleMate; use hasLegalMove for
+        that. Positions in the position cache are staged from the cached list instead.
+        """
+        entry = self._cachedEntry()
+        if entry is not None:
+            yield from self._stageMoves(entry[0])
+            return
+        inCheckFlag, pins, checks = self.checkForPinsAndChecks()
+        self.pins, self.checks = list(pins), checks
+        captures = self._generateCaptures(pins, checks)
+        captures.sort(key=captureOrder, reverse=True)
+        yield from captures
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        for moves in self._legalPieceMoves(pins, checks, kingRow, kingCol):
+            for move in moves:
+                if move.pieceCaptured == "--" and not move.isPawnPromotion:
+                    yield move
+        if not inCheckFlag:
+            moves = []
+            self.getCastleMoves(kingRow, kingCol, moves)
+            yield from moves
+
+    def _stageMoves(self, moves):
+        """Yields a complete legal move list in the order of generateMoves."""
+        captures = [move for move in moves if move.pieceCaptured != "--" or move.isPawnPromotion]
+        captures.sort(key=captureOrder, reverse=True)
+        yield from captures
+        yield from [move for move in moves if move.pieceCaptured == "--" and not move.isPawnPromotion
+                    and not move.isCastleMove]
+        yield from [move for move in moves if move.isCastleMove]
+
+    def hasLegalMove(self):
+        """Whether the side to move has any legal move, stopping at the first one
+        found, and sets checkMate/staleMate like getValidMoves. Use it instead of
+        getValidMoves when only the end of the game matters."""
+        entry = self._cachedEntry()
+        if entry is not None:
+            self.checkMate, self.staleMate = entry[2], entry[3]
+            return len(entry[0]) > 0
+        inCheckFlag, pins, checks = self.checkForPinsAndChecks()
+        self.pins, self.checks = list(pins), checks
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        # Castling is never the only legal move: the king could step to the square it passes
+        for moves in self._legalPieceMoves(pins, checks, kingRow, kingCol):
+            if moves:
+                self.checkMate = self.staleMate = False
+                return True
+        self.checkMate = inCheckFlag
+        self.staleMate = not inCheckFlag
+        return False
+
+    def _legalPieceMoves(self, pins, checks, kingRow, kingCol):
+        """Yields the legal moves of each piece of the side to move, other than
+        castling, as one list per piece; the king first when in check."""
+        board = self.board
+        if len(checks) > 1:
+            squares = [(kingRow, kingCol)]  # Double check — only king moves are legal.
+        elif checks:
+            squares = [(kingRow, kingCol)] + [(r, c) for r in range(8) for c in range(8)
+                                              if board[r][c][0] == board[kingRow][kingCol][0] and board[r][c][1] != "K"]
         else:
-            self.checkMate = False
-            self.staleMate = False
+            squares = [(r, c) for r in range(8) for c in range(8) if board[r][c][0] == board[kingRow][kingCol][0]]
+        validSquares = self._checkBlockSquares(kingRow, kingCol, checks[0]) if len(checks) == 1 else None
+        for r, c in squares:
+            moves = []
+            # Callers may search between items, which resets self.pins
+            self.pins = list(pins)
+            self.moveFunctions[board[r][c][1]](r, c, moves)
+            if validSquares is not None and (r, c) != (kingRow, kingCol):
+                moves = [move for move in moves if move.isEnpassantMove or (move.endRow, move.endCol) in validSquares]
+            yield moves
+
+    def _generateCaptures(self, pins, checks):
+        """The legal captures and promotions of the side to move, unordered."""
+        board = self.board
+        us, them = ("w", "b") if self.whiteToMove else ("b", "w")
+        kingRow, kingCol = self.whiteKingLocation if us == "w" else self.blackKingLocation
+        pinDirections = {(r, c): (dr, dc) for r, c, dr, dc in pins}
+        moves = []
+
+        # King captures, tested with the king lifted off the board like getKingMoves
+        king = board[kingRow][kingCol]
+        board[kingRow][kingCol] = "--"
+        for endRow, endCol in KING_TARGETS[kingRow][kingCol]:
+            if board[endRow][endCol][0] == them and not self.isSquareAttacked(endRow, endCol, them):
+                moves.append((endRow, endCol))
+        board[kingRow][kingCol] = king
+        moves = [Move((kingRow, kingCol), endSq, board) for endSq in moves]
+        if len(checks) > 1:
+            return moves
+
+        validSquares = self._checkBlockSquares(kingRow, kingCol, checks[0]) if checks else None
+        forward = -1 if us == "w" else 1
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != us or piece[1] == "K":
+                    continue
+                kind = piece[1]
+                pin = pinDirections.get((r, c))
+                if kind == "N" and pin is not None:
+                    continue
+                targets = []
+                if kind == "p":
+                    for endCol in (c - 1, c + 1):
+                        if 0 <= endCol <= 7 and board[r + forward][endCol][0] == them:
+                            targets.append((r + forward, endCol))
+                elif kind == "N":
+                    targets = [(endRow, endCol) for endRow, endCol in KNIGHT_TARGETS[r][c] if board[endRow][endCol][0] == them]
+                else:
+                    rays = DIAGONAL_RAYS[r][c] if kind == "B" else ORTHOGONAL_RAYS[r][c]
+                    if kind == "Q":
+                        rays = rays + DIAGONAL_RAYS[r][c]
+                    for ray in rays:
+                        for endRow, endCol in ray:
+                            if board[endRow][endCol] != "--":
+                                if board[endRow][endCol][0] == them:
+                                    targets.append((endRow, endCol))
+                                break
+                for endRow, endCol in targets:
+                    if validSquares is not None and (endRow, endCol) not in validSquares:
+                        continue
+                    if pin is not None:
+                        direction = ((endRow > r) - (endRow < r), (endCol > c) - (endCol < c))
+                        if direction != pin and direction != (-pin[0], -pin[1]):
+                            continue
+                    if kind == "p" and (endRow == 0 or endRow == 7):
+                        for promotion in PROMOTION_PIECES:
+                            moves.append(Move((r, c), (endRow, endCol), board, promotionChoice=promotion))
+                    else:
+                        moves.append(Move((r, c), (endRow, endCol), board))
 
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRight = tempCastleRights
-        return legalMoves
+        if self.enpassantPossible != ():
+            endRow, endCol = self.enpassantPossible
+            for startCol in (endCol - 1, endCol + 1):
+                # Tested against the king directly, like getPawnMoves; this also covers check evasion
+                if 0 <= startCol <= 7 and board[endRow - forward][startCol] == us + "p" and \
+                        self.enpassantIsSafe(endRow - forward, startCol, endCol):
+                    moves.append(Move((endRow - forward, startCol), (endRow, endCol), board, isEnpassantMove=True))
 
+        # Promotions without a capture
+        startRow = 1 if us == "w" else 6
+        for c in range(8):
+            if board[startRow][c] != us + "p" or board[startRow + forward][c] != "--":
+                continue
+            pin = pinDirections.get((startRow, c))
+            if (pin is not None and pin[1] != 0) or (validSquares is not None and (startRow + forward, c) not in validSquares):
+                continue
+            for piece in PROMOTION_PIECES:
+                moves.append(Move((startRow, c), (startRow + forward, c), board, promotionChoice=piece))
+        return moves
 
     def checkForPinsAndChecks(self):
         pins = []
@@ -289,20 +835,84 @@ class GameState():
         return inCheck, pins, checks
 
     def inCheck(self):
+        entry = self._cachedEntry()
+        if entry is not None:
+            return entry[1]
+        return self._kingAttacked()
+
+    def _kingAttacked(self):
         if self.whiteToMove:
             return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
         else:
             return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
+        """True if the side not to move attacks square (r, c)."""
+        return self.isSquareAttacked(r, c, "b" if self.whiteToMove else "w")
+
+    def isSquareAttacked(self, r, c, color):
+        """True if any piece of `color` attacks square (r, c).
+
+        Looks outward from the square along the precomputed knight, king, pawn and
+        ray tables instead of generating the attacker's moves.
+        """
+        board = self.board
+        pawn, knight, bishop, rook, queen, king = ATTACKER_NAMES[color]
+        for endRow, endCol in PAWN_ATTACKER_SQUARES[color][r][c]:
+            if board[endRow][endCol] == pawn:
+                return True
+        for endRow, endCol in KNIGHT_TARGETS[r][c]:
+            if board[endRow][endCol] == knight:
+                return True
+        for endRow, endCol in KING_TARGETS[r][c]:
+            if board[endRow][endCol] == king:
                 return True
+        for ray in ORTHOGONAL_RAYS[r][c]:
+            for endRow, endCol in ray:
+                endPiece = board[endRow][endCol]
+                if endPiece != "--":
+                    if endPiece == rook or endPiece == queen:
+                        return True
+                    break
+        for ray in DIAGONAL_RAYS[r][c]:
+            for endRow, endCol in ray:
+                endPiece = board[endRow][endCol]
+                if endPiece != "--":
+                    if endPiece == bishop or endPiece == queen:
+                        return True
+                    break
         return False
 
+    def attackersTo(self, r, c, color):
+        """Returns the (row, col) of every piece of `color` that attacks square (r, c)."""
+        board = self.board
+        pawn, knight, bishop, rook, queen, king = ATTACKER_NAMES[color]
+        attackers = []
+        for endRow, endCol in PAWN_ATTACKER_SQUARES[color][r][c]:
+            if board[endRow][endCol] == pawn:
+                attackers.append((endRow, endCol))
+        for endRow, endCol in KNIGHT_TARGETS[r][c]:
+            if board[endRow][endCol] == knight:
+                attackers.append((endRow, endCol))
+        for endRow, endCol in KING_TARGETS[r][c]:
+            if board[endRow][endCol] == king:
+                attackers.append((endRow, endCol))
+        for ray in ORTHOGONAL_RAYS[r][c]:
+            for endRow, endCol in ray:
+                endPiece = board[endRow][endCol]
+                if endPiece != "--":
+                    if endPiece == rook or endPiece == queen:
+                        attackers.append((endRow, endCol))
+                    break
+        for ray in DIAGONAL_RAYS[r][c]:
+            for endRow, endCol in ray:
+                endPiece = board[endRow][endCol]
+                if endPiece != "--":
+                    if endPiece == bishop or endPiece == queen:
+                        attackers.append((endRow, endCol))
+                    break
+        return attackers
+
     def getAllPossibleMoves(self):
         moves = []
         for r in range (len(self.board)):
@@ -324,42 +934,54 @@ class GameState():
                 break
 
         if self.whiteToMove:
-            if self.board[r - 1][c] == "--":
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((r, c), (r-1, c), self.board))
-                    if r == 6 and self.board[r - 2][c] == "--":
-                        moves.append(Move((r, c), (r-2, c), self.board))
-            if c - 1 >= 0:
-                if self.board[r - 1][c - 1][0] == "b":
-                    if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((r, c), (r-1, c-1), self.board))
-                elif (r-1, c-1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r-1, c-1), self.board, isEnpassantMove = True))
-
-            if c + 1 <= 7:
-                if self.board[r - 1][c + 1][0] == "b":
-                    if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((r, c), (r-1, c+1), self.board))
-                elif (r-1, c+1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r-1, c+1), self.board, isEnpassantMove = True))
+            moveAmount = -1
+            startRow = 6
+            enemyColor = "b"
+        else:
+            moveAmount = 1
+            startRow = 1
+            enemyColor = "w"
+
+        if self.board[r + moveAmount][c] == "--":
+            if not piecePinned or pinDirection == (moveAmount, 0) or pinDirection == (-moveAmount, 0):
+                self.appendPawnMove((r, c), (r + moveAmount, c), moves)
+                if r == startRow and self.board[r + 2 * moveAmount][c] == "--":
+                    moves.append(Move((r, c), (r + 2 * moveAmount, c), self.board))
+        for dc in (-1, 1):
+            if 0 <= c + dc <= 7:
+                if self.board[r + moveAmount][c + dc][0] == enemyColor:
+                    if not piecePinned or pinDirection == (moveAmount, dc) or pinDirection == (-moveAmount, -dc):
+                        self.appendPawnMove((r, c), (r + moveAmount, c + dc), moves)
+                elif (r + moveAmount, c + dc) == self.enpassantPossible and self.enpassantIsSafe(r, c, c + dc):
+                    moves.append(Move((r, c), (r + moveAmount, c + dc), self.board, isEnpassantMove = True))
+
+    def appendPawnMove(self, startSq, endSq, moves):
+        """Appends a pawn move, as one move per promotion piece when it reaches the last rank."""
+        if endSq[0] == 0 or endSq[0] == 7:
+            for piece in PROMOTION_PIECES:
+                moves.append(Move(startSq, endSq, self.board, promotionChoice=piece))
+        else:
+            moves.append(Move(startSq, endSq, self.board))
+
+    def enpassantIsSafe(self, r, c, endCol):
+        """True if the pawn on (r, c) can capture en passant onto column endCol without
+        exposing its own king. Both pawns leave the same rank at once, so this is tried
+        on the board directly rather than through the pin table.
+        """
+        pawn = self.board[r][c]
+        endRow = self.enpassantPossible[0]
+        capturedPawn = self.board[r][endCol]
+        self.board[r][c] = "--"
+        self.board[r][endCol] = "--"
+        self.board[endRow][endCol] = pawn
+        if pawn[0] == "w":
+            safe = not self.isSquareAttacked(self.whiteKingLocation[0], self.whiteKingLocation[1], "b")
         else:
-            if self.board[r+1][c] == "--":
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((r, c), (r+1, c), self.board))
-                    if r == 1 and self.board[r + 2][c] == "--":
-                        moves.append(Move((r, c), (r + 2, c), self.board))
-            if c - 1 >= 0:
-                if self.board[r + 1][c - 1][0] == "w":
-                    if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r+1, c-1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r+1, c-1), self.board, isEnpassantMove = True))
-            if c + 1 <= 7:
-                if self.board[r + 1][c + 1][0] == "w":
-                    if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r+1, c+1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r+1, c+1), self.board, isEnpassantMove = True))
+            safe = not self.isSquareAttacked(self.blackKingLocation[0], self.blackKingLocation[1], "w")
+        self.board[endRow][endCol] = "--"
+        self.board[r][endCol] = capturedPawn
+        self.board[r][c] = pawn
+        return safe
 
     def getRookMoves(self, r, c, moves):
         piecePinned = False
@@ -446,75 +1068,164 @@ class GameState():
         self.getBishopMoves(r, c, moves)
 
     def getKingMoves(self, r, c, moves):
-        rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        colMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
         allyColor = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            endRow = r + rowMoves[i]
-            endCol = c + colMoves[i]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    if allyColor == "w":
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheckFlag, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheckFlag:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    if allyColor == "w":
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
+        enemyColor = "b" if self.whiteToMove else "w"
+        # Lift the king off the board while testing targets so it cannot shield a
+        # square that lies on a ray through its current position.
+        king = self.board[r][c]
+        self.board[r][c] = "--"
+        targets = []
+        for endRow, endCol in KING_TARGETS[r][c]:
+            if self.board[endRow][endCol][0] != allyColor and not self.isSquareAttacked(endRow, endCol, enemyColor):
+                targets.append((endRow, endCol))
+        self.board[r][c] = king
+        for endSq in targets:
+            moves.append(Move((r, c), endSq, self.board))
 
 
     """
     get Castle moves
     """
     def getCastleMoves(self, r, c, moves):
-        print(f"\nChecking castle moves for {'white' if self.whiteToMove else 'black'} at row {r}, col {c}")
         if self.squareUnderAttack(r, c):
-            print("Cannot castle: King is in check")
+            logger.debug("%s cannot castle: king is in check", "White" if self.whiteToMove else "Black")
             return #cant castle while in check
         if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
-            print("Checking kingside castle possibility")
             self.getKingsideCastleMoves(r, c, moves)
         if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
-            print("Checking queenside castle possibility")
             self.getQueensideCastleMoves(r, c, moves)
         
 
     def getKingsideCastleMoves(self, r, c, moves):
-        print(f"Kingside castle check - squares empty? {self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--'}")
         if self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--":
             if not self.squareUnderAttack(r, c + 1) and not self.squareUnderAttack(r, c + 2):
-                print("Adding kingside castle move")
                 moves.append(Move((r, c), (r, c + 2), self.board, isCastleMove=True))
             else:
-                print("Cannot castle kingside: Path through check")
+                logger.debug("%s cannot castle kingside: path through check", "White" if self.whiteToMove else "Black")
 
     def getQueensideCastleMoves(self, r, c, moves):
-        print(f"Queenside castle check - squares empty? {self.board[r][c-1] == '--' and self.board[r][c-2] == '--'}")
-        if self.board[r][c-1] == "--" and self.board[r][c-2] == "--":
+        if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
             if not self.squareUnderAttack(r, c - 1) and not self.squareUnderAttack(r, c - 2):
-                print("Adding queenside castle move")
                 moves.append(Move((r, c), (r, c - 2), self.board, isCastleMove=True))
             else:
-                print("Cannot castle queenside: Path through check")
+                logger.debug("%s cannot castle queenside: path through check", "White" if self.whiteToMove else "Black")
+
+    # ------------------------------------------------------------------
+    # Snapshots and clones
+    # ------------------------------------------------------------------
+
+    def snapshot(self):
+        """The current position as a compact, picklable tuple (layout above
+        UNDO_STACK_SIZE), for handing to another process or restoring later.
+        The move history is not included, only what repetition detection needs."""
+        epSq = NO_SQUARE if self.enpassantPossible == () else self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+        board = bytes([PIECE_CODE[piece] for row in self.board for piece in row])
+        return (board, self.whiteToMove, self.currentCastlingRight.index(), epSq, self.halfmoveClock,
+                self.fenStartPly + len(self.moveLog), self.zobristKey, self._recentKeys().tobytes())
+
+    def restore(self, snapshot):
+        """Sets up the position of a snapshot() and clears the move history, like loadFen."""
+        board, whiteToMove, rightsIndex, epSq, halfmoveClock, ply, key, history = snapshot
+        self.board = [[PIECE_CODES[code] for code in board[r:r + 8]] for r in range(0, 64, 8)]
+        self.whiteKingLocation = SQUARE_COORDS[board.index(PIECE_CODE["wK"])]
+        self.blackKingLocation = SQUARE_COORDS[board.index(PIECE_CODE["bK"])]
+        self.whiteToMove = whiteToMove
+        self.currentCastlingRight = CastleRights(False, False, False, False)
+        self.currentCastlingRight.setIndex(rightsIndex)
+        self.enpassantPossible = () if epSq == NO_SQUARE else SQUARE_COORDS[epSq]
+        self.halfmoveClock = halfmoveClock
+        self.zobristKey = key
+        self.checkMate = False
+        self.staleMate = False
+        self.pins = []
+        self.checks = []
+        keys = array("Q")
+        keys.frombytes(history)
+        self._startHistory(ply, keys)
+
+    def clone(self, shareHistory=False):
+        """A copy of this GameState that can be played on independently, without
+        the cost of a new GameState and a replay of the game.
+
+        By default the clone starts a fresh history at the current position (it
+        cannot undo past it, but still sees repetitions of earlier positions).
+        With shareHistory=True it also gets the moves played so far: both sides
+        share moveLog, the undo stack and redoStack until one of them makes or
+        takes back a move, which copies them first. The clone has its
+        own, empty position cache.
+        """
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.board = [row[:] for row in self.board]
+        other.currentCastlingRight = CastleRights(False, False, False, False)
+        other.currentCastlingRight.setIndex(self.currentCastlingRight.index())
+        other.pins = list(self.pins)
+        other.checks = list(self.checks)
+        other.positionCache = OrderedDict()
+        other.cacheHits = 0
+        other.cacheMisses = 0
+        other._bindMoveFunctions()
+        if shareHistory:
+            self.historyShared = other.historyShared = True
+        else:
+            other._startHistory(self.fenStartPly + len(self.moveLog), self._recentKeys())
+        return other
+
+    def __reduce__(self):
+        # Pickling sends the snapshot, not the history, cache and bound methods
+        return (_restoredGameState, (type(self), self.snapshot()))
+
+    def _recentKeys(self):
+        """array("Q") of the hashes of the positions since the last capture or pawn
+        move, oldest first, not counting the current one."""
+        ply = len(self.moveLog)
+        count = min(self.halfmoveClock, ply + len(self.priorKeys))
+        if count <= ply:
+            return self.undoKeys[ply - count:ply]
+        return self.priorKeys[len(self.priorKeys) - (count - ply):] + self.undoKeys[:ply]
+
+    def _startHistory(self, ply, keys):
+        """Empty move history at ply number ply; keys are the hashes of the earlier
+        positions that can still repeat."""
+        self.fenStartPly = ply
+        self.moveLog = []
+        self.redoStack = []
+        self.undoStates = array("I", bytes(4 * CLONE_STACK_SIZE))
+        self.undoKeys = array("Q", bytes(8 * CLONE_STACK_SIZE))
+        self.historyShared = False
+        self.priorKeys = keys
+        self.updateDraws()
+
+    def _unshareHistory(self):
+        self.moveLog = list(self.moveLog)
+        self.undoStates = array("I", self.undoStates)
+        self.undoKeys = array("Q", self.undoKeys)
+        self.redoStack = list(self.redoStack)
+        self.historyShared = False
 
     # ------------------------------------------------------------------
     # Utility helpers
     # ------------------------------------------------------------------
 
-    def _printBoard(self):
-        """Pretty-prints the current board to stdout for debugging purposes."""
-        for row in self.board:
-            print(" ".join(piece.ljust(2) for piece in row))
-        print()
+    def _bindMoveFunctions(self):
+        self.moveFunctions = {"p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves,
+                              "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves}
+
+    def _boardText(self):
+        """The board as text, one rank per line, for debug logging."""
+        return "\n".join(" ".join(piece.ljust(2) for piece in row) for row in self.board)
 
     def resetRepetition(self):
-        self.positionCounts = {}
-        self.repetitionDraw = False
+        """Forgets the positions before the first move of moveLog, so they no longer
+        count as repetitions, and updates the draw flags."""
+        self.priorKeys = array("Q")
+        self.updateDraws()
+
+
+def _restoredGameState(cls, snapshot):
+    gs = cls()
+    gs.restore(snapshot)
+    return gs
 
 
 class CastleRights():
@@ -524,8 +1235,27 @@ class CastleRights():
         self.wqs = wqs
         self.bqs = bqs
 
+    def index(self):
+        """Packs the four rights into 0..15 (used to pick the Zobrist castling key)."""
+        return self.wks | (self.bks << 1) | (self.wqs << 2) | (self.bqs << 3)
+
+    def setIndex(self, index):
+        """Sets the four rights from an index() value."""
+        self.wks = bool(index & 1)
+        self.bks = bool(index & 2)
+        self.wqs = bool(index & 4)
+        self.bqs = bool(index & 8)
+
 
 class Move():
+    """A move between two squares, with the pieces involved read from the board.
+
+    Every move also has a 16-bit packed form (see packMove) that generators and
+    archives can store in array('H') lists; Move.fromPacked turns it back into a
+    Move for the UI and getChessNotation.
+    """
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "isPawnPromotion", "promotionChoice", "isEnpassantMove", "isCastleMove", "moveID")
 
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
                    "5": 3, "6": 2, "7": 1, "8": 0}
@@ -534,7 +1264,7 @@ class Move():
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove = False):
+    def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove = False, promotionChoice = "Q"):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -542,6 +1272,7 @@ class Move():
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
         self.isPawnPromotion = (self.pieceMoved == "wp" and self.endRow == 0) or (self.pieceMoved == "bp" and self.endRow == 7)
+        self.promotionChoice = promotionChoice
         self.isEnpassantMove = isEnpassantMove
         if self.isEnpassantMove:
             self.pieceCaptured = "wp" if self.pieceMoved == "bp" else "bp"
@@ -550,14 +1281,65 @@ class Move():
 
         self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
 
+    @classmethod
+    def fromPacked(cls, packed, board):
+        """Builds the Move described by a packMove() value on the given board."""
+        move = object.__new__(cls)
+        startRow = packed >> 3 & 7
+        startCol = packed & 7
+        endRow = packed >> 9 & 7
+        endCol = packed >> 6 & 7
+        flags = packed >> 12
+        move.startRow = startRow
+        move.startCol = startCol
+        move.endRow = endRow
+        move.endCol = endCol
+        pieceMoved = board[startRow][startCol]
+        move.pieceMoved = pieceMoved
+        if flags:
+            move.isEnpassantMove = flags == MOVE_FLAG_ENPASSANT
+            move.pieceCaptured = ("wp" if pieceMoved == "bp" else "bp") if move.isEnpassantMove else board[endRow][endCol]
+            move.isCastleMove = flags == MOVE_FLAG_CASTLE
+            move.isPawnPromotion = flags >= MOVE_FLAG_PROMOTION
+            move.promotionChoice = PROMOTION_PIECES[flags & 3] if move.isPawnPromotion else "Q"
+        else:
+            move.pieceCaptured = board[endRow][endCol]
+            move.isEnpassantMove = move.isCastleMove = move.isPawnPromotion = False
+            move.promotionChoice = "Q"
+        move.moveID = startRow * 1000 + startCol * 100 + endRow * 10 + endCol
+        return move
+
+    @property
+    def packed(self):
+        if self.isPawnPromotion:
+            flags = MOVE_FLAG_PROMOTION | PROMOTION_PIECES.index(self.promotionChoice)
+        elif self.isEnpassantMove:
+            flags = MOVE_FLAG_ENPASSANT
+        elif self.isCastleMove:
+            flags = MOVE_FLAG_CASTLE
+        else:
+            flags = 0
+        return packMove(self.startRow * 8 + self.startCol, self.endRow * 8 + self.endCol, flags)
+
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.moveID == other.moveID
+            return self.moveID == other.moveID and self.promotionChoice == other.promotionChoice
         return False
 
+    def __hash__(self):
+        return hash(self.moveID)
+
 
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionChoice.lower()
+        return notation
 
     def getRankFile(self, r, c):
-        return self.colsToFiles[c] + self.rowsToRanks[r]
\ No newline at end of file
+        return self.colsToFiles[c] + self.rowsToRanks[r]
+
+
+if os.environ.get("CHESS_INSTRUMENT"):
+    from . import Instrumentation
+    Instrumentation.enableFromEnvironment()
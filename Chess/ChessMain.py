@@ -1,114 +1,67 @@
 import pygame as p
-from ChessEngine import *
+from .ChessEngine import *
+from .OpeningBook import OpeningBook
+from .BoardRenderer import BoardRenderer
+from .AnalysisWorker import AnalysisWorker
+from .Analyzer import MATE_SCORE
+import os
 import random
 
 WIDTH = HEIGHT = 512
+EVAL_BAR_WIDTH = 32  # evaluation bar to the right of the board
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+BACKEND = "list"  # or "bitboard" for the bitboard move generator
+# Assets are found next to this file, so the game can be started from any directory
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BOOK_PATH = os.path.join(BASE_DIR, "book.bin")  # opening book built with OpeningBook.py; press b to show its moves
+BOOK_ARROW_COLOR = (70, 130, 180)
+ARROW_COLOR = (255, 140, 0)
+BEST_MOVE_ARROW_COLOR = (200, 40, 160)  # best move found by the analysis worker; press a to hide/show
+ANALYSIS_POLL_MS = 50  # how often the idle loop wakes up for results while the worker is searching
 
 # ---------------------------- Utility UI helpers ----------------------------
 
-def drawText(screen, text):
-    """Helper to draw centered text on the board surface."""
-    # Try Poppins (regular/thin), fallback to Arial (regular) if not available
-    try:
-        font = p.font.SysFont("Poppins", 40, False, False)
-    except:
-        font = p.font.SysFont("Arial", 40, False, False)
-    # For best results, you can use a custom TTF file with p.font.Font('path/to/Poppins-Regular.ttf', 40)
-    textObject = font.render(text, True, p.Color('white'))
-    # Draw a semi-transparent rectangle behind the text for readability
-    textBg = p.Surface((textObject.get_width()+20, textObject.get_height()+10))
-    textBg.set_alpha(180)
-    textBg.fill(p.Color('black'))
-    textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2,
-                                                   HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textBg, (textLocation.x-10, textLocation.y-5))
-    screen.blit(textObject, textLocation)
-
 def loadImages():
     pieces = ["wp", "wR", "wN", "wB", "wK", "wQ", "bp", "bR", "bN", "bB", "bK", "bQ"]
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("assests/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
-
-def drawValidMoves(screen, validMoves, sqSelected):
-    """Draw dots on squares where the selected piece can move. Captures show the capturable piece in a grey circle."""
-    if sqSelected != ():
-        r, c = sqSelected
-        for move in validMoves:
-            if move.startRow == r and move.startCol == c:
-                centerX = move.endCol * SQ_SIZE + SQ_SIZE // 2
-                centerY = move.endRow * SQ_SIZE + SQ_SIZE // 2
-                if move.pieceCaptured != "--":
-                    # Draw grey circle
-                    radius = SQ_SIZE // 2 - 6
-                    p.draw.circle(screen, p.Color('grey'), (centerX, centerY), radius)
-                    # Draw the capturable piece image centered in the square
-                    piece_img = IMAGES[move.pieceCaptured]
-                    img_rect = piece_img.get_rect(center=(centerX, centerY))
-                    screen.blit(piece_img, img_rect)
-                else:
-                    # Draw blue dot for normal move
-                    radius = SQ_SIZE // 8
-                    p.draw.circle(screen, p.Color('blue'), (centerX, centerY), radius)
-
-def drawSelectedSquare(screen, sqSelected):
-    """Highlight the selected square."""
-    if sqSelected != ():
-        r, c = sqSelected
-        s = p.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(100)  # transparency
-        s.fill(p.Color('yellow'))
-        screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-
-def drawMarkedSquares(screen, markedSquares):
-    for (r, c) in markedSquares:
-        s = p.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(120)
-        s.fill(p.Color('red'))
-        screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
+        IMAGES[piece] = p.transform.scale(p.image.load(os.path.join(BASE_DIR, "assests", piece + ".png")), (SQ_SIZE, SQ_SIZE))
 
-def drawArrows(screen, arrows):
-    for (start, end) in arrows:
-        sr, sc = start
-        er, ec = end
-        start_px = (sc * SQ_SIZE + SQ_SIZE // 2, sr * SQ_SIZE + SQ_SIZE // 2)
-        end_px = (ec * SQ_SIZE + SQ_SIZE // 2, er * SQ_SIZE + SQ_SIZE // 2)
-        # Draw line
-        p.draw.line(screen, (255, 140, 0), start_px, end_px, 8)
-        # Draw arrowhead
-        import math
-        angle = math.atan2(end_px[1] - start_px[1], end_px[0] - start_px[0])
-        arrow_length = 20
-        arrow_angle = math.pi / 7
-        for sign in [-1, 1]:
-            dx = arrow_length * math.cos(angle + sign * arrow_angle)
-            dy = arrow_length * math.sin(angle + sign * arrow_angle)
-            p.draw.line(screen, (255, 140, 0), end_px, (end_px[0] - dx, end_px[1] - dy), 8)
+def bookMoveArrows(book, gs):
+    """Arrows for the three most played book moves of the current position."""
+    if book is None:
+        return []
+    return [((entry.move.startRow, entry.move.startCol), (entry.move.endRow, entry.move.endCol))
+            for entry in book.lookup(gs)[:3]]
 
-# Update drawGameState to include arrows
-def drawGameState(screen, gs, sqSelected, validMoves, markedSquares, arrows, show_arrows=True, show_moves=True):
-    drawBoard(screen)
-    drawMarkedSquares(screen, markedSquares)
-    drawSelectedSquare(screen, sqSelected)
-    if show_moves:
-        drawValidMoves(screen, validMoves, sqSelected)
-    highlightChecks(screen, gs)
-    drawPieces(screen, gs.board)
-    if show_arrows:
-        drawArrows(screen, arrows)
+def moveHints(validMoves, sqSelected):
+    """(row, col) -> whether the selected piece would capture there, for each of its moves."""
+    if sqSelected == ():
+        return {}
+    r, c = sqSelected
+    return {(move.endRow, move.endCol): move.pieceCaptured != "--"
+            for move in validMoves if move.startRow == r and move.startCol == c}
 
+def packedArrow(packed):
+    """(start, end) squares of a packed move (see Move.packed)."""
+    return divmod(packed & 63, DIMENSION), divmod(packed >> 6 & 63, DIMENSION)
 
-def highlightChecks(screen, gs):
-    """Highlight the king square red when that king is in check."""
-    if gs.inCheck():
-        kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
-        s = p.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(120)  # transparency
-        s.fill(p.Color('red'))
-        screen.blit(s, (kingCol * SQ_SIZE, kingRow * SQ_SIZE))
+def endGameMessage(gs):
+    if gs.checkMate:
+        return f"Checkmate! {'Black' if gs.whiteToMove else 'White'} wins."
+    if gs.staleMate:
+        return "Stalemate!"
+    if gs.fivefoldRepetition:
+        return "Draw (by fivefold repetition)!"
+    if gs.seventyFiveMoveDraw:
+        return "Draw (by the 75-move rule)!"
+    if gs.repetitionDraw:
+        return "Draw (by repetition)!"
+    if gs.fiftyMoveDraw:
+        return "Draw (by the 50-move rule)!"
+    return None
 
 class ConfettiParticle:
     def __init__(self):
@@ -132,42 +85,30 @@ class ConfettiParticle:
         rect = p.Surface((self.size, self.size), p.SRCALPHA)
         rect.fill(self.color)
         rotated = p.transform.rotate(rect, self.angle)
-        screen.blit(rotated, (self.x, self.y))
-
-def drawConfetti(screen, confetti_particles):
-    for particle in confetti_particles:
-        particle.draw(screen)
-
-def animateMove(move, screen, board, clock):
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 10
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-        r, c = (move.startRow + dR * frame / frameCount, move.startCol + dC * frame / frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # Erase the piece from its end square
-        color = p.Color("white") if (move.endRow + move.endCol) % 2 == 0 else p.Color("dark green")
-        p.draw.rect(screen, color, p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        # Draw captured piece (if any)
-        if move.pieceCaptured != "--":
-            screen.blit(IMAGES[move.pieceCaptured], p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        # Draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
+        return screen.blit(rotated, (self.x, self.y))
 
 def main():
+    # Started before pygame so the worker process does not inherit an initialised display
+    worker = AnalysisWorker(BACKEND)
     p.init()
-    screen = p.display.set_mode((WIDTH, HEIGHT))
+    screen = p.display.set_mode((WIDTH + EVAL_BAR_WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = GameState()
-    validMoves = gs.getValidMoves()
+    gs = GameState(BACKEND)
+    # Legal moves, check state and evaluation arrive from the worker after each change of position
+    worker.submit(gs)
+    validMoves = None
+    inCheck = False
+    evaluation = None
+    bestMoveArrow = None
+    showAnalysis = True
     moveMade = False
+    book = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+    showBook = False
+    bookArrows = bookMoveArrows(book, gs)
 
     loadImages()
+    renderer = BoardRenderer(screen, IMAGES, SQ_SIZE)
     running = True
     sqSelected = ()
     playerClicks = []
@@ -178,9 +119,18 @@ def main():
     confetti_active = False
     # confetti_timer = 0  # No longer needed
     while running:
-        for e in p.event.get():
+        events = p.event.get()
+        if not events and not confetti_active:
+            # nothing is moving: sleep until the next input event, or the next poll of a busy worker
+            events = [p.event.wait(ANALYSIS_POLL_MS) if worker.busy else p.event.wait()]
+        for e in events:
             if e.type == p.QUIT:
-                running == False
+                running = False
+            elif e.type in (p.WINDOWEXPOSED, p.VIDEOEXPOSE):
+                renderer.invalidate()
+            # Clicks on the evaluation bar
+            elif e.type in (p.MOUSEBUTTONDOWN, p.MOUSEBUTTONUP) and e.pos[0] >= WIDTH:
+                arrow_drag_start = None
             # Right mouse button down: start arrow drag or remove arrow or toggle mark
             elif e.type == p.MOUSEBUTTONDOWN and e.button == 3:
                 location = p.mouse.get_pos()
@@ -230,12 +180,14 @@ def main():
                         sqSelected = (row, col)
                         playerClicks.append(sqSelected)
                     if len(playerClicks) == 2:
+                        if validMoves is None:  # the worker has not reported on this position yet
+                            validMoves = gs.getValidMoves()
                         move = Move(playerClicks[0], playerClicks[1], gs.board)
                         print(move.getChessNotation())
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
                                 gs.makeMove(validMoves[i])
-                                animateMove(validMoves[i], screen, gs.board, clock)
+                                renderer.animateMove(validMoves[i], gs.board, clock)
                                 moveMade = True
                                 sqSelected = ()
                                 playerClicks = []
@@ -246,11 +198,10 @@ def main():
                     gs.undoMove()
                     moveMade = True
                 elif e.key == p.K_r:  # reset the game
-                    gs = GameState()
-                    validMoves = gs.getValidMoves()
+                    gs = GameState(BACKEND)
                     sqSelected = ()
                     playerClicks = []
-                    moveMade = False
+                    moveMade = True
                     markedSquares = set()
                     arrows = []
                     confetti_particles = []
@@ -260,66 +211,71 @@ def main():
                 elif e.key == p.K_y:  # redo move
                     gs.redoMove()
                     moveMade = True
+                elif e.key == p.K_b:  # show/hide opening book moves
+                    showBook = not showBook
+                elif e.key == p.K_a:  # show/hide the evaluation and best move
+                    showAnalysis = not showAnalysis
 
         if moveMade:
-            validMoves = gs.getValidMoves()
+            worker.submit(gs)  # cancels the analysis of the previous position
+            validMoves = None
+            inCheck = False
+            gs.checkMate = gs.staleMate = False  # until the worker reports on the new position
+            bestMoveArrow = None
+            bookArrows = bookMoveArrows(book, gs)
             moveMade = False
-        
-        # Only show possible moves if a piece is selected and not drawing an arrow, and there are no arrows
-        if sqSelected != () and arrow_drag_start is None and not arrows:
-            drawGameState(screen, gs, sqSelected, validMoves, markedSquares, arrows, show_arrows=False, show_moves=True)
-        else:
-            drawGameState(screen, gs, sqSelected, validMoves, markedSquares, arrows, show_arrows=True, show_moves=False)
 
-        # Display end-game message if applicable
+        for result in worker.poll():
+            if result["kind"] == "position":
+                validMoves = [Move.fromPacked(packed, gs.board) for packed in result["moves"]]
+                inCheck = result["inCheck"]
+                gs.checkMate, gs.staleMate = result["checkMate"], result["staleMate"]
+                if gs.checkMate:
+                    evaluation = -MATE_SCORE if gs.whiteToMove else MATE_SCORE
+                elif gs.staleMate:
+                    evaluation = 0
+            elif result["kind"] == "line":
+                evaluation = result["score"]
+                bestMoveArrow = packedArrow(result["pv"][0]) if result["pv"] else None
+
+        # Only show possible moves if a piece is selected and not drawing an arrow, and there are no arrows
+        showMoves = sqSelected != () and arrow_drag_start is None and not arrows
+        message = endGameMessage(gs)
         if gs.checkMate:
-            winner = 'Black' if gs.whiteToMove else 'White'
-            drawText(screen, f'Checkmate! {winner} wins.')
             # Start confetti if not already started
             if not confetti_active:
                 confetti_particles = [ConfettiParticle() for _ in range(120)]
                 confetti_active = True
-                # confetti_timer = p.time.get_ticks()
         elif gs.staleMate:
-            drawText(screen, 'Stalemate!')
             confetti_active = False
             confetti_particles = []
-        elif gs.repetitionDraw:
-            drawText(screen, 'Draw (by repetition)!')
 
         # Animate confetti if active
         if confetti_active:
             for particle in confetti_particles:
                 particle.update()
-            drawConfetti(screen, confetti_particles)
             # Remove particles that fall off the screen
             confetti_particles = [p for p in confetti_particles if p.y < HEIGHT]
             # Stop confetti when all particles are gone
             if not confetti_particles:
                 confetti_active = False
 
+        shownArrows = [] if showMoves else [(arrow, ARROW_COLOR) for arrow in arrows]
+        if showBook:
+            shownArrows += [(arrow, BOOK_ARROW_COLOR) for arrow in bookArrows]
+        if showAnalysis and bestMoveArrow is not None:
+            shownArrows.append((bestMoveArrow, BEST_MOVE_ARROW_COLOR))
+        kingSquare = (gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation) if inCheck else None
+        hints = moveHints(validMoves or [], sqSelected) if showMoves else None
+        rects = renderer.render(gs.board, sqSelected, markedSquares, hints, kingSquare, shownArrows, message,
+                                confetti_particles, evaluation if showAnalysis else None)
+        if rects:
+            p.display.update(rects)
         clock.tick(MAX_FPS)
-        p.display.flip()
 
+    worker.close()
+    p.quit()
     
 
-def drawBoard(screen):
-    colors = [p.Color("white"), p.Color("dark green")]
-    for r in range (DIMENSION):
-        for c in range (DIMENSION):
-            color = colors[((r+c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-            
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece],  p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""Compact binary game archive with random access through mmap.
+
+    with GameArchiveWriter("games.chessarc") as writer:
+        writer.addGame(moves, result="1-0")            # Move objects or packed ints
+    archive = GameArchive("games.chessarc")
+    gs = archive[12345]                                # replayed GameState
+
+    python -m Chess archive convert games.pgn.gz games.chessarc
+    python -m Chess archive bench games.chessarc games.pgn.gz
+
+Layout (little-endian):
+    header   HEADER_FORMAT: magic, version, game count, index offset
+    games    per game: [uint16 FEN length + FEN bytes, if it has a FEN] + uint16 packed moves
+    index    one INDEX_FORMAT entry per game: record offset, ply count, result, has-FEN flag
+
+Opening an archive only maps the file and reads the header; index entries and
+moves are read from the mapping when a game is asked for.
+"""
+import argparse
+import io
+import mmap
+import struct
+import sys
+import time
+from array import array
+
+from .ChessEngine import GameState, Move, START_FEN
+
+MAGIC = b"CHESSARC"
+VERSION = 1
+HEADER_FORMAT = "<8sHxxxxxxQQ"  # magic, version, game count, index offset
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INDEX_FORMAT = "<QIBBxx"  # record offset, plies, result code, has-FEN flag
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+RESULTS = ("*", "1-0", "0-1", "1/2-1/2")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+class GameArchiveWriter():
+    """Writes games one at a time; the index is kept in memory (16 bytes a game) and
+    appended, with the final header, on close()."""
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, 0))
+        self.offset = HEADER_SIZE
+        self.index = bytearray()
+        self.count = 0
+
+    def addGame(self, moves, result="*", startFen=None):
+        """Appends a game given as Move objects or packed 16-bit moves."""
+        packed = array("H", [move if isinstance(move, int) else move.packed for move in moves])
+        hasFen = startFen is not None and startFen != START_FEN
+        self.index += struct.pack(INDEX_FORMAT, self.offset, len(packed), RESULTS.index(result), hasFen)
+        if hasFen:
+            fen = startFen.encode("ascii")
+            self.file.write(struct.pack("<H", len(fen)) + fen)
+            self.offset += 2 + len(fen)
+        if _BIG_ENDIAN:
+            packed.byteswap()
+        self.file.write(packed.tobytes())
+        self.offset += 2 * len(packed)
+        self.count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write(self.index)
+        self.file.seek(0)
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.count, self.offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameArchive():
+    """Read-only view of an archive; archive[i] replays game i into a new GameState."""
+
+    def __init__(self, path, backend="list"):
+        self.backend = backend
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.indexOffset = struct.unpack_from(HEADER_FORMAT, self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Not a game archive (version {VERSION}): {path}")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return self.replay(i)
+
+    def _entry(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("game index out of range")
+        return struct.unpack_from(INDEX_FORMAT, self.map, self.indexOffset + i * INDEX_SIZE)
+
+    def result(self, i):
+        return RESULTS[self._entry(i)[2]]
+
+    def startFen(self, i):
+        offset, plies, result, hasFen = self._entry(i)
+        if not hasFen:
+            return START_FEN
+        length, = struct.unpack_from("<H", self.map, offset)
+        return self.map[offset + 2:offset + 2 + length].decode("ascii")
+
+    def packedMoves(self, i):
+        """The moves of game i as an array('H') of packed moves."""
+        offset, plies, result, hasFen = self._entry(i)
+        if hasFen:
+            offset += 2 + struct.unpack_from("<H", self.map, offset)[0]
+        moves = array("H")
+        moves.frombytes(self.map[offset:offset + 2 * plies])
+        if _BIG_ENDIAN:
+            moves.byteswap()
+        return moves
+
+    def replay(self, i, gs=None, plies=None):
+        """Plays the first `plies` moves (default: all) of game i into gs, a fresh
+        GameState by default, and returns it."""
+        gs = gs if gs is not None else GameState(self.backend)
+        gs.loadFen(self.startFen(i))
+        moves = self.packedMoves(i)
+        if plies is not None:
+            moves = moves[:plies]
+        fromPacked = Move.fromPacked
+        for packed in moves:
+            gs.makeMove(fromPacked(packed, gs.board))
+        return gs
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convertPgn(pgnPath, archivePath, backend="list"):
+    """Writes every game of a PGN file to an archive; returns (games, games skipped
+    because their movetext did not replay)."""
+    from .PgnReader import readGames
+    written = skipped = 0
+    with GameArchiveWriter(archivePath) as writer:
+        for game in readGames(pgnPath, backend):
+            if game.error:
+                skipped += 1
+                continue
+            writer.addGame(game.moves, game.result if game.result in RESULTS else "*", game.headers.get("FEN"))
+            written += 1
+    return written, skipped
+
+
+def benchmark(archivePath, pgnPath=None, sample=200, backend="list"):
+    """Times opening the archive, replaying `sample` games from it, and (given the PGN
+    the archive was made from) re-parsing the same games from text, on the same
+    GameState. Reading the PGN text into memory is not timed."""
+    results = {}
+    start = time.perf_counter()
+    archive = GameArchive(archivePath, backend)
+    results["openSeconds"] = time.perf_counter() - start
+    count = min(sample, len(archive))
+    if count <= 0:
+        archive.close()
+        raise ValueError(f"No games to benchmark in {archivePath}")
+    step = max(1, len(archive) // count)
+    indexes = list(range(0, step * count, step))
+    start = time.perf_counter()
+    for i in indexes:
+        archive.packedMoves(i)
+    results["readMovesPerSecond"] = count / (time.perf_counter() - start)
+    gs = GameState(backend, positionCacheSize=0)
+    start = time.perf_counter()
+    for i in indexes:
+        archive.replay(i, gs)
+    results["replayGamesPerSecond"] = count / (time.perf_counter() - start)
+    archiveLength = len(archive)
+    archive.close()
+    if pgnPath:
+        from .PgnReader import readGames, readGameTexts
+        texts = list(readGameTexts(pgnPath))
+        if len(texts) != archiveLength:
+            # convertPgn leaves out games that do not replay; line the rest up with the archive
+            texts = [text for text in texts if next(readGames(io.StringIO(text), gs=gs)).error is None]
+        start = time.perf_counter()
+        for i in indexes:
+            next(readGames(io.StringIO(texts[i]), gs=gs))
+        results["pgnGamesPerSecond"] = count / (time.perf_counter() - start)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Binary game archives")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convertParser = sub.add_parser("convert", help="PGN to archive")
+    convertParser.add_argument("pgn")
+    convertParser.add_argument("archive")
+    benchParser = sub.add_parser("bench", help="archive load time against PGN parsing")
+    benchParser.add_argument("archive")
+    benchParser.add_argument("pgn", nargs="?")
+    benchParser.add_argument("--sample", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        written, skipped = convertPgn(args.pgn, args.archive, args.backend)
+        print(f"{written} games written, {skipped} skipped")
+        return 0
+    try:
+        results = benchmark(args.archive, args.pgn, args.sample, args.backend)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print(f"open                 {results['openSeconds'] * 1000:10.3f} ms")
+    print(f"read moves           {results['readMovesPerSecond']:10,.0f} games/s")
+    print(f"replay to GameState  {results['replayGamesPerSecond']:10,.0f} games/s")
+    if "pgnGamesPerSecond" in results:
+        print(f"re-parse PGN         {results['pgnGamesPerSecond']:10,.0f} games/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Whole-game review: every move scored against the engine's best alternative.
+
+    from Chess.GameReview import reviewGame
+    review = reviewGame(pgnGame, depth=3, timeBudget=20.0)   # or a GameState, or a list of moves
+    for ply in review["plies"]:
+        ply["move"], ply["bestMove"], ply["loss"], ply["classification"]
+
+    python -m Chess review games.pgn --depth 3 --budget 20 --limit 10 [--output reviews.jsonl]
+    python -m Chess review games.pgn --depth 2 --limit 20 --compare     # against a cold forward review
+
+The game is replayed to its final position and the positions are then analysed
+backwards, taking moves back one at a time with a single Analyzer. The played move
+leads to the position searched just before, so it is tried first at every depth and
+its subtree comes straight out of the transposition table; the rest of the tree is
+searched as usual. backwards=False (--forwards) walks the game in playing order with
+the same Analyzer, which only shares whatever the table still holds.
+Scores are clamped to SCORE_CLAMP centipawns before losses are taken, so missing a
+mate counts as a blunder without dwarfing the rest.
+"""
+import argparse
+import json
+import sys
+import time
+
+from .Analyzer import Analyzer
+from .ChessEngine import START_FEN, GameState, Move
+from .PgnReader import moveToSan, readGames
+
+DEFAULT_DEPTH = 3
+SCORE_CLAMP = 1000
+# Centipawn loss thresholds, largest first
+CLASSIFICATIONS = ((300, "blunder"), (100, "mistake"), (50, "inaccuracy"))
+PLURALS = {"blunder": "blunders", "mistake": "mistakes", "inaccuracy": "inaccuracies"}
+MIN_POSITION_SECONDS = 0.01  # time limit floor once the budget is spent; depth 1 always completes
+
+
+def classify(loss):
+    for threshold, name in CLASSIFICATIONS:
+        if loss >= threshold:
+            return name
+    return None
+
+
+def _clamp(score):
+    return max(-SCORE_CLAMP, min(SCORE_CLAMP, score))
+
+
+def _gameMoves(game, startFen):
+    """(start FEN, moves) of a PgnGame, a GameState or a sequence of Moves / packed ints."""
+    if isinstance(game, GameState):
+        start = game.clone(shareHistory=True)
+        while start.moveLog:
+            start.undoMove(record=False)
+        return start.getFen(), list(game.moveLog)
+    if hasattr(game, "startFen") and hasattr(game, "moves"):
+        return game.startFen, list(game.moves)
+    return startFen or START_FEN, list(game)
+
+
+def reviewGame(game, depth=DEFAULT_DEPTH, timeBudget=None, analyzer=None, startFen=None, backend="list",
+               backwards=True):
+    """Reviews every move of game (a PgnGame, a GameState or a list of moves from
+    startFen) and returns a dict with one entry per ply under "plies" and per-colour
+    totals under "summary". timeBudget caps the whole review in seconds; each position
+    gets an equal share of what is left. Pass an Analyzer to keep its table across games."""
+    started = time.perf_counter()
+    fen, moves = _gameMoves(game, startFen)
+    analyzer = analyzer or Analyzer()
+    gs = GameState(backend)
+    gs.loadFen(fen)
+    for i, move in enumerate(moves):
+        if isinstance(move, int):
+            move = moves[i] = Move.fromPacked(move, gs.board)
+        gs.makeMove(move)
+    if not backwards:
+        gs.loadFen(fen)
+
+    positions = [None] * (len(moves) + 1)  # (AnalysisResult, whiteToMove, played SAN, best SAN) per position
+    nodes = 0
+    order = range(len(moves), -1, -1) if backwards else range(len(moves) + 1)
+    for step, ply in enumerate(order):
+        timeLimit = None
+        if timeBudget is not None:
+            remaining = timeBudget - (time.perf_counter() - started)
+            timeLimit = max(MIN_POSITION_SECONDS, remaining / (len(positions) - step))
+        # Backwards, the played move leads to the position just searched, so trying it
+        # first at every depth starts each search from a table hit with an exact score
+        result = analyzer.analyze(gs, depth, timeLimit,
+                                  searchFirst=moves[ply] if backwards and ply < len(moves) else None)
+        nodes += result.nodes
+        played = best = None
+        if ply < len(moves):
+            validMoves = gs.getValidMoves()
+            played = moveToSan(gs, moves[ply], validMoves)
+            best = moveToSan(gs, result.bestMove, validMoves) if result.bestMove is not None else None
+        positions[ply] = (result, gs.whiteToMove, played, best)
+        if backwards and ply:
+            gs.undoMove()
+        elif not backwards and ply < len(moves):
+            gs.makeMove(moves[ply])
+
+    plies = []
+    summary = {color: {"moves": 0, "totalLoss": 0, **{name: 0 for threshold, name in CLASSIFICATIONS}}
+               for color in ("white", "black")}
+    for ply, move in enumerate(moves):
+        result, whiteToMove, played, best = positions[ply]
+        sign = 1 if whiteToMove else -1
+        before = _clamp(result.score)
+        after = -_clamp(positions[ply + 1][0].score)
+        bestPlayed = result.bestMove is not None and result.bestMove.packed == move.packed
+        loss = 0 if bestPlayed else max(0, before - after)
+        classification = classify(loss)
+        color = "white" if whiteToMove else "black"
+        summary[color]["moves"] += 1
+        summary[color]["totalLoss"] += loss
+        if classification:
+            summary[color][classification] += 1
+        plies.append({"ply": ply, "color": color, "move": played, "uci": move.getChessNotation(), "bestMove": best,
+                      "bestUci": result.bestMove.getChessNotation() if result.bestMove else None,
+                      "scoreBefore": sign * before, "scoreAfter": sign * after, "loss": loss,
+                      "classification": classification,
+                      "depth": result.iterations[-1]["depth"] if result.iterations else 0})
+    for totals in summary.values():
+        totals["averageLoss"] = round(totals["totalLoss"] / totals["moves"], 1) if totals["moves"] else 0.0
+    return {"startFen": fen, "plies": plies, "summary": summary, "positions": len(positions), "nodes": nodes,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _coldReviewNodes(fen, moves, depth, backend):
+    """Work done searching every position of a game forwards, each from an empty
+    transposition table and position cache, for comparison with reviewGame.
+    Returns (nodes, seconds)."""
+    started = time.perf_counter()
+    analyzer = Analyzer()
+    gs = GameState(backend)
+    gs.loadFen(fen)
+    nodes = 0
+    for ply in range(len(moves) + 1):
+        analyzer.tt.clear()
+        gs.clearPositionCache()
+        nodes += analyzer.analyze(gs, depth).nodes
+        if ply < len(moves):
+            gs.makeMove(moves[ply])
+    return nodes, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Review every move of PGN games")
+    parser.add_argument("pgn", help="PGN file (.pgn/.pgn.gz/.pgn.bz2)")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--budget", type=float, help="seconds per game")
+    parser.add_argument("--limit", type=int, help="review only the first LIMIT games")
+    parser.add_argument("--output", help="JSON lines file, one review per game (default: a table per game)")
+    parser.add_argument("--forwards", action="store_true", help="analyse in playing order instead of backwards")
+    parser.add_argument("--compare", action="store_true", help="also time a cold forward review of each game")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    args = parser.parse_args(argv)
+
+    analyzer = Analyzer()
+    out = open(args.output, "w") if args.output else None
+    games = positions = nodes = coldNodes = 0
+    seconds = coldSeconds = 0.0
+    try:
+        for game in readGames(args.pgn, args.backend):
+            if args.limit is not None and games >= args.limit:
+                break
+            review = reviewGame(game, args.depth, args.budget, analyzer, backend=args.backend,
+                                backwards=not args.forwards)
+            games += 1
+            positions += review["positions"]
+            nodes += review["nodes"]
+            seconds += review["seconds"]
+            if args.compare:
+                gameNodes, gameSeconds = _coldReviewNodes(game.startFen, game.moves, args.depth, args.backend)
+                coldNodes += gameNodes
+                coldSeconds += gameSeconds
+            if out is not None:
+                out.write(json.dumps({"headers": game.headers, **review}) + "\n")
+                continue
+            print(f"{game.headers.get('White', '?')} - {game.headers.get('Black', '?')} {game.result}")
+            for ply in review["plies"]:
+                if ply["classification"]:
+                    number = f"{ply['ply'] // 2 + 1}{'.' if ply['color'] == 'white' else '...'}"
+                    print(f"  {number:6} {ply['move']:8} {ply['classification']:10} loss {ply['loss']:4}  "
+                          f"best {ply['bestMove']}")
+            for color, totals in review["summary"].items():
+                print(f"  {color}: average loss {totals['averageLoss']}, " +
+                      ", ".join(f"{totals[name]} {PLURALS[name]}" for threshold, name in CLASSIFICATIONS))
+    finally:
+        if out is not None:
+            out.close()
+    if games:
+        print(f"{games} games ({positions} positions) in {seconds:.1f}s: {games * 60 / seconds:,.1f} games/min, "
+              f"{nodes / seconds:,.0f} nodes/s", file=sys.stderr)
+    if args.compare and games:
+        print(f"cold forward review: {coldSeconds:.1f}s, {games * 60 / coldSeconds:,.1f} games/min, "
+              f"{coldNodes:,} nodes against {nodes:,}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Opt-in call counters and cumulative timers for the engine's hot paths.
+
+    from Chess import Instrumentation
+    Instrumentation.enable()
+    ...                                  # any workload: perft, a search, a PGN import
+    Instrumentation.stats()              # {"GameState.makeMove": {"calls": n, "seconds": t}, ...}
+    Instrumentation.dumpJson("profile.json")
+    Instrumentation.disable()
+
+or, without changing any code:
+
+    CHESS_INSTRUMENT=profile.json python -m Chess batch games.pgn
+
+which enables it as soon as ChessEngine is imported and writes the JSON when the
+process exits ("-" writes it to stderr). Only the main process is measured; worker
+processes exit without running exit handlers.
+
+enable() swaps the measured methods on their classes for counting wrappers and
+disable() puts the originals back, so while instrumentation is off the engine runs
+its own methods with no checks at all. Times are inclusive: getValidMoves includes
+the squareUnderAttack calls it makes, and BitboardGameState.makeMove includes the
+GameState.makeMove it calls. Move allocations are counted but not timed.
+"""
+import atexit
+import contextlib
+import json
+import os
+import sys
+import time
+
+ENVIRONMENT_VARIABLE = "CHESS_INSTRUMENT"
+
+# Class -> methods measured with a call counter and a timer
+TIMED = {
+    "GameState": ("getValidMoves", "_generateValidMoves", "checkForPinsAndChecks", "squareUnderAttack",
+                  "isSquareAttacked", "makeMove", "undoMove"),
+    "BitboardGameState": ("_generateValidMoves", "getValidMovesPacked", "isSquareAttacked", "makeMove", "undoMove"),
+}
+# Class -> methods measured with a call counter only
+COUNTED = {
+    "Move": ("__init__", "fromPacked"),
+}
+
+_counters = {}  # "Class.method" -> [calls, seconds]
+_originals = []  # (class, attribute, original class attribute) while enabled
+
+
+def _classes():
+    from .ChessEngine import GameState, Move
+    from .BitboardEngine import BitboardGameState
+    return {"GameState": GameState, "BitboardGameState": BitboardGameState, "Move": Move}
+
+
+def _timed(entry, function):
+    clock = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            entry[0] += 1
+            entry[1] += clock() - start
+    return wrapper
+
+
+def _counted(entry, function):
+    def wrapper(*args, **kwargs):
+        entry[0] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def isEnabled():
+    return bool(_originals)
+
+
+def enable():
+    """Starts measuring. Counts keep accumulating across enable/disable; see reset."""
+    if _originals:
+        return
+    classes = _classes()
+    for table, makeWrapper in ((TIMED, _timed), (COUNTED, _counted)):
+        for className, attributes in table.items():
+            cls = classes[className]
+            for attribute in attributes:
+                original = cls.__dict__[attribute]
+                entry = _counters.setdefault(f"{className}.{attribute}", [0, 0.0])
+                if isinstance(original, classmethod):
+                    replacement = classmethod(makeWrapper(entry, original.__func__))
+                else:
+                    replacement = makeWrapper(entry, original)
+                _originals.append((cls, attribute, original))
+                setattr(cls, attribute, replacement)
+
+
+def disable():
+    """Stops measuring and restores the original methods; the counts are kept."""
+    while _originals:
+        cls, attribute, original = _originals.pop()
+        setattr(cls, attribute, original)
+
+
+def reset():
+    for entry in _counters.values():
+        entry[0] = 0
+        entry[1] = 0.0
+
+
+@contextlib.contextmanager
+def instrumented():
+    """Measures the body of a with statement, starting from zero."""
+    reset()
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+
+def stats():
+    """{"Class.method": {"calls": n, "seconds": t}} for every timed method and
+    {"Class.method": {"calls": n}} for every counted one."""
+    timed = {f"{className}.{attribute}" for className, attributes in TIMED.items() for attribute in attributes}
+    return {name: {"calls": calls, "seconds": seconds} if name in timed else {"calls": calls}
+            for name, (calls, seconds) in sorted(_counters.items())}
+
+
+def dumpJson(target=None):
+    """Writes stats() as JSON to a path or an open text file (stdout by default)."""
+    if target is None or hasattr(target, "write"):
+        json.dump(stats(), target or sys.stdout, indent=2)
+        (target or sys.stdout).write("\n")
+        return
+    with open(target, "w") as f:
+        json.dump(stats(), f, indent=2)
+        f.write("\n")
+
+
+def enableFromEnvironment():
+    """Enables instrumentation and registers a dump at exit if CHESS_INSTRUMENT is set."""
+    target = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not target or isEnabled():
+        return
+    enable()
+    atexit.register(dumpJson, sys.stderr if target == "-" else target)
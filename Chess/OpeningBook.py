@@ -0,0 +1,180 @@
+"""Opening book: per-position move statistics from a game corpus, read through mmap.
+
+    python -m Chess book build games.pgn.gz book.bin --max-ply 20 --min-count 2
+    python -m Chess book probe book.bin --fen "<fen>"
+
+    book = OpeningBook("book.bin")
+    for entry in book.lookup(gs):      # most played first
+        entry.move, entry.wins, entry.draws, entry.losses, entry.frequency
+
+The file is a header followed by fixed-width rows sorted by position hash
+(GameState.zobristKey), so lookups are a binary search over the mapped file.
+Wins and losses are counted from the point of view of the side playing the move.
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+
+from .ChessEngine import GameState, Move
+
+MAGIC = b"CHESSBK1"
+HEADER_FORMAT = "<8sQ"  # magic, row count
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ROW_FORMAT = "<QHxxIIII"  # position hash, packed move, wins, draws, losses, frequency
+ROW = struct.Struct(ROW_FORMAT)
+KEY = struct.Struct("<Q")
+
+
+class BookMove():
+    def __init__(self, move, wins, draws, losses, frequency):
+        self.move = move
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+        self.frequency = frequency
+
+    @property
+    def score(self):
+        """Expected result for the side playing the move, from 0 to 1, over decided or drawn games."""
+        games = self.wins + self.draws + self.losses
+        return (self.wins + self.draws / 2) / games if games else 0.5
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = struct.unpack_from(HEADER_FORMAT, self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not an opening book: {path}")
+
+    def __len__(self):
+        return self.count
+
+    def rows(self, key):
+        """Raw (packed move, wins, draws, losses, frequency) rows stored for a position hash."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(self.map, HEADER_SIZE + mid * ROW.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        rows = []
+        while lo < self.count:
+            row = ROW.unpack_from(self.map, HEADER_SIZE + lo * ROW.size)
+            if row[0] != key:
+                break
+            rows.append(row[1:])
+            lo += 1
+        return rows
+
+    def lookup(self, gs):
+        """Book moves for the position in gs, most frequent first. Only moves that are
+        legal in gs are returned, which also guards against hash collisions."""
+        rows = self.rows(gs.zobristKey)
+        if not rows:
+            return []
+        legal = {move.packed: move for move in gs.getValidMoves()}
+        return [BookMove(legal[packed], wins, draws, losses, frequency)
+                for packed, wins, draws, losses, frequency in rows if packed in legal]
+
+    def chooseMove(self, gs, rng=random):
+        """A book move picked at random, weighted by how often it was played; None out of book."""
+        entries = self.lookup(gs)
+        if not entries:
+            return None
+        return rng.choices([entry.move for entry in entries], [entry.frequency for entry in entries])[0]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def corpusGames(path, backend):
+    """(start FEN, packed moves, result) for every game in a PGN file or a GameArchive."""
+    if path.endswith(".chessarc"):
+        from .GameArchive import GameArchive
+        with GameArchive(path, backend) as archive:
+            for i in range(len(archive)):
+                yield archive.startFen(i), archive.packedMoves(i), archive.result(i)
+    else:
+        from .PgnReader import readGames
+        for game in readGames(path, backend):
+            if game.error is None:
+                yield game.startFen, [move.packed for move in game.moves], game.result
+
+
+def buildBook(corpusPath, bookPath, maxPly=20, minCount=1, backend="list"):
+    """Plays every game of the corpus through GameState.makeMove, counting each
+    (position, move) pair in the first maxPly plies, and writes the rows seen at
+    least minCount times. Returns (games, rows written)."""
+    stats = {}
+    gs = GameState(backend, positionCacheSize=0)
+    games = 0
+    for startFen, packedMoves, result in corpusGames(corpusPath, backend):
+        games += 1
+        gs.loadFen(startFen)
+        whiteResult = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}.get(result)
+        for packed in packedMoves[:maxPly]:
+            counts = stats.get((gs.zobristKey, packed))
+            if counts is None:
+                counts = stats[(gs.zobristKey, packed)] = [0, 0, 0, 0]
+            if whiteResult is not None:
+                # wins/draws/losses for the side to move
+                counts[whiteResult if gs.whiteToMove else 2 - whiteResult] += 1
+            counts[3] += 1
+            gs.makeMove(Move.fromPacked(packed, gs.board), record=False)
+    rows = sorted((key, -counts[3], packed, counts) for (key, packed), counts in stats.items() if counts[3] >= minCount)
+    with open(bookPath, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, len(rows)))
+        buffer = bytearray(ROW.size * 4096)
+        for start in range(0, len(rows), 4096):
+            chunk = rows[start:start + 4096]
+            for i, (key, negativeFrequency, packed, counts) in enumerate(chunk):
+                ROW.pack_into(buffer, i * ROW.size, key, packed, *counts)
+            f.write(buffer[:len(chunk) * ROW.size])
+    return games, len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query opening books")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    sub = parser.add_subparsers(dest="command", required=True)
+    buildParser = sub.add_parser("build", help="build a book from a PGN file or game archive")
+    buildParser.add_argument("corpus")
+    buildParser.add_argument("book")
+    buildParser.add_argument("--max-ply", type=int, default=20)
+    buildParser.add_argument("--min-count", type=int, default=1)
+    probeParser = sub.add_parser("probe", help="list the book moves of a position")
+    probeParser.add_argument("book")
+    probeParser.add_argument("--fen")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        games, rows = buildBook(args.corpus, args.book, args.max_ply, args.min_count, args.backend)
+        print(f"{games} games, {rows} rows in {time.perf_counter() - start:.1f}s")
+        return 0
+    gs = GameState(args.backend)
+    if args.fen:
+        gs.loadFen(args.fen)
+    with OpeningBook(args.book) as book:
+        for entry in book.lookup(gs):
+            print(f"{entry.move.getChessNotation():6} played {entry.frequency:7}  "
+                  f"+{entry.wins} ={entry.draws} -{entry.losses}  score {entry.score:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""Perft / divide and micro-benchmarks for the move generator.
+
+    python -m Chess perft perft --depth 4                 # all reference positions
+    python -m Chess perft --backend bitboard perft --position kiwipete --depth 3
+    python -m Chess perft divide --fen "<fen>" --depth 2
+    python -m Chess perft bench --json bench.json --baseline last.json --max-slowdown 0.2
+
+perft exits with status 1 if a node count differs from the published value;
+bench exits with status 1 if a metric falls more than --max-slowdown below the
+baseline file, so both can gate a change.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from .ChessEngine import GameState, START_FEN
+
+# Published perft node counts for depth 1, 2, ... (chessprogramming.org "Perft Results")
+REFERENCE_POSITIONS = {
+    "start": (START_FEN, (20, 400, 8902, 197281, 4865609)),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 (48, 2039, 97862, 4085603)),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", (14, 191, 2812, 43238, 674624)),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", (6, 264, 9467, 422333)),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", (44, 1486, 62379, 2103487)),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                  (46, 2079, 89890, 3894594)),
+}
+
+
+def newGameState(fen, backend="list"):
+    # Position cache off, so perft and the benchmarks measure the move generator itself
+    gs = GameState(backend, positionCacheSize=0)
+    gs.loadFen(fen)
+    return gs
+
+
+def _checkDepth(depth):
+    if depth < 1:
+        raise ValueError(f"perft depth must be at least 1, got {depth}")
+
+
+def perft(gs, depth):
+    """Counts the leaf nodes of the legal move tree `depth` (at least 1) plies deep.
+    States with packed make/unmake (the bitboard backend) never build Move objects."""
+    _checkDepth(depth)
+    if hasattr(gs, "makePackedMove"):
+        return _perftPacked(gs, depth)
+    return _perft(gs, depth)
+
+
+def _perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move, record=False)
+        nodes += _perft(gs, depth - 1)
+        gs.undoMove(record=False)
+    return nodes
+
+
+def _perftPacked(gs, depth):
+    moves = gs.getValidMovesPacked()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makePackedMove(move)
+        nodes += _perftPacked(gs, depth - 1)
+        gs.undoPackedMove()
+    return nodes
+
+
+def divide(gs, depth):
+    """perft split by root move: {move notation: node count}."""
+    _checkDepth(depth)
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move, record=False)
+        counts[move.getChessNotation()] = perft(gs, depth - 1) if depth > 1 else 1
+        gs.undoMove(record=False)
+    return counts
+
+
+def runPerft(names, depth, backend="list"):
+    """Runs perft on the named reference positions, up to `depth` (capped at the
+    deepest published count for each). Returns one result dict per position."""
+    _checkDepth(depth)
+    results = []
+    for name in names:
+        fen, expected = REFERENCE_POSITIONS[name]
+        d = min(depth, len(expected))
+        gs = newGameState(fen, backend)
+        start = time.perf_counter()
+        nodes = perft(gs, d)
+        seconds = time.perf_counter() - start
+        results.append({"position": name, "depth": d, "nodes": nodes, "expected": expected[d - 1],
+                        "ok": nodes == expected[d - 1], "seconds": seconds,
+                        "nps": nodes / seconds if seconds > 0 else 0.0})
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Micro-benchmarks
+# ---------------------------------------------------------------------------
+
+def samplePositions(backend="list", pliesPerPosition=6):
+    """A fixed set of positions: every reference position plus a few plies into it
+    (always playing the middle move of the legal move list, so the sample is deterministic)."""
+    states = []
+    for fen, expected in REFERENCE_POSITIONS.values():
+        gs = newGameState(fen, backend)
+        for ply in range(pliesPerPosition):
+            states.append(gs.clone())
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(moves[len(moves) // 2])
+    return states
+
+
+def _measure(function, minSeconds):
+    """Calls function() until minSeconds have passed; returns operations per second.
+    function returns how many operations it performed."""
+    operations = 0
+    start = time.perf_counter()
+    while True:
+        operations += function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= minSeconds:
+            return operations / elapsed
+
+
+def runBenchmarks(backend="list", minSeconds=0.5):
+    states = samplePositions(backend)
+    movesPerState = [gs.getValidMoves() for gs in states]
+
+    def validMoves():
+        for gs in states:
+            gs.getValidMoves()
+        return len(states)
+
+    def makeUndo():
+        count = 0
+        for gs, moves in zip(states, movesPerState):
+            for move in moves:
+                gs.makeMove(move, record=False)
+                gs.undoMove(record=False)
+            count += len(moves)
+        return count
+
+    def squareUnderAttack():
+        for gs in states:
+            for r in range(8):
+                for c in range(8):
+                    gs.squareUnderAttack(r, c)
+        return 64 * len(states)
+
+    results = {
+        "getValidMoves": _measure(validMoves, minSeconds),
+        "makeMove+undoMove": _measure(makeUndo, minSeconds),
+        "squareUnderAttack": _measure(squareUnderAttack, minSeconds),
+    }
+    if hasattr(states[0], "makePackedMove"):
+        packedPerState = [gs.getValidMovesPacked() for gs in states]
+
+        def makeUndoPacked():
+            count = 0
+            for gs, moves in zip(states, packedPerState):
+                for move in moves:
+                    gs.makePackedMove(move)
+                    gs.undoPackedMove()
+                count += len(moves)
+            return count
+
+        results["makePackedMove+undo"] = _measure(makeUndoPacked, minSeconds)
+    return results
+
+
+def compareWithBaseline(bench, baseline, maxSlowdown):
+    """Returns a message for every metric more than maxSlowdown (a fraction) slower than baseline."""
+    failures = []
+    for name, opsPerSecond in bench.items():
+        reference = baseline.get(name)
+        if reference and opsPerSecond < reference * (1 - maxSlowdown):
+            failures.append(f"{name}: {opsPerSecond:,.0f} ops/s is more than {maxSlowdown:.0%} below baseline {reference:,.0f}")
+    return failures
+
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+def _depthArgument(text):
+    depth = int(text)
+    if depth < 1:
+        raise argparse.ArgumentTypeError(f"depth must be at least 1, got {depth}")
+    return depth
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft and benchmarks for the chess move generator")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    perftParser = sub.add_parser("perft", help="check node counts against published values")
+    perftParser.add_argument("--depth", type=_depthArgument, default=3)
+    perftParser.add_argument("--position", action="append", choices=sorted(REFERENCE_POSITIONS),
+                             help="reference position to run (repeatable, default: all)")
+    perftParser.add_argument("--json", help="write results to this file")
+
+    divideParser = sub.add_parser("divide", help="node counts per root move")
+    divideParser.add_argument("--fen", default=START_FEN)
+    divideParser.add_argument("--depth", type=_depthArgument, default=2)
+
+    benchParser = sub.add_parser("bench", help="micro-benchmarks of the hot functions")
+    benchParser.add_argument("--seconds", type=float, default=0.5, help="minimum run time per benchmark")
+    benchParser.add_argument("--json", help="write results to this file")
+    benchParser.add_argument("--baseline", help="earlier --json output to compare against")
+    benchParser.add_argument("--max-slowdown", type=float, default=0.2,
+                             help="allowed fractional slowdown against --baseline (default 0.2)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "perft":
+        results = runPerft(args.position or list(REFERENCE_POSITIONS), args.depth, args.backend)
+        for result in results:
+            status = "ok" if result["ok"] else f"FAIL (expected {result['expected']})"
+            print(f"{result['position']:<10} depth {result['depth']}: {result['nodes']:>9} nodes "
+                  f"{result['seconds']:8.2f}s {result['nps']:>10,.0f} nps  {status}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"backend": args.backend, "python": platform.python_version(), "perft": results}, f, indent=2)
+        return 0 if all(result["ok"] for result in results) else 1
+
+    if args.command == "divide":
+        counts = divide(newGameState(args.fen, args.backend), args.depth)
+        for notation in sorted(counts):
+            print(f"{notation}: {counts[notation]}")
+        print(f"\nMoves: {len(counts)}\nNodes: {sum(counts.values())}")
+        return 0
+
+    bench = runBenchmarks(args.backend, args.seconds)
+    for name, opsPerSecond in bench.items():
+        print(f"{name:<20} {opsPerSecond:>12,.0f} ops/s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"backend": args.backend, "python": platform.python_version(), "bench": bench}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compareWithBaseline(bench, json.load(f)["bench"], args.max_slowdown)
+        for failure in failures:
+            print("SLOWER:", failure)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
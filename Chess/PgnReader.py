@@ -0,0 +1,284 @@
+"""Streaming PGN import.
+
+    from Chess.PgnReader import readGames
+    for game in readGames("dump.pgn.gz"):
+        game.headers["White"], game.result, game.moves   # moves are Move objects
+
+    python -m Chess pgn games.pgn.bz2 [--limit N] [--backend bitboard]
+
+Files (plain, .gz or .bz2) are read through a fixed-size buffer and games are
+yielded one at a time, so memory use does not grow with the size of the file.
+SAN tokens are resolved against GameState.getValidMoves, which makes every
+imported move legal by construction.
+"""
+import argparse
+import bz2
+import gzip
+import io
+import re
+import sys
+import time
+
+from .ChessEngine import GameState, Move, START_FEN
+
+HEADER_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+MOVE_NUMBER_PATTERN = re.compile(r"^\d+\.+")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class PgnError(ValueError):
+    pass
+
+
+class PgnGame():
+    def __init__(self, headers):
+        self.headers = headers
+        self.moves = []
+        self.result = headers.get("Result", "*")
+        self.error = None  # set when the movetext could not be replayed; moves stops there
+
+    @property
+    def startFen(self):
+        return self.headers.get("FEN", START_FEN)
+
+    def replay(self, gs=None):
+        """Plays the game into gs (a fresh GameState by default) and returns it."""
+        gs = gs if gs is not None else GameState()
+        gs.loadFen(self.startFen)
+        for move in self.moves:
+            gs.makeMove(move)
+        return gs
+
+
+def openPgn(path, chunkSize=1 << 16):
+    """Opens a PGN file as text, decompressing .gz/.bz2 on the fly and reading
+    `chunkSize` bytes at a time."""
+    if path.endswith(".gz"):
+        raw = gzip.open(path, "rb")
+    elif path.endswith(".bz2"):
+        raw = bz2.open(path, "rb")
+    else:
+        raw = open(path, "rb", buffering=0)
+    return io.TextIOWrapper(io.BufferedReader(raw, chunkSize), encoding="utf-8", errors="replace")
+
+
+def _movetextTokens(line, state):
+    """Splits one line of movetext into move/result tokens, skipping comments, NAGs and
+    variations. `state` is [brace comment open, variation depth], carried across lines."""
+    i = 0
+    n = len(line)
+    while i < n:
+        ch = line[i]
+        if state[0]:
+            end = line.find("}", i)
+            if end < 0:
+                return
+            state[0] = False
+            i = end + 1
+        elif ch == "{":
+            state[0] = True
+            i += 1
+        elif ch == ";":
+            return
+        elif ch == "(":
+            state[1] += 1
+            i += 1
+        elif ch == ")":
+            state[1] = max(0, state[1] - 1)
+            i += 1
+        elif ch.isspace():
+            i += 1
+        else:
+            start = i
+            while i < n and not line[i].isspace() and line[i] not in "{}();":
+                i += 1
+            if state[1] == 0:
+                token = line[start:i]
+                if token[0] != "$":
+                    yield token
+
+
+def resolveSan(gs, san, validMoves=None):
+    """Returns the legal Move in gs written as `san`; raises PgnError if there is none
+    or the notation is ambiguous."""
+    text = san.rstrip("+#!?")
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(text) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        raise PgnError(f"Illegal castling: {san}")
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise PgnError(f"Unreadable move: {san}")
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    piece = piece or "p"
+    endRow, endCol = Move.ranksToRows[target[1]], Move.filesToCols[target[0]]
+    startCol = Move.filesToCols[fromFile] if fromFile else None
+    startRow = Move.ranksToRows[fromRank] if fromRank else None
+    found = None
+    for move in validMoves:
+        if (move.endRow == endRow and move.endCol == endCol and move.pieceMoved[1] == piece
+                and (startCol is None or move.startCol == startCol)
+                and (startRow is None or move.startRow == startRow)
+                and not move.isCastleMove):
+            if move.isPawnPromotion and move.promotionChoice != (promotion or "Q"):
+                continue
+            if found is not None:
+                raise PgnError(f"Ambiguous move: {san}")
+            found = move
+    if found is None:
+        raise PgnError(f"Illegal move: {san}")
+    return found
+
+
+def moveToSan(gs, move, validMoves=None):
+    """Standard algebraic notation for a legal move in gs, with +/# suffix."""
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    if move.isCastleMove:
+        san = "O-O" if move.endCol == 6 else "O-O-O"
+    else:
+        piece = move.pieceMoved[1]
+        target = move.colsToFiles[move.endCol] + move.rowsToRanks[move.endRow]
+        capture = move.pieceCaptured != "--"
+        if piece == "p":
+            san = (move.colsToFiles[move.startCol] + "x" if capture else "") + target
+            if move.isPawnPromotion:
+                san += "=" + move.promotionChoice
+        else:
+            rivals = [other for other in validMoves if other.pieceMoved == move.pieceMoved and
+                      other.endRow == move.endRow and other.endCol == move.endCol and other.moveID != move.moveID]
+            disambiguation = ""
+            if rivals:
+                if all(other.startCol != move.startCol for other in rivals):
+                    disambiguation = move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    disambiguation = move.rowsToRanks[move.startRow]
+                else:
+                    disambiguation = move.colsToFiles[move.startCol] + move.rowsToRanks[move.startRow]
+            san = piece + disambiguation + ("x" if capture else "") + target
+    flags = (gs.checkMate, gs.staleMate)
+    gs.makeMove(move, record=False)
+    if gs.inCheck():
+        san += "#" if not gs.hasLegalMove() else "+"
+    gs.undoMove(record=False)
+    gs.checkMate, gs.staleMate = flags
+    return san
+
+
+def readGames(source, backend="list", chunkSize=1 << 16, gs=None):
+    """Yields a PgnGame for every game in `source`, a file path or an open text stream.
+
+    Games whose movetext cannot be replayed are still yielded, with `error` set and
+    `moves` holding the moves up to the problem. Pass gs to replay the games on an
+    existing GameState (backend is then ignored); it is left at the last position read.
+    """
+    stream = openPgn(source, chunkSize) if isinstance(source, str) else source
+    # One GameState for the whole file, so its position cache keeps common openings
+    if gs is None:
+        gs = GameState(backend)
+    try:
+        headers = {}
+        game = None
+        state = [False, 0]
+        for line in stream:
+            if not state[0] and state[1] == 0 and line.startswith("["):
+                # A tag pair outside comments and variations starts the next game
+                if game is not None:
+                    yield game
+                    game = None
+                    state = [False, 0]
+                match = HEADER_PATTERN.match(line.strip())
+                if match:
+                    headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+            if game is None:
+                if not line.strip():
+                    continue
+                game = PgnGame(headers)
+                headers = {}
+                try:
+                    gs.loadFen(game.startFen)
+                except (ValueError, IndexError, KeyError):
+                    game.error = f"Invalid FEN: {game.startFen}"
+            for token in _movetextTokens(line, state):
+                if token in RESULTS:
+                    game.result = token
+                    continue
+                if game.error is not None:
+                    continue
+                token = MOVE_NUMBER_PATTERN.sub("", token)
+                if not token:
+                    continue
+                try:
+                    move = resolveSan(gs, token)
+                except PgnError as error:
+                    game.error = str(error)
+                    continue
+                gs.makeMove(move, record=False)
+                game.moves.append(move)
+        if game is not None:
+            yield game
+        elif headers:
+            yield PgnGame(headers)
+    finally:
+        if isinstance(source, str):
+            stream.close()
+
+
+def readGameTexts(source, chunkSize=1 << 16):
+    """Yields the raw text (tag pairs and movetext) of every game without replaying it,
+    so the SAN work can be handed to other processes; readGames(io.StringIO(text), gs=gs)
+    parses one."""
+    stream = openPgn(source, chunkSize) if isinstance(source, str) else source
+    try:
+        lines = []
+        inMovetext = False
+        state = [False, 0]
+        for line in stream:
+            if not state[0] and state[1] == 0 and line.startswith("["):
+                if inMovetext:
+                    yield "".join(lines)
+                    lines = []
+                    inMovetext = False
+            elif line.strip():
+                inMovetext = True
+                for token in _movetextTokens(line, state):
+                    pass
+            lines.append(line)
+        if inMovetext or any(line.strip() for line in lines):
+            yield "".join(lines)
+    finally:
+        if isinstance(source, str):
+            stream.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import PGN games and report throughput")
+    parser.add_argument("path", help="PGN file (.pgn, .pgn.gz or .pgn.bz2)")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    parser.add_argument("--limit", type=int, help="stop after this many games")
+    args = parser.parse_args(argv)
+
+    games = plies = errors = 0
+    start = time.perf_counter()
+    for game in readGames(args.path, args.backend):
+        games += 1
+        plies += len(game.moves)
+        if game.error:
+            errors += 1
+            print(f"game {games}: {game.error}", file=sys.stderr)
+        if args.limit and games >= args.limit:
+            break
+    seconds = time.perf_counter() - start
+    print(f"{games} games, {plies} plies, {errors} errors in {seconds:.2f}s: "
+          f"{games / seconds if seconds else 0:,.1f} games/s, {plies / seconds if seconds else 0:,.0f} plies/s")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
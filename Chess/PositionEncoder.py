@@ -0,0 +1,257 @@
+"""Batch encoding of positions into NumPy arrays for training evaluation models.
+
+    batch = PositionBatch.allocate(len(states))               # or allocate(n, "out/") for .npy memmaps
+    encodePositions(states, batch)
+    batch.planes       # (N, 12, 8, 8) uint8, one plane per piece in PLANE_PIECES order
+    batch.sideToMove   # (N,) uint8, 1 when White is to move
+    batch.castling     # (N, 4) uint8, rights K Q k q
+    batch.enPassant    # (N, 8) uint8, one-hot file of the en passant square (all 0 when none)
+
+    encodeGames([(startFen, packedMoves), ...], batch)         # every position of every game
+
+    python -m Chess encode encode games.chessarc out/       # games.pgn works too
+    python -m Chess encode bench games.chessarc
+
+Row 0 of a plane is rank 8, as in GameState.board. Nothing is encoded square by
+square in Python: each position contributes its board as a 128-byte string, and
+every few thousand positions the strings are decoded into piece codes with one
+table lookup and expanded into planes by a single numpy.equal that writes straight
+into the caller's arrays (in memory or memory-mapped .npy files).
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from .ChessEngine import START_FEN, GameState, Move
+
+PLANE_PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+CHUNK_SIZE = 4096  # positions gathered before each vectorised write
+ARRAY_SHAPES = {"planes": (12, 8, 8), "sideToMove": (), "castling": (4,), "enPassant": (8,)}
+
+# Piece code (plane + 1, 0 for empty) indexed by the two characters of a board entry
+_PIECE_LOOKUP = np.zeros((256, 256), np.uint8)
+for _plane, _piece in enumerate(PLANE_PIECES):
+    _PIECE_LOOKUP[ord(_piece[0]), ord(_piece[1])] = _plane + 1
+_PLANE_CODES = np.arange(1, 13, dtype=np.uint8)[None, :, None]
+# CastleRights.index() bits (wks 1, bks 2, wqs 4, bqs 8) in K Q k q order
+_CASTLING_SHIFTS = np.array([0, 2, 1, 3], np.uint8)
+_FILES = np.arange(8, dtype=np.uint8)
+
+
+class PositionBatch():
+    """The output arrays, all with the same first dimension. Caller-supplied arrays
+    must be C-contiguous uint8 with the shapes in ARRAY_SHAPES, since the encoder
+    writes into them through reshaped views."""
+
+    def __init__(self, planes, sideToMove, castling, enPassant):
+        for name, array in (("planes", planes), ("sideToMove", sideToMove), ("castling", castling),
+                            ("enPassant", enPassant)):
+            if (array.dtype != np.uint8 or array.shape[1:] != ARRAY_SHAPES[name] or len(array) != len(planes)
+                    or not array.flags.c_contiguous):
+                raise ValueError(f"{name} must be a C-contiguous uint8 array of shape (N,) + {ARRAY_SHAPES[name]}")
+        self.planes = planes
+        self.sideToMove = sideToMove
+        self.castling = castling
+        self.enPassant = enPassant
+
+    @classmethod
+    def allocate(cls, count, directory=None):
+        """Zeroed arrays for count positions; with a directory they are memory-mapped
+        <name>.npy files there, which np.load(path, mmap_mode="r") opens again."""
+        arrays = {}
+        for name, shape in ARRAY_SHAPES.items():
+            if directory is None:
+                arrays[name] = np.zeros((count,) + shape, np.uint8)
+            else:
+                os.makedirs(directory, exist_ok=True)
+                arrays[name] = np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), "w+", np.uint8,
+                                                         (count,) + shape)
+        return cls(**arrays)
+
+    @classmethod
+    def load(cls, directory, mmapMode="r"):
+        return cls(**{name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmapMode)
+                      for name in ARRAY_SHAPES})
+
+    def __len__(self):
+        return len(self.planes)
+
+    def flush(self):
+        for array in (self.planes, self.sideToMove, self.castling, self.enPassant):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+
+class _ChunkWriter():
+    """Collects positions and writes them to a PositionBatch CHUNK_SIZE at a time."""
+
+    def __init__(self, batch, start):
+        self.batch = batch
+        self.position = start
+        self.boards = []
+        self.sides = bytearray()
+        self.rights = bytearray()
+        self.files = bytearray()
+
+    def add(self, gs):
+        if self.position + len(self.boards) >= len(self.batch):
+            raise ValueError(f"PositionBatch is full ({len(self.batch)} positions)")
+        self.boards.append("".join(["".join(row) for row in gs.board]))
+        self.sides.append(gs.whiteToMove)
+        self.rights.append(gs.currentCastlingRight.index())
+        self.files.append(8 if gs.enpassantPossible == () else gs.enpassantPossible[1])
+        if len(self.boards) == CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        count = len(self.boards)
+        if not count:
+            return
+        stop = self.position + count
+        characters = np.frombuffer("".join(self.boards).encode("ascii"), np.uint8).reshape(count, 64, 2)
+        codes = _PIECE_LOOKUP[characters[:, :, 0], characters[:, :, 1]]
+        planes = self.batch.planes[self.position:stop].reshape(count, 12, 64).view(np.bool_)
+        np.equal(codes[:, None, :], _PLANE_CODES, out=planes)
+        self.batch.sideToMove[self.position:stop] = np.frombuffer(self.sides, np.uint8)
+        rights = np.frombuffer(self.rights, np.uint8)
+        np.bitwise_and(rights[:, None] >> _CASTLING_SHIFTS, 1, out=self.batch.castling[self.position:stop])
+        np.equal(np.frombuffer(self.files, np.uint8)[:, None], _FILES,
+                 out=self.batch.enPassant[self.position:stop].view(np.bool_))
+        self.position = stop
+        self.boards = []
+        self.sides = bytearray()
+        self.rights = bytearray()
+        self.files = bytearray()
+
+
+def encodePositions(states, batch, start=0):
+    """Encodes the current position of every GameState in states into batch from
+    index start. Returns the index after the last position written."""
+    writer = _ChunkWriter(batch, start)
+    for gs in states:
+        writer.add(gs)
+    writer.flush()
+    return writer.position
+
+
+def encodeGames(games, batch, start=0, backend="list"):
+    """Encodes every position of every game: the start position and the position
+    after each move. Each game is a sequence of moves (packed ints or Moves) from
+    the initial position, or a (start FEN, moves) pair. Returns the index after the
+    last position written."""
+    gs = GameState(backend, positionCacheSize=0)
+    writer = _ChunkWriter(batch, start)
+    for game in games:
+        if isinstance(game, tuple) and len(game) == 2 and (game[0] is None or isinstance(game[0], str)):
+            startFen, moves = game
+        else:
+            startFen, moves = None, game
+        gs.loadFen(startFen or START_FEN)
+        writer.add(gs)
+        for move in moves:
+            gs.makeMove(Move.fromPacked(move, gs.board) if isinstance(move, int) else move, record=False)
+            writer.add(gs)
+    writer.flush()
+    return writer.position
+
+
+def _corpus(path, backend):
+    from .OpeningBook import corpusGames
+    return ((startFen, packedMoves) for startFen, packedMoves, result in corpusGames(path, backend))
+
+
+def _naiveEncode(states, batch):
+    """Square-by-square reference encoder, used by the benchmark as the baseline."""
+    for i, gs in enumerate(states):
+        for r in range(8):
+            for c in range(8):
+                piece = gs.board[r][c]
+                if piece != "--":
+                    batch.planes[i, PLANE_PIECES.index(piece), r, c] = 1
+        batch.sideToMove[i] = gs.whiteToMove
+        rights = gs.currentCastlingRight
+        batch.castling[i] = (rights.wks, rights.wqs, rights.bks, rights.bqs)
+        if gs.enpassantPossible != ():
+            batch.enPassant[i, gs.enpassantPossible[1]] = 1
+
+
+def benchmark(corpusPath, backend="list", limit=100000):
+    """Positions per second for the vectorised encoder on GameStates and on move
+    streams, against the square-by-square baseline. Returns a dict."""
+    games = []
+    total = 0
+    for game in _corpus(corpusPath, backend):
+        games.append(game)
+        total += len(game[1]) + 1
+        if total >= limit:
+            break
+    states = []
+    gs = GameState(backend, positionCacheSize=0)
+    for startFen, moves in games:
+        gs.loadFen(startFen)
+        states.append(_PositionSnapshot(gs))
+        for packed in moves:
+            gs.makeMove(Move.fromPacked(packed, gs.board), record=False)
+            states.append(_PositionSnapshot(gs))
+    batch = PositionBatch.allocate(total)
+    start = time.perf_counter()
+    encodePositions(states, batch)
+    statesSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    encodeGames(games, batch)
+    gamesSeconds = time.perf_counter() - start
+    reference = PositionBatch.allocate(total)
+    start = time.perf_counter()
+    _naiveEncode(states, reference)
+    naiveSeconds = time.perf_counter() - start
+    matches = all(np.array_equal(getattr(batch, name), getattr(reference, name)) for name in ARRAY_SHAPES)
+    return {"positions": total, "statesPerSecond": total / statesSeconds, "gamesPerSecond": total / gamesSeconds,
+            "naivePerSecond": total / naiveSeconds, "matchesReference": matches}
+
+
+class _PositionSnapshot():
+    """The attributes the encoder reads, copied from a GameState."""
+
+    def __init__(self, gs):
+        self.board = [row[:] for row in gs.board]
+        self.whiteToMove = gs.whiteToMove
+        self.currentCastlingRight = type(gs.currentCastlingRight)(False, False, False, False)
+        self.currentCastlingRight.setIndex(gs.currentCastlingRight.index())
+        self.enpassantPossible = gs.enpassantPossible
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encode positions as NumPy planes for model training")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    sub = parser.add_subparsers(dest="command", required=True)
+    encodeParser = sub.add_parser("encode", help="write every position of a PGN file or game archive as .npy files")
+    encodeParser.add_argument("corpus")
+    encodeParser.add_argument("directory")
+    benchParser = sub.add_parser("bench", help="positions per second against a square-by-square encoder")
+    benchParser.add_argument("corpus")
+    benchParser.add_argument("--limit", type=int, default=100000, help="positions to encode")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        result = benchmark(args.corpus, args.backend, args.limit)
+        print(f"{result['positions']} positions")
+        print(f"GameStates        {result['statesPerSecond']:12,.0f} positions/s")
+        print(f"move streams      {result['gamesPerSecond']:12,.0f} positions/s (including replay)")
+        print(f"square by square  {result['naivePerSecond']:12,.0f} positions/s")
+        print(f"matches reference: {result['matchesReference']}")
+        return 0
+    start = time.perf_counter()
+    # One pass to size the memory-mapped arrays, one to fill them
+    count = sum(len(moves) + 1 for startFen, moves in _corpus(args.corpus, args.backend))
+    batch = PositionBatch.allocate(count, args.directory)
+    encodeGames(_corpus(args.corpus, args.backend), batch, backend=args.backend)
+    batch.flush()
+    print(f"{count} positions written to {args.directory} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
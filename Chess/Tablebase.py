@@ -0,0 +1,437 @@
+"""Endgame tablebases: retrograde analysis of small material sets, probed through mmap.
+
+    python -m Chess tablebase generate KQK KRK KPK --directory tablebases --workers 4
+    python -m Chess tablebase probe --fen "8/8/8/4k3/8/8/8/4K2Q w - - 0 1"
+
+    from Chess.Tablebase import probe
+    probe(gs)   # (1, 19): side to move mates in 19 plies; (-1, n) loses; (0, 0) draw; None if unknown
+
+A material set is a king and one or more pieces against a lone king, named like
+"KQK", "KRK", "KPK" or "KBNK" (the pieces of the stronger side between the two
+K's). Either colour may be the stronger side when probing; tables are stored with
+White stronger and positions are mirrored before lookup.
+
+Each table is a header followed by one byte per index: 0 for a draw (or an
+illegal placement), otherwise 1 + the number of plies to mate. The index is
+side to move, the white king square, the black king square and the square of
+every other piece, with the white king folded into one eighth of the board
+(one half when there are pawns) by symmetry.
+
+Generation plays every position's moves with GameState.getValidMoves across a
+process pool, then works backwards from the checkmates one ply at a time.
+Captures and promotions leave the table; their results come from the smaller
+tables, which are generated first when missing.
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from .ChessEngine import KING_TARGETS, CastleRights, GameState
+
+MAGIC = b"CHESSTB1"
+HEADER_FORMAT = "<8s8sQ"  # magic, material set name, number of entries
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+PIECE_ORDER = "QRBNP"
+NO_RESULT = 255
+
+# Status of a position found by the forward scan
+ILLEGAL, NORMAL, MATED, STALEMATE = 0, 1, 2, 3
+
+
+def _transform(sq, flipRows, flipCols, swap):
+    r, c = divmod(sq, 8)
+    if flipRows:
+        r = 7 - r
+    if flipCols:
+        c = 7 - c
+    if swap:  # reflect in the a1-h8 diagonal
+        r, c = 7 - c, 7 - r
+    return r * 8 + c
+
+
+def _buildTransforms(pawns):
+    """For every white king square, the square mapping that moves the king into the
+    canonical region: files a-d, and without pawns also ranks 1-4 below the diagonal."""
+    transforms = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        flipRows = not pawns and r < 4
+        flipCols = c > 3
+        r2, c2 = divmod(_transform(sq, flipRows, flipCols, False), 8)
+        swap = not pawns and 7 - r2 > c2
+        transforms.append(tuple(_transform(s, flipRows, flipCols, swap) for s in range(64)))
+    return transforms
+
+
+TRANSFORMS = {False: _buildTransforms(False), True: _buildTransforms(True)}
+KING_REGIONS = {pawns: sorted(set(TRANSFORMS[pawns][sq][sq] for sq in range(64))) for pawns in (False, True)}
+KING_REGION_INDEX = {pawns: {sq: i for i, sq in enumerate(KING_REGIONS[pawns])} for pawns in (False, True)}
+ADJACENT = [set(r * 8 + c for r, c in KING_TARGETS[sq // 8][sq % 8]) for sq in range(64)]
+
+
+def materialName(pieces):
+    return "K" + "".join(sorted(pieces, key=PIECE_ORDER.index)) + "K"
+
+
+def isDrawnMaterial(pieces):
+    """A lone minor piece (or nothing) cannot mate."""
+    return len(pieces) == 0 or (len(pieces) == 1 and pieces[0] in "BN")
+
+
+class MaterialSet():
+    def __init__(self, name):
+        if not (name.startswith("K") and name.endswith("K") and len(name) >= 3 and
+                all(piece in PIECE_ORDER for piece in name[1:-1])):
+            raise ValueError(f"Unsupported material set: {name} (expected e.g. KQK, KRK, KPK, KBNK)")
+        self.pieces = sorted(name[1:-1], key=PIECE_ORDER.index)
+        self.name = materialName(self.pieces)
+        self.pawns = "P" in self.pieces
+        self.region = KING_REGIONS[self.pawns]
+        self.regionIndex = KING_REGION_INDEX[self.pawns]
+        self.transforms = TRANSFORMS[self.pawns]
+        self.radices = [48 if piece == "P" else 64 for piece in self.pieces]
+        self.size = 2 * len(self.region) * 64
+        for radix in self.radices:
+            self.size *= radix
+
+    def index(self, whiteToMove, whiteKing, blackKing, squares):
+        """Perfect index of a placement; White is the stronger side."""
+        transform = self.transforms[whiteKing]
+        index = (0 if whiteToMove else 1) * len(self.region) + self.regionIndex[transform[whiteKing]]
+        index = index * 64 + transform[blackKing]
+        for piece, sq in zip(self.pieces, squares):
+            index = index * 64 + transform[sq] if piece != "P" else index * 48 + transform[sq] - 8
+        return index
+
+    def decode(self, index):
+        """(whiteToMove, white king, black king, piece squares) for an index."""
+        squares = []
+        for piece, radix in zip(reversed(self.pieces), reversed(self.radices)):
+            index, digit = divmod(index, radix)
+            squares.append(digit + 8 if piece == "P" else digit)
+        squares.reverse()
+        index, blackKing = divmod(index, 64)
+        side, king = divmod(index, len(self.region))
+        return side == 0, self.region[king], blackKing, squares
+
+    def dependencies(self):
+        """Smaller material sets reachable by a capture or a promotion."""
+        names = set()
+        for i, piece in enumerate(self.pieces):
+            rest = self.pieces[:i] + self.pieces[i + 1:]
+            if not isDrawnMaterial(rest):
+                names.add(materialName(rest))
+            if piece == "P":
+                for promoted in "QRBN":
+                    if not isDrawnMaterial(rest + [promoted]):
+                        names.add(materialName(rest + [promoted]))
+        return sorted(names)
+
+
+class Tablebases():
+    """The tables in a directory, opened lazily and read through mmap."""
+
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".dtm")
+
+    def _table(self, name):
+        if name not in self.tables:
+            table = None
+            if os.path.exists(self.path(name)):
+                f = open(self.path(name), "rb")
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, storedName, size = struct.unpack_from(HEADER_FORMAT, data, 0)
+                if magic != MAGIC or storedName.rstrip(b"\0").decode() != name:
+                    raise ValueError(f"Not a tablebase for {name}: {self.path(name)}")
+                table = (MaterialSet(name), data, f)
+            self.tables[name] = table
+        return self.tables[name]
+
+    def probe(self, gs):
+        """(wdl, plies) for the side to move: wdl is 1 (wins), 0 (draw) or -1 (loses) and
+        plies the distance to mate. None if the material has no table or castling is
+        still possible."""
+        rights = gs.currentCastlingRight
+        if rights.wks or rights.wqs or rights.bks or rights.bqs:
+            return None
+        pieces = {"w": [], "b": []}
+        for r, row in enumerate(gs.board):
+            for c, piece in enumerate(row):
+                if piece != "--":
+                    pieces[piece[0]].append((piece[1].upper(), r * 8 + c))  # "p" -> "P"
+        if len(pieces["b"]) == 1:
+            strong, whiteToMove, mirror = pieces["w"], gs.whiteToMove, False
+            weakKing = pieces["b"][0][1] if pieces["b"][0][0] == "K" else None
+        elif len(pieces["w"]) == 1:
+            # Black is the stronger side: flip the board so it plays up the board as White
+            strong, whiteToMove, mirror = pieces["b"], not gs.whiteToMove, True
+            weakKing = pieces["w"][0][1] ^ 56 if pieces["w"][0][0] == "K" else None
+        else:
+            return None
+        strongKing = None
+        others = []
+        for piece, sq in strong:
+            sq = sq ^ 56 if mirror else sq
+            if piece != "K":
+                others.append((PIECE_ORDER.index(piece), sq, piece))
+            elif strongKing is None:
+                strongKing = sq
+            else:
+                return None
+        if strongKing is None or weakKing is None:
+            return None
+        others.sort()
+        if isDrawnMaterial([piece for order, sq, piece in others]):
+            return (0, 0)
+        table = self._table(materialName([piece for order, sq, piece in others]))
+        if table is None:
+            return None
+        material, data, f = table
+        value = data[HEADER_SIZE + material.index(whiteToMove, strongKing, weakKing, [sq for order, sq, piece in others])]
+        if value == 0:
+            return (0, 0)
+        return (1, value - 1) if whiteToMove else (-1, value - 1)
+
+    def bestMove(self, gs):
+        """A move that keeps the tablebase result (quickest mate when winning, slowest when
+        losing), with its (wdl, plies); None if the position cannot be probed."""
+        if self.probe(gs) is None:
+            return None
+        best = None
+        bestKey = None
+        flags = (gs.checkMate, gs.staleMate)
+        for move in gs.getValidMoves():
+            gs.makeMove(move, record=False)
+            result = self.probe(gs) or (0, 0)  # mates and stalemates are in the tables too
+            gs.undoMove(record=False)
+            wdl, plies = -result[0], result[1] + 1 if result[0] else 0
+            key = (wdl, -plies if wdl > 0 else plies)
+            if bestKey is None or key > bestKey:
+                best, bestKey = (move, (wdl, plies)), key
+        gs.checkMate, gs.staleMate = flags
+        return best
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+                table[2].close()
+        self.tables = {}
+
+
+_defaultTablebases = None
+
+
+def probe(gs):
+    """Probes the tables in TABLEBASE_DIR; see Tablebases.probe."""
+    global _defaultTablebases
+    if _defaultTablebases is None:
+        _defaultTablebases = Tablebases()
+    return _defaultTablebases.probe(gs)
+
+
+# ---------------------------------------------------------------------------
+# Generation
+# ---------------------------------------------------------------------------
+
+_scanState = None  # (GameState, Tablebases) of a worker process
+
+
+def _initScan(directory):
+    global _scanState
+    _scanState = (GameState(positionCacheSize=0), Tablebases(directory))
+
+
+def _setUp(gs, material, whiteToMove, whiteKing, blackKing, squares):
+    board = [["--"] * 8 for r in range(8)]
+    board[whiteKing // 8][whiteKing % 8] = "wK"
+    board[blackKing // 8][blackKing % 8] = "bK"
+    for piece, sq in zip(material.pieces, squares):
+        board[sq // 8][sq % 8] = "wp" if piece == "P" else "w" + piece
+    gs.board = board
+    gs.whiteToMove = whiteToMove
+    gs.whiteKingLocation = divmod(whiteKing, 8)
+    gs.blackKingLocation = divmod(blackKing, 8)
+    gs.currentCastlingRight = CastleRights(False, False, False, False)
+    gs.enpassantPossible = ()
+    gs.halfmoveClock = 0
+    gs.moveLog = []
+
+
+def _scanRange(name, start, stop):
+    """Forward pass over indexes [start, stop): status, in-table successors and the best
+    result of moves that leave the table, for every position."""
+    gs, tablebases = _scanState
+    material = MaterialSet(name)
+    count = stop - start
+    status = bytearray(count)
+    successorCounts = array("H", bytes(2 * count))
+    successors = array("I")
+    external = bytearray(b"\xff" * count)
+    for offset in range(count):
+        whiteToMove, whiteKing, blackKing, squares = material.decode(start + offset)
+        occupied = {whiteKing, blackKing, *squares}
+        if len(occupied) != 2 + len(squares) or blackKing in ADJACENT[whiteKing]:
+            continue
+        _setUp(gs, material, whiteToMove, whiteKing, blackKing, squares)
+        if whiteToMove and gs.isSquareAttacked(blackKing // 8, blackKing % 8, "w"):
+            continue  # Black to move would have left its king in check
+        moves = gs.getValidMoves()
+        if not moves:
+            status[offset] = MATED if gs.checkMate else STALEMATE
+            continue
+        status[offset] = NORMAL
+        # White: quickest win found outside the table. Black: slowest loss outside the
+        # table, or NO_RESULT once a move escapes to a draw.
+        best = NO_RESULT if whiteToMove else 0
+        for move in moves:
+            startSq = move.startRow * 8 + move.startCol
+            endSq = move.endRow * 8 + move.endCol
+            if move.pieceCaptured != "--" or move.isPawnPromotion:
+                gs.makeMove(move, record=False)
+                result = tablebases.probe(gs)
+                gs.undoMove(record=False)
+                if result is None:
+                    raise RuntimeError(f"{name}: no table for the position after {move.getChessNotation()}")
+                if whiteToMove:
+                    if result[0] < 0:
+                        best = min(best, result[1] + 1)
+                elif best != NO_RESULT:
+                    best = max(best, result[1] + 1) if result[0] > 0 else NO_RESULT
+                continue
+            if startSq == whiteKing:
+                successor = material.index(not whiteToMove, endSq, blackKing, squares)
+            elif startSq == blackKing:
+                successor = material.index(not whiteToMove, whiteKing, endSq, squares)
+            else:
+                moved = [endSq if sq == startSq else sq for sq in squares]
+                successor = material.index(not whiteToMove, whiteKing, blackKing, moved)
+            successors.append(successor)
+            successorCounts[offset] += 1
+        external[offset] = best
+    return status, successorCounts, successors, external
+
+
+def generate(name, directory=TABLEBASE_DIR, workers=None, chunkSize=4096, log=print):
+    """Builds the table for a material set (and any smaller ones it needs that are
+    missing) and writes it to directory. Returns the path of the table."""
+    material = MaterialSet(name)
+    os.makedirs(directory, exist_ok=True)
+    for dependency in material.dependencies():
+        if not os.path.exists(os.path.join(directory, dependency + ".dtm")):
+            generate(dependency, directory, workers, chunkSize, log)
+
+    started = time.perf_counter()
+    size = material.size
+    status = bytearray()
+    successorCounts = array("H")
+    successors = array("I")
+    external = bytearray()
+    with ProcessPoolExecutor(workers, initializer=_initScan, initargs=(directory,)) as pool:
+        ranges = [(start, min(start + chunkSize, size)) for start in range(0, size, chunkSize)]
+        for part in pool.map(_scanRange, [material.name] * len(ranges), *zip(*ranges)):
+            status += part[0]
+            successorCounts.extend(part[1])
+            successors.extend(part[2])
+            external += part[3]
+    scanned = time.perf_counter()
+
+    # Predecessor lists, in the same flat layout as the successors
+    predecessorStart = array("I", bytes(4 * (size + 1)))
+    for successor in successors:
+        predecessorStart[successor + 1] += 1
+    for i in range(size):
+        predecessorStart[i + 1] += predecessorStart[i]
+    predecessors = array("I", bytes(4 * len(successors)))
+    cursor = array("I", predecessorStart)
+    position = 0
+    for index in range(size):
+        for k in range(position, position + successorCounts[index]):
+            successor = successors[k]
+            predecessors[cursor[successor]] = index
+            cursor[successor] += 1
+        position += successorCounts[index]
+    del successors, cursor
+
+    # Retrograde pass, one ply at a time. buckets[d] holds positions that are
+    # decided at d plies to mate unless an earlier bucket already decided them.
+    half = size // 2  # indexes below half have White to move
+    values = bytearray(size)
+    buckets = [[] for d in range(256)]
+    remaining = successorCounts
+    for index in range(size):
+        if status[index] == MATED:
+            buckets[0].append(index)
+        elif status[index] == NORMAL and external[index] != NO_RESULT:
+            if index < half or remaining[index] == 0:
+                buckets[external[index]].append(index)
+    for plies in range(254):
+        for index in buckets[plies]:
+            if values[index]:
+                continue
+            values[index] = plies + 1
+            for k in range(predecessorStart[index], predecessorStart[index + 1]):
+                predecessor = predecessors[k]
+                if values[predecessor]:
+                    continue
+                if index >= half:
+                    buckets[plies + 1].append(predecessor)  # White mates by moving here
+                else:
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor] == 0 and external[predecessor] != NO_RESULT:
+                        buckets[max(plies + 1, external[predecessor])].append(predecessor)
+        buckets[plies] = None
+
+    path = os.path.join(directory, material.name + ".dtm")
+    with open(path + ".tmp", "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, material.name.encode(), size))
+        f.write(values)
+    os.replace(path + ".tmp", path)
+    legal = size - status.count(ILLEGAL)
+    won = size - values.count(0)
+    if log:
+        log(f"{material.name}: {size} indexes, {legal} legal, {won} decided, longest mate {max(values) - 1} plies; "
+            f"scan {scanned - started:.1f}s, solve {time.perf_counter() - scanned:.1f}s")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and probe endgame tablebases")
+    parser.add_argument("--directory", default=TABLEBASE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    generateParser = sub.add_parser("generate", help="build tables for material sets such as KQK KRK KPK KBNK")
+    generateParser.add_argument("names", nargs="+")
+    generateParser.add_argument("--workers", type=int, help="processes for the forward scan (default: all cores)")
+    probeParser = sub.add_parser("probe", help="look up a position")
+    probeParser.add_argument("--fen", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for name in args.names:
+            generate(name, args.directory, args.workers)
+        return 0
+    gs = GameState()
+    gs.loadFen(args.fen)
+    tablebases = Tablebases(args.directory)
+    result = tablebases.probe(gs)
+    if result is None:
+        print("not in the tablebases")
+        return 1
+    best = tablebases.bestMove(gs)
+    outcome = {1: f"win, mate in {result[1]} plies", 0: "draw", -1: f"loss, mated in {result[1]} plies"}[result[0]]
+    print(outcome + (f"; best move {best[0].getChessNotation()}" if best else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
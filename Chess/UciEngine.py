@@ -0,0 +1,231 @@
+"""UCI front-end: a long-running engine process speaking the Universal Chess
+Interface over stdin/stdout, for chess GUIs and scripted analysis.
+
+    python -m Chess uci
+
+Supported commands: uci, isready, ucinewgame, position (startpos | fen <fen>)
+[moves ...], go [depth n] [movetime ms] [wtime/btime/winc/binc/movestogo ...]
+[infinite], stop and quit. Anything else is ignored, as the protocol asks.
+
+One GameState and one Analyzer live for the whole process, so the transposition
+table and the position cache stay warm from one command to the next. A position
+command that repeats the previous one plus some moves (what GUIs send after every
+move) only plays the new moves; a shorter or different move list takes back moves
+to the common prefix first. The search runs in a worker thread that polls a stop
+flag, so stop, isready and quit are answered while it is searching.
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+
+from .Analyzer import MATE_SCORE, MAX_PLY, Analyzer, isMateScore
+from .ChessEngine import START_FEN, GameState
+
+ENGINE_NAME = "chess-analyzer"
+ENGINE_AUTHOR = "chess-analyzer contributors"
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining clock time is spread over when the GUI does not say
+MOVE_OVERHEAD_MS = 50  # kept in hand on every move for communication delays
+
+logger = logging.getLogger(__name__)
+
+
+def scoreText(score):
+    """UCI score field for a side-to-move score from Analyzer."""
+    if isMateScore(score):
+        plies = MATE_SCORE - abs(score)
+        return f"mate {(plies + 1) // 2 if score > 0 else -(plies // 2)}"
+    return f"cp {score}"
+
+
+def searchLimits(tokens, whiteToMove, report=None):
+    """(depth, seconds, infinite) from the arguments of a go command. A limit whose
+    value is not a number is skipped and passed to report(message), if given.
+    Negative times count as zero; depth and movestogo are at least 1."""
+    values = {}
+    infinite = False
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == "infinite":
+            infinite = True
+        elif tokens[i] in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo") and i + 1 < len(tokens):
+            try:
+                values[tokens[i]] = max(0, int(tokens[i + 1]))
+            except ValueError:
+                if report is not None:
+                    report(f"ignoring {tokens[i]} {tokens[i + 1]}: not a number")
+            i += 1
+        i += 1
+    if "depth" in values:
+        values["depth"] = max(1, values["depth"])
+    if "movestogo" in values:
+        values["movestogo"] = max(1, values["movestogo"])
+    depth = values.get("depth")
+    if "movetime" in values:
+        return depth, values["movetime"] / 1000, False
+    remaining = values.get("wtime" if whiteToMove else "btime")
+    if remaining is not None:
+        increment = values.get("winc" if whiteToMove else "binc", 0)
+        budget = remaining / values.get("movestogo", DEFAULT_MOVES_TO_GO) + increment * 3 // 4
+        budget = max(1, min(budget, remaining - MOVE_OVERHEAD_MS))
+        return depth, budget / 1000, False
+    # A bare go searches until stop, like go infinite
+    return depth, None, infinite or depth is None
+
+
+class UciEngine():
+    def __init__(self, output=None, backend="list", book=None, tablebases=None):
+        self.output = output or sys.stdout
+        self.outputLock = threading.Lock()
+        self.gs = GameState(backend)
+        self.analyzer = Analyzer(book=book, tablebases=tablebases)
+        self.fen = START_FEN
+        self.played = []  # UCI moves played on self.gs since self.fen
+        self.stopEvent = threading.Event()
+        self.searchThread = None
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        """Runs one command line. Returns False after quit."""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.analyzer.tt.clear()
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(arguments)
+        elif command == "go":
+            self.stopSearch()
+            self.startSearch(*searchLimits(arguments, self.gs.whiteToMove,
+                                           lambda message: self.send(f"info string {message}")))
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        else:
+            logger.debug("Ignoring UCI command: %s", line.strip())
+        return True
+
+    def run(self, input=None):
+        """Reads commands until quit or end of input."""
+        input = input or sys.stdin
+        while True:
+            line = input.readline()
+            if not line or not self.handle(line):
+                break
+        self.stopSearch()
+
+    def setPosition(self, arguments):
+        if "moves" in arguments:
+            split = arguments.index("moves")
+            setup, moves = arguments[:split], arguments[split + 1:]
+        else:
+            setup, moves = arguments, []
+        if setup[:1] == ["fen"]:
+            fen = " ".join(setup[1:])
+        elif setup[:1] == ["startpos"]:
+            fen = START_FEN
+        else:
+            logger.warning("Invalid position command: position %s", " ".join(arguments))
+            return
+        previous = (self.fen, list(self.played))
+        if not self._reachPosition(fen, moves):
+            # Back to the last position that was set completely
+            self._reachPosition(*previous)
+
+    def _reachPosition(self, fen, moves):
+        """Sets self.gs to fen plus the UCI moves, reusing what is already played.
+        Returns False, after reporting it, on a bad FEN or an illegal move; the moves
+        before the illegal one are left played."""
+        if fen != self.fen:
+            try:
+                self.gs.loadFen(fen)
+            except ValueError as error:
+                self.send(f"info string {error}")
+                return False
+            self.fen = fen
+            self.played = []
+        common = 0
+        while common < min(len(moves), len(self.played)) and moves[common] == self.played[common]:
+            common += 1
+        while len(self.played) > common:
+            self.gs.undoMove()
+            self.played.pop()
+        for text in moves[common:]:
+            move = next((m for m in self.gs.getValidMoves() if m.getChessNotation() == text), None)
+            if move is None:
+                self.send(f"info string illegal move {text}")
+                return False
+            self.gs.makeMove(move)
+            self.played.append(text)
+        return True
+
+    def startSearch(self, depth, seconds, infinite):
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self._search, args=(depth, seconds, infinite), daemon=True)
+        self.searchThread.start()
+
+    def stopSearch(self):
+        """Stops the search in progress, if any, and waits for its bestmove."""
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+    def _search(self, depth, seconds, infinite):
+        start = time.perf_counter()
+
+        def onIteration(iteration, pv):
+            elapsed = time.perf_counter() - start
+            nodes = self.analyzer.nodes
+            self.send(f"info depth {iteration['depth']} score {scoreText(iteration['score'])} nodes {nodes} "
+                      f"nps {int(nodes / elapsed) if elapsed > 0 else 0} time {int(elapsed * 1000)} "
+                      f"pv {' '.join(iteration['pv'])}")
+
+        result = self.analyzer.analyze(self.gs, depth if depth is not None else MAX_PLY, seconds,
+                                       onIteration=onIteration, shouldStop=self.stopEvent.is_set)
+        if infinite:
+            # go infinite reports its move only when told to stop
+            self.stopEvent.wait()
+        if result.bestMove is None:
+            self.send("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.send(f"bestmove {result.bestMove.getChessNotation()} ponder {result.pv[1].getChessNotation()}")
+        else:
+            self.send(f"bestmove {result.bestMove.getChessNotation()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UCI chess engine over stdin/stdout")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    parser.add_argument("--book", help="opening book to consult first")
+    parser.add_argument("--tablebases", help="directory of endgame tables to consult first")
+    args = parser.parse_args(argv)
+    book = tablebases = None
+    if args.book:
+        from .OpeningBook import OpeningBook
+        book = OpeningBook(args.book)
+    if args.tablebases:
+        from .Tablebase import Tablebases
+        tablebases = Tablebases(args.tablebases)
+    UciEngine(backend=args.backend, book=book, tablebases=tablebases).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
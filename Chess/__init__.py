@@ -0,0 +1,52 @@
+"""Headless chess engine.
+
+    import Chess
+    gs = Chess.GameState()
+    result = Chess.analyze(gs, depth=4)
+
+    python -m Chess analyze --fen "<fen>" --depth 5
+    python -m Chess perft perft --depth 4
+    python -m Chess play
+
+Importing the package loads nothing but this file: submodules and the names
+below are imported on first use, and pygame is only ever imported by ChessMain
+and BoardRenderer.
+
+The modules import each other relatively (from .ChessEngine import ...), so they
+are run through the package, python -m Chess <command>, rather than as scripts;
+the package never touches sys.path or the import machinery.
+"""
+import importlib
+
+SUBMODULES = ("ChessEngine", "BitboardEngine", "Analyzer", "Perft", "PgnReader", "BatchAnalysis", "GameArchive",
+              "OpeningBook", "Tablebase", "PositionEncoder", "Instrumentation", "AnalysisWorker", "BoardRenderer",
+              "ChessMain", "UciEngine", "AnalysisServer",
+              "GameReview")
+
+# Public names and the submodule that defines them. Classes named like their module
+# (Analyzer, GameArchive, OpeningBook) are reached through the module: Chess.Analyzer.Analyzer.
+_EXPORTS = {
+    "GameState": "ChessEngine", "Move": "ChessEngine", "CastleRights": "ChessEngine", "START_FEN": "ChessEngine",
+    "AnalysisResult": "Analyzer", "analyze": "Analyzer", "evaluate": "Analyzer",
+    "readGames": "PgnReader", "resolveSan": "PgnReader", "moveToSan": "PgnReader",
+    "analyzeBatch": "BatchAnalysis",
+    "GameArchiveWriter": "GameArchive",
+    "Tablebases": "Tablebase", "probe": "Tablebase",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    elif name in SUBMODULES:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | set(SUBMODULES))
@@ -0,0 +1,90 @@
+"""Command line entry point: python -m Chess <command> [options]
+
+    analyze    search one position (FEN plus optional moves)
+    perft      move generator node counts and benchmarks   (Perft.py)
+    pgn        import a PGN file and report throughput     (PgnReader.py)
+    batch      analyse a game or position file on all cores (BatchAnalysis.py)
+    archive    binary game archives                        (GameArchive.py)
+    book       opening books                               (OpeningBook.py)
+    tablebase  endgame tablebases                          (Tablebase.py)
+    encode     positions as NumPy planes for model training (PositionEncoder.py)
+    uci        UCI engine over stdin/stdout for chess GUIs (UciEngine.py)
+    server     HTTP/JSON analysis service for index.html   (AnalysisServer.py)
+    review     classify every move of PGN games            (GameReview.py)
+    play       the pygame board                            (ChessMain.py)
+
+Only the module behind the chosen command is imported, so pygame is loaded by play alone.
+"""
+import argparse
+import importlib
+import sys
+
+# Command -> module whose main(argv) handles it
+COMMANDS = {"perft": "Perft", "pgn": "PgnReader", "batch": "BatchAnalysis", "archive": "GameArchive",
+            "book": "OpeningBook", "tablebase": "Tablebase", "encode": "PositionEncoder",
+            "uci": "UciEngine", "server": "AnalysisServer",
+            "review": "GameReview"}
+
+
+def analyzeCommand(argv):
+    parser = argparse.ArgumentParser(prog="python -m Chess analyze", description="Search one position")
+    parser.add_argument("--fen", help="start position (default: the initial position)")
+    parser.add_argument("--moves", nargs="*", default=[], help="moves to play first, e.g. e2e4 e7e5")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--movetime", type=float, help="seconds to search")
+    parser.add_argument("--backend", choices=("list", "bitboard"), default="list")
+    parser.add_argument("--book", help="opening book to consult first")
+    parser.add_argument("--tablebases", help="directory of endgame tables to consult first")
+    args = parser.parse_args(argv)
+
+    from .Analyzer import Analyzer
+    from .ChessEngine import GameState
+    gs = GameState(args.backend)
+    if args.fen:
+        gs.loadFen(args.fen)
+    for text in args.moves:
+        move = next((m for m in gs.getValidMoves() if m.getChessNotation() == text), None)
+        if move is None:
+            parser.error(f"illegal move: {text}")
+        gs.makeMove(move)
+    book = tablebases = None
+    if args.book:
+        from .OpeningBook import OpeningBook
+        book = OpeningBook(args.book)
+    if args.tablebases:
+        from .Tablebase import Tablebases
+        tablebases = Tablebases(args.tablebases)
+    depth = args.depth if args.depth is not None or args.movetime is not None else 4
+    result = Analyzer(book=book, tablebases=tablebases).analyze(gs, depth, args.movetime)
+    for iteration in result.iterations:
+        print(f"depth {iteration['depth']:2} score {iteration['score']:7} nodes {iteration['nodes']:9} "
+              f"nps {iteration['nps']:8,.0f} tt {iteration['ttHitRate']:4.0%} pv {' '.join(iteration['pv'])}")
+    source = " (book)" if result.fromBook else " (tablebase)" if result.fromTablebase else ""
+    print(f"bestmove {result.bestMove.getChessNotation() if result.bestMove else '(none)'} score {result.score}{source}")
+    return 0
+
+
+def playCommand(argv):
+    argparse.ArgumentParser(prog="python -m Chess play", description="Play on the pygame board").parse_args(argv)
+    from .ChessMain import main as play
+    play()
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help") or argv[0] not in COMMANDS and argv[0] not in ("analyze", "play"):
+        print(__doc__.strip())
+        return 0 if argv and argv[0] in ("-h", "--help") else 2
+    command, rest = argv[0], argv[1:]
+    if command == "analyze":
+        return analyzeCommand(rest)
+    if command == "play":
+        return playCommand(rest)
+    name = COMMANDS[command]
+    module = importlib.import_module("." + name, __package__)
+    return module.main(rest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())